@@ -0,0 +1,192 @@
+"""
+Closed-loop load generator: N workers issue requests back to back until the scenario's
+request budget is spent, recording per-request latency and the server's peak RSS.
+
+Latency and throughput count only responses with one of the scenario's expected statuses.
+Anything else (a 429, a 500) is counted under its status and timed separately, so a run
+that fails fast cannot pass for a fast run.
+"""
+import asyncio
+import os
+import resource
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+# A request factory gets (client, sequence number) and returns the response
+RequestFn = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+@dataclass
+class Scenario:
+    name: str
+    request: RequestFn
+    requests: int = 200
+    concurrency: int = 10
+    warmup: int = 10
+    expected_statuses: Tuple[int, ...] = (200,)
+
+
+# --- 1. Memory ---
+def rss_bytes(pid: Optional[int] = None) -> Optional[int]:
+    """Current resident set size of a process (Linux /proc); None where unavailable."""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None:
+        # Lifetime peak rather than current, but better than nothing (kB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    return None
+
+
+class RssSampler:
+    """Polls RSS in the background; `peak` is the highest value seen while running."""
+
+    def __init__(self, pid: Optional[int] = None):
+        self.pid = pid
+        self.peak: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _sample(self):
+        value = rss_bytes(self.pid)
+        if value is not None:
+            self.peak = max(self.peak or 0, value)
+
+    async def _run(self):
+        while True:
+            self._sample()
+            await asyncio.sleep(RSS_SAMPLE_INTERVAL)
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._sample()
+
+
+# --- 2. Statistics ---
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))  # ceil without importing math
+    return sorted_values[int(rank) - 1]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "p50": ms(percentile(ordered, 50)),
+        "p95": ms(percentile(ordered, 95)),
+        "p99": ms(percentile(ordered, 99)),
+        "mean": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        "max": ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+def summarize(latencies: List[float], unexpected_latencies: List[float], elapsed: float, statuses: Counter,
+              errors: int, concurrency: int, peak_rss: Optional[int]) -> dict:
+    """latencies: responses with an expected status; unexpected_latencies: every other response."""
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "errors": errors,  # Transport failures: no response at all
+        "unexpected_status": len(unexpected_latencies),
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": latency_summary(latencies),
+        "unexpected_latency_ms": latency_summary(unexpected_latencies) if unexpected_latencies else None,
+        "peak_rss_mb": round(peak_rss / 2**20, 1) if peak_rss else None,
+    }
+
+
+# --- 3. Running ---
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, server_pid: Optional[int] = None) -> dict:
+    for i in range(scenario.warmup):
+        await scenario.request(client, i)
+
+    latencies: List[float] = []
+    unexpected_latencies: List[float] = []
+    statuses: Counter = Counter()
+    errors = 0
+    next_seq = scenario.warmup
+    end_seq = scenario.warmup + scenario.requests
+
+    async def worker():
+        nonlocal next_seq, errors
+        while next_seq < end_seq:
+            seq, next_seq = next_seq, next_seq + 1
+            started = time.perf_counter()
+            try:
+                response = await scenario.request(client, seq)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            elapsed = time.perf_counter() - started
+            statuses[response.status_code] += 1
+            if response.status_code in scenario.expected_statuses:
+                latencies.append(elapsed)
+            else:
+                unexpected_latencies.append(elapsed)
+
+    async with RssSampler(server_pid) as sampler:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(scenario.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return summarize(latencies, unexpected_latencies, elapsed, statuses, errors, scenario.concurrency, sampler.peak)
+
+
+def status_mix(result: dict) -> Dict[str, float]:
+    """Share of each status code (and of transport errors) in a run, to the percent."""
+    counts = dict(result.get("status_codes", {}))
+    if result.get("errors"):
+        counts["error"] = result["errors"]
+    total = sum(counts.values())
+    return {code: round(count / total * 100) for code, count in sorted(counts.items())} if total else {}
+
+
+def compare(current: Dict[str, dict], baseline: Dict[str, dict]) -> List[str]:
+    """
+    One line per scenario present in both runs: p50/p95/p99 and throughput change. Runs whose
+    status mixes differ measured different work, so those are reported as not comparable.
+    """
+    lines = []
+    for name, result in current.items():
+        before = baseline.get(name)
+        if not before or "latency_ms" not in before or "latency_ms" not in result:
+            continue
+        old_mix, new_mix = status_mix(before), status_mix(result)
+        if old_mix != new_mix:
+            lines.append(f"{name}: not compared, status mix differs ({_mix(old_mix)} → {_mix(new_mix)})")
+            continue
+        parts = []
+        for key in ("p50", "p95", "p99"):
+            old, new = before["latency_ms"][key], result["latency_ms"][key]
+            parts.append(f"{key} {old}→{new} ms ({_change(old, new)})")
+        old, new = before["throughput_rps"], result["throughput_rps"]
+        parts.append(f"{old}→{new} req/s ({_change(old, new)})")
+        lines.append(f"{name}: " + ", ".join(parts))
+    return lines
+
+
+def _mix(mix: Dict[str, float]) -> str:
+    return ", ".join(f"{code}: {share}%" for code, share in mix.items()) or "no responses"
+
+
+def _change(old: float, new: float) -> str:
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
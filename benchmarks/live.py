@@ -0,0 +1,204 @@
+"""
+Measures live sync fan-out: how long an op takes to reach every other session on a note, and
+what each open session costs in memory.
+
+Usage:
+    python -m benchmarks.live [--rooms 50] [--sessions-per-room 20] [--messages 200] [--output results.json]
+    python -m benchmarks.live --base-url http://localhost:8000 --server-pid PID [--sessions-per-room 50]
+
+Without --base-url the LiveHub is driven in-process with fake sockets: this isolates the
+hub (encode once, queue per session) from the network, and RSS growth per session is this
+process's. With it, real WebSockets (the `websockets` package) connect to a running server
+as a seeded bench user (see benchmarks.run) and all sessions share one note; --server-pid
+reads that server's RSS, which gives the number of sessions a worker can hold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+
+from benchmarks import seed as seeding
+from benchmarks.harness import percentile, rss_bytes
+
+
+def _latency_ms(latencies: List[float]) -> dict:
+    ordered = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "samples": len(ordered),
+        "p50": ms(percentile(ordered, 50)),
+        "p95": ms(percentile(ordered, 95)),
+        "p99": ms(percentile(ordered, 99)),
+        "max": ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+def _op_message(page_id: int, element_id: str) -> dict:
+    element = {"id": element_id, "tool": "pen", "points": [[1.0, 2.0, 0.5], [3.0, 4.0, 0.5], [5.0, 6.0, 0.5]]}
+    return {"type": "ops", "page_id": page_id, "ops": [{"op": "add_element", "element": element}]}
+
+
+# --- 1. In-process hub ---
+class _FakeSocket:
+    """Stands in for a WebSocket: records when each op reaches it."""
+
+    def __init__(self, sent_at: Dict[str, float], latencies: List[float]):
+        self.sent_at = sent_at
+        self.latencies = latencies
+
+    async def send_text(self, text: str):
+        message = json.loads(text)
+        if message["type"] == "ops":
+            self.latencies.append(time.perf_counter() - self.sent_at[message["ops"][0]["element"]["id"]])
+
+
+async def bench_hub(args) -> dict:
+    from services import live
+
+    hub = live.LiveHub(live.InProcessLiveBackend())
+    await hub.backend.start(hub._deliver)  # No flush task: this measures fan-out, not persistence
+    sent_at: Dict[str, float] = {}
+    latencies: List[float] = []
+
+    rss_before = rss_bytes()
+    connections, senders = [], []
+    for room in range(args.rooms):
+        for _ in range(args.sessions_per_room):
+            conn = live.LiveConnection(_FakeSocket(sent_at, latencies), note_id=room, user_id=room)
+            await hub.join(conn)
+            connections.append(conn)
+            senders.append(asyncio.create_task(conn.run_sender()))
+    await asyncio.sleep(0)
+    rss_open = rss_bytes()
+
+    expected = args.rooms * args.messages * (args.sessions_per_room - 1)
+    started = time.perf_counter()
+    for i in range(args.messages):
+        for room in range(args.rooms):
+            origin = connections[room * args.sessions_per_room]
+            element_id = uuid.uuid4().hex
+            message = {**_op_message(page_id=room, element_id=element_id), "user_id": room, "origin": origin.id}
+            sent_at[element_id] = time.perf_counter()
+            await hub.backend.publish(room, message)
+        await asyncio.sleep(0)  # Let the senders drain, as a live server would between messages
+    while len(latencies) < expected - hub.resyncs and time.perf_counter() - started < args.timeout:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+
+    for task in senders:
+        task.cancel()
+    await asyncio.gather(*senders, return_exceptions=True)
+
+    sessions = len(connections)
+    return {
+        "mode": "in_process",
+        "sessions": sessions,
+        "deliveries": len(latencies),
+        "resyncs": hub.resyncs,
+        "deliveries_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "fanout_latency_ms": _latency_ms(latencies),
+        "rss_per_session_kb": round((rss_open - rss_before) / sessions / 1024, 2) if rss_before and rss_open else None,
+    }
+
+
+# --- 2. Running server ---
+async def bench_server(args) -> dict:
+    try:
+        import websockets
+    except ImportError:
+        raise SystemExit("--base-url needs the websockets package (pip install websockets)")
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+        response = await client.post("/auth/login", data={"username": args.email, "password": seeding.PASSWORD})
+        response.raise_for_status()
+        token = response.json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        response = await client.get("/notes", headers=headers, params={"limit": 1})
+        response.raise_for_status()
+        note_id = response.json()["items"][0]["id"]
+        response = await client.get(f"/notes/{note_id}", headers=headers)
+        response.raise_for_status()
+        page_id = response.json()["pages"][0]["id"]
+
+    url = args.base_url.replace("http", "ws", 1) + f"/notes/{note_id}/live?token={token}"
+    sent_at: Dict[str, float] = {}
+    latencies: List[float] = []
+    acks: List[float] = []
+
+    rss_before = rss_bytes(args.server_pid) if args.server_pid else None
+    sockets = [await websockets.connect(url, max_queue=None) for _ in range(args.sessions_per_room)]
+    await asyncio.sleep(0.5)  # Presence messages settle
+    rss_open = rss_bytes(args.server_pid) if args.server_pid else None
+
+    async def listen(ws, is_sender: bool):
+        async for text in ws:
+            message = json.loads(text)
+            if message["type"] == "ops":
+                latencies.append(time.perf_counter() - sent_at[message["ops"][0]["element"]["id"]])
+            elif message["type"] == "ack" and is_sender:
+                acks.append(time.perf_counter() - sent_at[message["seq"]])
+
+    listeners = [asyncio.create_task(listen(ws, i == 0)) for i, ws in enumerate(sockets)]
+    expected = args.messages * (len(sockets) - 1)
+    started = time.perf_counter()
+    for seq in range(args.messages):
+        element_id = uuid.uuid4().hex
+        sent_at[element_id] = sent_at[seq] = time.perf_counter()
+        await sockets[0].send(json.dumps({**_op_message(page_id, element_id), "seq": seq}))
+        await asyncio.sleep(args.interval)
+    while len(latencies) < expected and time.perf_counter() - started < args.timeout:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    for ws in sockets:
+        await ws.close()
+    await asyncio.gather(*listeners, return_exceptions=True)
+
+    sessions = len(sockets)
+    return {
+        "mode": "server",
+        "note_id": note_id,
+        "sessions": sessions,
+        "deliveries": len(latencies),
+        "missing": expected - len(latencies),
+        "deliveries_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "ack_latency_ms": _latency_ms(acks),
+        "fanout_latency_ms": _latency_ms(latencies),
+        "rss_per_session_kb": round((rss_open - rss_before) / sessions / 1024, 2) if rss_before and rss_open else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=50, help="Notes with open sessions (in-process only)")
+    parser.add_argument("--sessions-per-room", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200, help="Ops messages sent per room")
+    parser.add_argument("--interval", type=float, default=0.005, help="Seconds between messages (server mode)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--base-url", help="Connect to a running server instead of the in-process hub")
+    parser.add_argument("--server-pid", type=int, help="PID of that server, for RSS per session")
+    parser.add_argument("--email", default="bench-0@bench.local", help="Seeded bench user to connect as")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(bench_server(args) if args.base_url else bench_hub(args))
+    latency = result["fanout_latency_ms"]
+    print(f"📡 {result['sessions']} sessions, {result['deliveries']} deliveries, {result['deliveries_per_s']}/s")
+    print(f"   fan-out p50 {latency['p50']} ms   p95 {latency['p95']} ms   p99 {latency['p99']} ms")
+    if result["rss_per_session_kb"] is not None:
+        print(f"   ~{result['rss_per_session_kb']} KB RSS per session")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as out:
+            json.dump({"params": vars(args), "result": result}, out, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Load-tests the API hot paths and writes latency percentiles, throughput and peak RSS to JSON.
+
+Usage:
+    python -m benchmarks.run [--scenarios login,list_notes,get_note,first_page,patch_page,create_pdf_note]
+                             [--requests 200] [--concurrency 10] [--output results.json]
+                             [--base-url http://localhost:8000 --server-pid PID]
+                             [--reseed] [--compare previous.json] [--admission-control]
+
+The database comes from DATABASE_URL as usual: a local Postgres, or SQLite
+(sqlite+aiosqlite:///bench.db) for a quick run. Without --base-url the app is driven
+in-process over httpx's ASGI transport; with it, requests go to an already running server
+(e.g. uvicorn main:app) and --server-pid lets the sampler read that server's RSS.
+
+Rate limits and import caps would turn most of a load test into 429s, so the in-process app
+runs with admission control off unless --admission-control is given. Start an external
+server with ADMISSION_CONTROL=false for the same reason.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks import seed as seeding
+from benchmarks.harness import Scenario, compare, run_scenario
+from database import Base, dispose_engines, engine, settings
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+SCENARIOS = ["login", "list_notes", "get_note", "first_page", "patch_page", "create_pdf_note"]
+
+
+# --- 1. Scenarios ---
+def build_scenarios(data: seeding.SeededData, tokens: Dict[str, str], args) -> Dict[str, Scenario]:
+    rng = random.Random(args.seed)
+    emails = data.emails
+    headers = {email: {"Authorization": f"Bearer {tokens[email]}"} for email in emails}
+    overlay = seeding.make_overlay(rng, args.strokes_per_page, args.points_per_stroke)
+    with open(data.pdf_path, "rb") as pdf:
+        pdf_bytes = pdf.read()
+
+    def user(seq: int) -> str:
+        return emails[seq % len(emails)]
+
+    async def login(client, seq):
+        return await client.post("/auth/login", data={"username": user(seq), "password": data.password})
+
+    async def list_notes(client, seq):
+        return await client.get("/notes", params={"limit": 20}, headers=headers[user(seq)])
+
+    async def get_note(client, seq):
+        email = user(seq)
+        return await client.get(f"/notes/{rng.choice(data.notes[email])}", headers=headers[email])
+
+    async def first_page(client, seq):
+        # Time to first page: note metadata, then the body of the page being shown
+        email = user(seq)
+        note_id = rng.choice(data.notes[email])
+        response = await client.get(f"/notes/{note_id}", headers=headers[email])
+        if response.status_code != 200:
+            return response
+        return await client.get(f"/notes/{note_id}/pages", params={"from": 1, "to": 1}, headers=headers[email])
+
+    async def patch_page(client, seq):
+        email = user(seq)
+        return await client.patch(f"/notes/pages/{rng.choice(data.pages[email])}",
+                                  json={"overlay_data": overlay}, headers=headers[email])
+
+    async def create_pdf_note(client, seq):
+        # A trailing comment makes every upload unique, so content-addressed dedup does not
+        # turn the scenario into a cache hit (pass --pdf-dedup to measure that path instead)
+        body = pdf_bytes if args.pdf_dedup else pdf_bytes + f"\n%bench-{seq}-{time.time_ns()}\n".encode()
+        return await client.post(
+            "/notes",
+            data={"title": f"Bench upload {seq}", "back_type": "pdf"},
+            files={"file": ("bench.pdf", body, "application/pdf")},
+            headers=headers[user(seq)],
+        )
+
+    def scenario(name, request, requests=args.requests, concurrency=args.concurrency, warmup=args.warmup):
+        return Scenario(name=name, request=request, requests=requests, concurrency=concurrency, warmup=warmup)
+
+    return {
+        "login": scenario("login", login),
+        "list_notes": scenario("list_notes", list_notes),
+        "get_note": scenario("get_note", get_note),
+        "first_page": scenario("first_page", first_page),
+        "patch_page": scenario("patch_page", patch_page),
+        # Rendering is orders of magnitude slower than the other paths; keep the budget small
+        "create_pdf_note": scenario("create_pdf_note", create_pdf_note,
+                                    requests=args.pdf_requests, concurrency=min(args.concurrency, 4), warmup=1),
+    }
+
+
+def skip_reason(name: str) -> Optional[str]:
+    if name == "create_pdf_note" and not shutil.which("pdftoppm"):
+        return "poppler (pdftoppm) is not installed"
+    return None
+
+
+# --- 2. Setup ---
+async def prepare(args) -> seeding.SeededData:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    pdf_path = os.path.join(RESULTS_DIR, "bench.pdf")
+    data = await seeding.load()
+    if args.reseed or len(data.emails) < args.users:
+        config = seeding.SeedConfig(
+            users=args.users, notes_per_user=args.notes_per_user, pages_per_note=args.pages_per_note,
+            strokes_per_page=args.strokes_per_page, points_per_stroke=args.points_per_stroke,
+            pdf_pages=args.pdf_pages, seed=args.seed,
+        )
+        print(f"🌱 Seeding {config.users} users x {config.notes_per_user} notes x {config.pages_per_note} pages...")
+        data = await seeding.seed(config, pdf_path)
+    elif not os.path.exists(pdf_path):
+        seeding.make_pdf(pdf_path, args.pdf_pages)
+    data.pdf_path = pdf_path
+    return data
+
+
+async def login_all(client: httpx.AsyncClient, data: seeding.SeededData) -> Dict[str, str]:
+    tokens = {}
+    for email in data.emails:
+        response = await client.post("/auth/login", data={"username": email, "password": data.password})
+        response.raise_for_status()
+        tokens[email] = response.json()["access_token"]
+    return tokens
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- 3. Main ---
+async def benchmark(args) -> dict:
+    data = await prepare(args)
+    selected = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(selected) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results: Dict[str, dict] = {}
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as client:
+            await _run_all(client, data, selected, args, results, args.server_pid)
+    else:
+        import main  # Imported late: the app reads its settings at import time
+        from services import admission
+
+        admission.ADMISSION_CONTROL = args.admission_control
+        async with main.lifespan(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+                await _run_all(client, data, selected, args, results, None)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "mode": "external" if args.base_url else "in-process",
+            "base_url": args.base_url,
+            "admission_control": None if args.base_url else args.admission_control,  # Server's own setting if external
+            "seed": {
+                # Counts come from the database: an existing seed is reused unless --reseed
+                "users": len(data.emails),
+                "notes": sum(len(ids) for ids in data.notes.values()),
+                "pages": sum(len(ids) for ids in data.pages.values()),
+                "strokes_per_page": args.strokes_per_page,
+                "points_per_stroke": args.points_per_stroke,
+                "pdf_pages": args.pdf_pages,
+            },
+        },
+        "scenarios": results,
+    }
+
+
+async def _run_all(client, data, selected: List[str], args, results: Dict[str, dict], server_pid: Optional[int]):
+    tokens = await login_all(client, data)
+    scenarios = build_scenarios(data, tokens, args)
+    for name in selected:
+        reason = skip_reason(name)
+        if reason:
+            print(f"⏭️  {name}: skipped ({reason})")
+            results[name] = {"skipped": reason}
+            continue
+        print(f"🏃 {name}...")
+        results[name] = result = await run_scenario(client, scenarios[name], server_pid)
+        latency = result["latency_ms"]
+        print(f"   p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, "
+              f"{result['throughput_rps']} req/s, {result['errors']} errors, peak RSS {result['peak_rss_mb']} MB")
+        if result["unexpected_status"]:
+            print(f"   ⚠️  {result['unexpected_status']} unexpected responses (status codes {result['status_codes']}), "
+                  f"not counted in latency or throughput")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--pdf-requests", type=int, default=8, help="Measured uploads for create_pdf_note")
+    parser.add_argument("--pdf-dedup", action="store_true", help="Upload identical bytes (measures the dedup path)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--base-url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--server-pid", type=int, help="PID of that server, for its peak RSS")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="Previous results file to diff against")
+    parser.add_argument("--reseed", action="store_true", help="Recreate the bench data even if it exists")
+    parser.add_argument("--admission-control", action="store_true",
+                        help="Keep rate limits and import caps on (in-process only)")
+    parser.add_argument("--users", type=int, default=seeding.SeedConfig.users)
+    parser.add_argument("--notes-per-user", type=int, default=seeding.SeedConfig.notes_per_user)
+    parser.add_argument("--pages-per-note", type=int, default=seeding.SeedConfig.pages_per_note)
+    parser.add_argument("--strokes-per-page", type=int, default=seeding.SeedConfig.strokes_per_page)
+    parser.add_argument("--points-per-stroke", type=int, default=seeding.SeedConfig.points_per_stroke)
+    parser.add_argument("--pdf-pages", type=int, default=seeding.SeedConfig.pdf_pages)
+    parser.add_argument("--seed", type=int, default=seeding.SeedConfig.seed)
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            return await benchmark(args)
+        finally:
+            await dispose_engines()
+
+    print(f"🗄️  Database: {settings.url.split('@')[-1]}")
+    report = asyncio.run(run())
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as out:
+        json.dump(report, out, indent=2)
+    print(f"✅ Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = json.load(previous)
+        for line in compare(report["scenarios"], baseline.get("scenarios", {})):
+            print("   " + line)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Seeds the database with benchmark data: users with many notes, pages carrying large
+overlay_data, and a multi-page PDF on disk for the upload scenario.
+
+Everything it creates belongs to users named bench-<n>@bench.local, so it can share a
+database with real data and be re-seeded without touching anything else.
+"""
+import os
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from sqlalchemy import delete, select
+
+import models
+import security
+from database import AsyncSessionLocal
+from services import content_store
+
+EMAIL_DOMAIN = "bench.local"
+PASSWORD = "bench-password"
+
+
+@dataclass
+class SeedConfig:
+    users: int = 5
+    notes_per_user: int = 100
+    pages_per_note: int = 4
+    strokes_per_page: int = 100   # overlay_data size driver: 100 strokes x 30 points is ~70 KB of JSON
+    points_per_stroke: int = 30
+    pdf_pages: int = 10
+    seed: int = 1234
+
+
+@dataclass
+class SeededData:
+    emails: List[str]
+    password: str
+    notes: Dict[str, List[int]] = field(default_factory=dict)  # email -> note ids
+    pages: Dict[str, List[int]] = field(default_factory=dict)  # email -> page ids
+    pdf_path: str = ""
+
+
+def bench_email(n: int) -> str:
+    return f"bench-{n}@{EMAIL_DOMAIN}"
+
+
+def make_overlay(rng: random.Random, strokes: int, points: int) -> dict:
+    """An overlay shaped like a page of handwriting: strokes of jittered polyline points."""
+    result = []
+    for i in range(strokes):
+        x, y = rng.uniform(0, 800), rng.uniform(0, 1100)
+        path = []
+        for _ in range(points):
+            x += rng.uniform(-4, 4)
+            y += rng.uniform(-4, 4)
+            path.append([round(x, 2), round(y, 2), round(rng.uniform(0.2, 1.0), 3)])
+        result.append({
+            "id": f"s{i}",
+            "tool": "pen",
+            "color": rng.choice(["#000000", "#1f4fd1", "#d1301f"]),
+            "width": rng.choice([1.5, 2, 3]),
+            "points": path,
+        })
+    return {"strokes": result, "highlights": [], "text": []}
+
+
+def make_pdf(path: str, pages: int):
+    """Writes a multi-page PDF with some text and lines per page (needs Pillow)."""
+    from PIL import Image, ImageDraw
+
+    images = []
+    for n in range(1, pages + 1):
+        image = Image.new("RGB", (1240, 1754), "white")  # A4 at 150 dpi
+        draw = ImageDraw.Draw(image)
+        draw.text((100, 100), f"Benchmark page {n}", fill="black")
+        for y in range(200, 1700, 40):
+            draw.line((100, y, 1140, y), fill=(180, 180, 220), width=2)
+        images.append(image)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    images[0].save(path, "PDF", save_all=True, append_images=images[1:], resolution=150)
+    for image in images:
+        image.close()
+
+
+async def _bench_user_ids(db) -> List[int]:
+    result = await db.execute(select(models.User.id).where(models.User.email.like(f"%@{EMAIL_DOMAIN}")))
+    return list(result.scalars().all())
+
+
+async def clear():
+    """Removes every bench user and everything they own, including uploaded page images."""
+    async with AsyncSessionLocal() as db:
+        user_ids = await _bench_user_ids(db)
+        if not user_ids:
+            return
+        note_ids = select(models.Note.id).where(models.Note.owner_id.in_(user_ids))
+
+        result = await db.execute(
+            select(models.Page.background_url, models.Page.renditions)
+            .where(models.Page.note_id.in_(note_ids))
+            .where(models.Page.background_type == "image")
+        )
+        files = content_store.page_files(row._asdict() for row in result)
+        result = await db.execute(
+            select(models.Note.source_digest)
+            .where(models.Note.owner_id.in_(user_ids))
+            .where(models.Note.source_digest.is_not(None))
+        )
+        digests = list(result.scalars().all())
+
+        page_ids = select(models.Page.id).where(models.Page.note_id.in_(note_ids))
+        # Explicit deletes rather than ON DELETE CASCADE: SQLite does not enforce foreign keys by default
+        await db.execute(delete(models.PageOverlayDelta).where(models.PageOverlayDelta.page_id.in_(page_ids)))
+        await db.execute(delete(models.Page).where(models.Page.note_id.in_(note_ids)))
+        await db.execute(delete(models.Note).where(models.Note.owner_id.in_(user_ids)))
+        await db.execute(delete(models.User).where(models.User.id.in_(user_ids)))
+        prefixes = [await content_store.release(db, digest) for digest in digests]
+        await db.commit()
+
+    for prefix in filter(None, prefixes):
+        await content_store.remove_files(prefix=prefix)
+    await content_store.remove_files(files=files)
+
+
+async def load() -> SeededData:
+    """Ids of the bench data already in the database (empty lists if there is none)."""
+    data = SeededData(emails=[], password=PASSWORD)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(models.User.email, models.Note.id, models.Page.id)
+            .join(models.Note, models.Note.owner_id == models.User.id)
+            .join(models.Page, models.Page.note_id == models.Note.id)
+            .where(models.User.email.like(f"%@{EMAIL_DOMAIN}"))
+            .order_by(models.User.id, models.Note.id, models.Page.id)
+        )
+        for email, note_id, page_id in result:
+            if email not in data.notes:
+                data.emails.append(email)
+                data.notes[email] = []
+                data.pages[email] = []
+            if not data.notes[email] or data.notes[email][-1] != note_id:
+                data.notes[email].append(note_id)
+            data.pages[email].append(page_id)
+    return data
+
+
+async def seed(config: SeedConfig, pdf_path: str) -> SeededData:
+    rng = random.Random(config.seed)
+    await clear()
+
+    hashed = security.get_password_hash(PASSWORD)  # One bcrypt call, shared by every bench user
+    data = SeededData(emails=[], password=PASSWORD)
+    for n in range(config.users):
+        email = bench_email(n)
+        async with AsyncSessionLocal() as db:
+            user = models.User(email=email, name=f"Bench User {n}", hashed_password=hashed, provider="email")
+            db.add(user)
+            await db.flush()
+
+            notes = []
+            for i in range(config.notes_per_user):
+                note = models.Note(title=f"Lecture {i} ({rng.choice(['Biology', 'Physics', 'History'])})",
+                                   owner_id=user.id, import_status="ready")
+                note.pages = [
+                    models.Page(
+                        page_number=p,
+                        content="",
+                        background_type="plain",
+                        overlay_data=make_overlay(rng, config.strokes_per_page, config.points_per_stroke),
+                    )
+                    for p in range(1, config.pages_per_note + 1)
+                ]
+                notes.append(note)
+            db.add_all(notes)
+            await db.commit()
+
+            data.emails.append(email)
+            data.notes[email] = [note.id for note in notes]
+            data.pages[email] = [page.id for note in notes for page in note.pages]
+        print(f"… seeded {email}: {config.notes_per_user} notes x {config.pages_per_note} pages")
+
+    make_pdf(pdf_path, config.pdf_pages)
+    data.pdf_path = pdf_path
+    return data
@@ -0,0 +1,148 @@
+"""
+Compares ways of turning pages with large overlays into a GET /notes/{id}/pages body.
+
+Usage: python -m benchmarks.serialization [--pages 10] [--strokes-per-page 2000]
+                                          [--points-per-stroke 60] [--repeat 5] [--output results.json]
+
+Every path starts from what Postgres sends for a JSONB column (its text form), so decoding
+is part of the cost wherever the path needs Python objects:
+  pydantic         driver json.loads, PageRangeResponse.model_validate, model_dump_json (FastAPI today)
+  pydantic_stdlib  same, but model_dump(mode="json") + json.dumps (older FastAPI / JSONResponse)
+  orjson           json.loads, then services.fast_json encoding (the SQLite / pending-delta path)
+  raw_jsonb        jsonb::text spliced into the body undecoded (the Postgres fast path)
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+import schemas
+from benchmarks import seed as seeding
+from services import fast_json
+
+
+def build_rows(pages: int, strokes: int, points: int, seed: int) -> List[SimpleNamespace]:
+    rng = random.Random(seed)
+    return [
+        SimpleNamespace(
+            id=n,
+            page_number=n,
+            background_type="plain",
+            background_url=None,
+            renditions=None,
+            overlay_json=json.dumps(seeding.make_overlay(rng, strokes, points)),  # As Postgres returns it
+            overlay_version=n,
+        )
+        for n in range(1, pages + 1)
+    ]
+
+
+RANGE_FIELDS = {"note_id": 1, "next_from": None}
+
+
+def _orm_range(rows):
+    pages = [
+        SimpleNamespace(
+            id=row.id, page_number=row.page_number, background_type=row.background_type,
+            background_url=row.background_url, renditions=row.renditions,
+            overlay_data=json.loads(row.overlay_json), overlay_version=row.overlay_version,
+        )
+        for row in rows
+    ]
+    return {**RANGE_FIELDS, "pages": pages}
+
+
+def pydantic_path(rows) -> bytes:
+    return schemas.PageRangeResponse.model_validate(_orm_range(rows)).model_dump_json().encode()
+
+
+def pydantic_stdlib_path(rows) -> bytes:
+    content = schemas.PageRangeResponse.model_validate(_orm_range(rows)).model_dump(mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def _fields(row) -> Dict:
+    return {"id": row.id, "page_number": row.page_number, "background_type": row.background_type,
+            "background_url": row.background_url, "renditions": row.renditions,
+            "overlay_version": row.overlay_version}
+
+
+def orjson_path(rows) -> bytes:
+    pages = [
+        fast_json.encode_page(_fields(row), fast_json.dumps(json.loads(row.overlay_json)))
+        for row in rows
+    ]
+    return fast_json.encode_with_pages(RANGE_FIELDS, pages)
+
+
+def raw_jsonb_path(rows) -> bytes:
+    pages = [fast_json.encode_page(_fields(row), row.overlay_json.encode()) for row in rows]
+    return fast_json.encode_with_pages(RANGE_FIELDS, pages)
+
+
+PATHS: Dict[str, Callable] = {
+    "pydantic": pydantic_path,
+    "pydantic_stdlib": pydantic_stdlib_path,
+    "orjson": orjson_path,
+    "raw_jsonb": raw_jsonb_path,
+}
+
+
+def measure(fn: Callable, rows, repeat: int) -> dict:
+    fn(rows)  # Warm-up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn(rows)
+        timings.append(time.perf_counter() - started)
+    median = statistics.median(timings)
+    return {
+        "median_ms": round(median * 1000, 2),
+        "min_ms": round(min(timings) * 1000, 2),
+        "body_bytes": len(body),
+        "mb_per_s": round(len(body) / median / 2**20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--strokes-per-page", type=int, default=2000)
+    parser.add_argument("--points-per-stroke", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=seeding.SeedConfig.seed)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    rows = build_rows(args.pages, args.strokes_per_page, args.points_per_stroke, args.seed)
+    overlay_mb = sum(len(row.overlay_json) for row in rows) / 2**20
+    print(f"📄 {args.pages} pages, {overlay_mb:.1f} MB of overlay JSON")
+
+    # All paths must produce the same document
+    reference = json.loads(pydantic_path(rows))
+    for name, fn in PATHS.items():
+        document = json.loads(fn(rows))
+        assert document == reference, f"{name} produced a different body"
+
+    results = {}
+    for name, fn in PATHS.items():
+        results[name] = result = measure(fn, rows, args.repeat)
+        print(f"   {name:16} {result['median_ms']:>9} ms   {result['mb_per_s']:>7} MB/s")
+
+    baseline = results["pydantic"]["median_ms"]
+    for name, result in results.items():
+        result["speedup_vs_pydantic"] = round(baseline / result["median_ms"], 1) if result["median_ms"] else None
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as out:
+            json.dump({"params": vars(args), "overlay_mb": round(overlay_mb, 1), "paths": results}, out, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,79 @@
-from fastapi import FastAPI, Depends, HTTPException
+import time
+_IMPORTS_STARTED = time.perf_counter()  # Before the heavy imports, for the startup profile
+
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.exc import OperationalError
 from contextlib import asynccontextmanager
 from starlette.middleware.sessions import SessionMiddleware
 from dotenv import load_dotenv
 import os
-import asyncio
-from database import engine, Base
+from database import engine, read_engine, dispose_engines, pool_stats, check_database, settings as db_settings
 import routers
+import security
+from services import admission, rasterizer, import_queue, overlay_buffer, live_hub, user_cache, OVERLAY_WRITE_BUFFER
+from services.static_files import UploadFiles
+from services.storage import LocalStorage, get_storage
+from services import metrics
 
 load_dotenv()
 
+startup_profile = metrics.startup_profile
+startup_profile.record("imports", time.perf_counter() - _IMPORTS_STARTED)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # --- STARTUP LOGIC ---
-    print("🚀 Starting up... Waiting for Database...")
-    
-    # RETRY LOGIC: Try connecting 5 times with a 2-second delay
-    for i in range(5):
-        try:
-            async with engine.begin() as conn:
-                # This line triggers the actual connection check
-                await conn.run_sync(Base.metadata.create_all)
-            print("✅ Database Connected & Tables Created!")
-            break # Success! Exit the loop
-        except (OSError, OperationalError, ConnectionRefusedError) as e:
-            print(f"⚠️ Database not ready yet (Attempt {i+1}/5)... waiting 2s")
-            if i == 4: # Last attempt
-                print("❌ Could not connect to DB after 5 attempts.")
-                raise e
-            await asyncio.sleep(2) # Non-blocking wait
+    # No DDL here: the schema is created by `python -m scripts.migrate` before workers start,
+    # and the database is not awaited either; /health/ready reports when it is reachable.
+    print("🚀 Starting up...")
+    app.state.accepting = True
+
+    if db_settings.migrate_on_startup:
+        from scripts.migrate import migrate
+        with startup_profile.phase("migrate"):
+            await migrate()
+    with startup_profile.phase("import_queue"):
+        await import_queue.start()
+    if OVERLAY_WRITE_BUFFER:
+        with startup_profile.phase("overlay_buffer"):
+            await overlay_buffer.start()
+    with startup_profile.phase("live_hub"):
+        await live_hub.start()
+    print(f"✅ Started in {startup_profile.summary()}")
 
     yield # App runs here
     
     # --- SHUTDOWN LOGIC ---
     print("🛑 Shutting down...")
-    await engine.dispose()
+    app.state.accepting = False  # Fail readiness so the load balancer drains us
+    await import_queue.stop()
+    await live_hub.stop()  # Writes pending live ops; before the buffer stops, since it flushes through it
+    await overlay_buffer.stop()  # Flushes buffered overlay saves before the pool goes away
+    rasterizer.shutdown_rasterizer()
+    security.password_pool.shutdown()
+    await admission.close_rate_store()
+    await dispose_engines()
     
 app = FastAPI(lifespan=lifespan)
 
+# Request metrics (latency, sizes, in-flight, SQL time per request), scraped at /metrics
+metrics.instrument_engine(engine)
+if read_engine is not engine:
+    metrics.instrument_engine(read_engine)
+metrics.registry.add_collector(lambda: metrics.stats_gauges("db_pool", pool_stats(), label="engine"))
+metrics.registry.add_collector(lambda: metrics.stats_gauges("user_cache", user_cache.stats()))
+metrics.registry.add_collector(lambda: metrics.stats_gauges("password_hashing", security.password_pool.stats()))
+metrics.registry.add_collector(lambda: metrics.stats_gauges("overlay_buffer", overlay_buffer.stats()))
+metrics.registry.add_collector(lambda: metrics.stats_gauges("import_queue", import_queue.stats()))
+metrics.registry.add_collector(lambda: metrics.stats_gauges("live", live_hub.stats()))
+metrics.registry.add_collector(lambda: metrics.stats_gauges("rate_limit", admission.rate_limit_stats(), label="limit"))
+metrics.registry.add_collector(lambda: metrics.stats_gauges("admission", admission.concurrency_stats(), label="limit"))
+# Rate limits and full import queues turn requests away before their bodies are read
+app.add_middleware(admission.AdmissionMiddleware, user_id=security.token_user_id)
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Add Session Middleware (REQUIRED for Google Auth)
 # This handles the temporary cookies needed during the login flow
 app.add_middleware(SessionMiddleware, secret_key=os.getenv("SESSION_SECRET_KEY"))
@@ -53,14 +87,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-upload_dir = os.getenv("UPLOAD_DIRECTORY", "static/uploads")
+storage = get_storage()
+if isinstance(storage, LocalStorage):
+    os.makedirs(storage.root, exist_ok=True)
 
-os.makedirs(upload_dir, exist_ok=True)
+    # Uploaded page images: long-lived cache headers, strong ETags, Range, optional X-Accel-Redirect.
+    # Mounted before /static so it takes precedence for /static/uploads/...
+    # (With STORAGE_BACKEND=s3 page URLs point at the bucket instead.)
+    app.mount("/static/uploads", UploadFiles(directory=storage.root), name="uploads")
 
 # Mount the "static" folder
 # This tells FastAPI: "If a URL starts with /static, look in the 'static' folder on disk"
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.exception_handler(admission.Rejected)
+async def admission_rejected(request: Request, exc: admission.Rejected):
+    # Import queue full or waited too long: tell the client when to come back
+    return admission.rejection_response(exc)
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to NeuroLearn API"}
@@ -69,6 +113,27 @@ def read_root():
 def health_check():
     return {"status": "active", "service": "neurolearn-api"}
 
+@app.get("/health/live")
+def liveness():
+    # The process is up and its event loop answers. Deliberately checks nothing else:
+    # a database outage should not get every worker restarted.
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    # Whether to route traffic here: the database pools can connect, and we are not shutting down
+    database = await check_database()
+    ready = getattr(app.state, "accepting", False) and all(database.values())
+    return JSONResponse(
+        {"status": "ready" if ready else "unavailable", "database": database},
+        status_code=200 if ready else 503,
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics_endpoint():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 app.include_router(routers.auth)
 app.include_router(routers.notes)
 app.include_router(routers.user)
\ No newline at end of file
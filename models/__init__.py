@@ -1,3 +1,3 @@
 from .user import User
-from .note import Note, Page
+from .note import Note, Page, PageOverlayDelta, PdfBlob
 from database import Base
\ No newline at end of file
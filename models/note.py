@@ -1,7 +1,15 @@
+from datetime import datetime, timezone
+
 from database import Base
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, func
-from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index, JSON, DDL, event, func
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy.dialects import postgresql
+
+# JSONB on Postgres, plain JSON elsewhere (lets the benchmarks run against SQLite)
+JSONB = JSON().with_variant(postgresql.JSONB(), "postgresql")
+TSVECTOR = Text().with_variant(postgresql.TSVECTOR(), "postgresql")
+
+SEARCH_CONFIG = "english"  # Postgres text search configuration for titles and page text
 
 class Note(Base):
     __tablename__ = "notes"
@@ -9,20 +17,87 @@ class Note(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Set by the app as well as the server: SQLite's CURRENT_TIMESTAMP text does not compare equal to
+    # a bound datetime, which would make the GET /notes cursor return its own row again
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now())
+    import_status = Column(String, default="ready")  # pending, running, ready, failed
+    source_digest = Column(String(64), ForeignKey("pdf_blobs.digest"), nullable=True, index=True)  # Shared page images, if any
+    version = Column(Integer, nullable=False, default=0, server_default="0")  # Bumped by writes to the note itself (title, status, page set)
+    search_vector = deferred(Column(TSVECTOR, nullable=True))  # to_tsvector(title), kept current by a trigger (Postgres)
     
     pages = relationship("Page", back_populates="note", order_by="Page.page_number", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Serves the keyset-paginated GET /notes listing
+        Index("ix_notes_owner_created_id", owner_id, created_at.desc(), id.desc()),
+        Index("ix_notes_search_vector", search_vector, postgresql_using="gin"),
+    )
+
 class Page(Base):
     __tablename__ = "pages"
 
     id = Column(Integer, primary_key=True, index=True)
     note_id = Column(Integer, ForeignKey("notes.id", ondelete="CASCADE"))
     page_number = Column(Integer, index=True)
-    content = Column(Text)
+    content = deferred(Column(Text))  # PDF text layer; only search reads it
     
     background_type = Column(String, default="plain")  # image, plain, ruled, grid
     background_url = Column(String, nullable=True)     # URL for image background
-    overlay_data = Column(JSONB, nullable=True)        # JSON data for overlays like highlights, drawings, etc.
+    renditions = Column(JSONB, nullable=True)          # Rendition name (thumb, screen, full) -> image URL
+    overlay_data = deferred(Column(JSONB, nullable=True))  # Overlays (highlights, drawings, ...); loaded per page on demand
+    overlay_format = Column(String, nullable=False, default="json", server_default="json")  # "packed" once any stroke is stored packed
+    overlay_version = Column(Integer, nullable=False, default=0, server_default="0")       # Bumped on every overlay write
+    overlay_base_version = Column(Integer, nullable=False, default=0, server_default="0")  # Version overlay_data already includes
+    search_vector = deferred(Column(TSVECTOR, nullable=True))  # to_tsvector(content), kept current by a trigger (Postgres)
+
+    note = relationship("Note", back_populates="pages")
+
+    __table_args__ = (
+        Index("ix_pages_note_id_page_number", note_id, page_number),
+        Index("ix_pages_search_vector", search_vector, postgresql_using="gin"),
+    )
+
+class PageOverlayDelta(Base):
+    """Pending overlay operations, folded into Page.overlay_data on compaction."""
+    __tablename__ = "page_overlay_deltas"
+
+    id = Column(Integer, primary_key=True)
+    page_id = Column(Integer, ForeignKey("pages.id", ondelete="CASCADE"), nullable=False)
+    version = Column(Integer, nullable=False)  # Page.overlay_version this delta produced
+    ops = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_page_overlay_deltas_page_version", page_id, version),
+    )
+
+class PdfBlob(Base):
+    """
+    A rendered PDF, keyed by the SHA-256 of its bytes. Notes created from identical
+    uploads share its page images; ref_count tracks how many notes point at it.
+    """
+    __tablename__ = "pdf_blobs"
+
+    digest = Column(String(64), primary_key=True)
+    status = Column(String, nullable=False, default="rendering")  # rendering, ready
+    prefix = Column(String, nullable=False)                       # Directory under the upload dir holding the images
+    page_count = Column(Integer, nullable=True)
+    pages = Column(JSONB, nullable=True)                          # [{page_number, background_url, renditions}, ...]
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# Full-text search vectors are recomputed by Postgres itself, and only when the source column
+# is written: overlay saves (the hot write path) never touch them.
+SEARCH_SOURCES = ((Note.__table__, "title"), (Page.__table__, "content"))
+
+def search_trigger_sql(table_name: str, column: str) -> str:
+    """The trigger keeping table_name.search_vector in sync with `column` (also used by scripts.migrate)."""
+    return (
+        f"CREATE TRIGGER {table_name}_search_vector_update "
+        f"BEFORE INSERT OR UPDATE OF {column} ON {table_name} "
+        f"FOR EACH ROW EXECUTE FUNCTION "
+        f"tsvector_update_trigger(search_vector, 'pg_catalog.{SEARCH_CONFIG}', {column})"
+    )
 
-    note = relationship("Note", back_populates="pages")
\ No newline at end of file
+for _table, _column in SEARCH_SOURCES:
+    event.listen(_table, "after_create", DDL(search_trigger_sql(_table.name, _column)).execute_if(dialect="postgresql"))
@@ -1,3 +1,5 @@
+import logging
+
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.responses import RedirectResponse
 from fastapi.security import OAuth2PasswordRequestForm
@@ -9,6 +11,8 @@ import schemas
 import security
 from database import get_db
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(
     prefix="/auth",
     tags=["Authentication"],
@@ -29,7 +33,7 @@ async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db))
         )
     
     # Hash password and save
-    hashed_pwd = security.get_password_hash(user.password)
+    hashed_pwd = await security.hash_password(user.password)
     new_user = models.User(
         email=user.email, 
         hashed_password=hashed_pwd, 
@@ -58,16 +62,24 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSessi
             detail="This email is linked to a Google account. Please login with Google."
         )
 
-    # 3. Verify password
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    # 3. Verify password (off the event loop)
+    valid, new_hash = (False, None)
+    if user and user.hashed_password:
+        valid, new_hash = await security.verify_and_update_password(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # Transparently upgrade hashes made with a different bcrypt cost
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     
     # 4. Generate JWT
-    access_token = security.create_access_token(data={"sub": user.email})
+    access_token = security.create_access_token(data=security.user_token_claims(user))
     return {"access_token": access_token, "token_type": "bearer"}
 
 # --------------------------------------------------------------------------
@@ -80,7 +92,8 @@ async def login_google(request: Request):
     """
     # This URL must match EXACTLY what is in your Google Cloud Console
     redirect_uri = "http://localhost:8000/auth/callback" 
-    return await security.oauth.google.authorize_redirect(request, redirect_uri)
+    google = await security.google_oauth()
+    return await google.authorize_redirect(request, redirect_uri)
 
 # --------------------------------------------------------------------------
 # 4. GOOGLE CALLBACK (FINISH FLOW)
@@ -93,7 +106,8 @@ async def auth_callback(request: Request, db: AsyncSession = Depends(get_db)):
     """
     try:
         # A. Securely Exchange Code for Google Token
-        token = await security.oauth.google.authorize_access_token(request)
+        google = await security.google_oauth()
+        token = await google.authorize_access_token(request)
         
         # B. Get User Info from the token
         # Note: 'userinfo' is automatically parsed by Authlib from the id_token
@@ -101,7 +115,7 @@ async def auth_callback(request: Request, db: AsyncSession = Depends(get_db)):
         
         # Fallback manual fetch if userinfo is missing (rare)
         if not user_info:
-            user_info = await security.oauth.google.userinfo(token=token)
+            user_info = await google.userinfo(token=token)
                     
         email = user_info.get('email')
         name = user_info.get('name')
@@ -125,7 +139,7 @@ async def auth_callback(request: Request, db: AsyncSession = Depends(get_db)):
             await db.refresh(user)
         
         # D. Generate OUR JWT (This is what the Frontend uses)
-        access_token = security.create_access_token(data={"sub": user.email})
+        access_token = security.create_access_token(data=security.user_token_claims(user))
         
         # E. Redirect back to Frontend Dashboard with the token
         # We pass the token in the URL query params
@@ -133,7 +147,7 @@ async def auth_callback(request: Request, db: AsyncSession = Depends(get_db)):
         return RedirectResponse(url=frontend_url)
 
     except Exception as e:
-        print(f"OAuth Error: {e}")
+        logger.exception("OAuth callback failed: %s", e)
         # Redirect to a frontend error page
         return RedirectResponse(url="http://localhost:3000/auth/error")
     
@@ -1,20 +1,34 @@
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, Form
-from pydantic import BaseModel
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, Form, Query, Header, Request, Response
+from fastapi import WebSocket, WebSocketDisconnect, WebSocketException, status
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, func, tuple_, literal, insert, update, delete
+from sqlalchemy.orm import selectinload, undefer
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Optional
-from pdf2image import convert_from_bytes
-from database import get_db
-import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from database import AsyncSessionLocal, get_db, get_read_db
+from security import get_current_user_id, user_id_from_token
+from dataclasses import asdict, replace
+from datetime import datetime
+import aiofiles
+import asyncio
+import base64
+import hashlib
+import json
+import logging
 import os
-from security import get_current_user
-from typing import Dict, Any
 
 import models
 import schemas
+from services import (
+    admission, rasterizer, content_store, search, fast_json, stroke_codec, live, live_hub,
+    import_queue, overlay, overlay_buffer, BufferedOverlay, OVERLAY_WRITE_BUFFER,
+)
+from services.imports import IMPORT_RETRY_AFTER, ImportQueueFull
+from services.rasterizer import SpooledUpload
+from services.storage import INCOMING_PREFIX, UPLOAD_MAX_BYTES, LocalStorage, StorageError, get_storage, incoming_key
 
-upload_dir = os.getenv("UPLOAD_DIRECTORY", "static/uploads")
+logger = logging.getLogger(__name__)
 
 class PageOverlayUpdate(BaseModel):
     overlay_data: Dict[str, Any]  # Stores JSON data (strokes, text, etc.)
@@ -25,129 +39,853 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-@router.get("", response_model=List[schemas.NoteResponse])
+def _encode_cursor(created_at: datetime, note_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), note_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, note_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(note_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+NOTE_CACHE_CONTROL = "private, no-cache"  # Clients may keep a copy but must revalidate it
+PAGE_RANGE_MAX = int(os.getenv("PAGE_RANGE_MAX", 20))  # Pages per GET /notes/{id}/pages response
+
+def _overlay_format(
+    overlay_format: Optional[str] = Query(None, description="json (default) or packed"),
+    x_overlay_format: Optional[str] = Header(None),
+) -> str:
+    """Stroke format the client reads and writes: ?overlay_format= or X-Overlay-Format."""
+    requested = (overlay_format or x_overlay_format or stroke_codec.FORMAT_JSON).lower()
+    if requested not in stroke_codec.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported overlay format: {requested}")
+    return requested
+
+def _format_headers(overlay_format: str) -> Dict[str, str]:
+    return {"X-Overlay-Format": overlay_format, "Vary": "X-Overlay-Format"}
+
+def _overlay_for_storage(overlay_data: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return stroke_codec.for_storage(overlay_data)
+    except stroke_codec.StrokeCodecError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def _page_state(page_id: int, overlay_version: int) -> str:
+    buffered = overlay_buffer.get(page_id)
+    return f"b{buffered.revision}" if buffered is not None else str(overlay_version)
+
+async def _note_etag(
+    db: AsyncSession, note_id: int, owner_id: int, overlay_format: str, page_range: Optional[Tuple[int, int]] = None
+) -> Optional[str]:
+    """
+    Weak ETag for GET /notes/{id} (or for one page range of it), built from version counters
+    only: one narrow query that never reads content or overlay JSON, plus the state of any
+    saves still in the write buffer. None if the note does not exist or belongs to someone else.
+    """
+    joined = models.Page.note_id == models.Note.id
+    if page_range is not None:
+        joined &= models.Page.page_number.between(*page_range)
+    result = await db.execute(
+        select(models.Note.version, models.Note.import_status, models.Page.id, models.Page.overlay_version)
+        .outerjoin(models.Page, joined)
+        .where(models.Note.id == note_id)
+        .where(models.Note.owner_id == owner_id)
+        .order_by(models.Page.id)
+    )
+    rows = result.all()
+    if not rows:
+        return None
+
+    digest = hashlib.sha1(
+        f"{note_id}:{overlay_format}:{page_range}:{rows[0].version}:{rows[0].import_status}".encode(),
+        usedforsecurity=False,
+    )
+    for row in rows:
+        if row.id is None:  # Note without pages
+            continue
+        digest.update(f"|{row.id}:{_page_state(row.id, row.overlay_version)}".encode())
+    return f'W/"{digest.hexdigest()}"'
+
+async def _page_etag(db: AsyncSession, page_id: int, owner_id: int, overlay_format: str) -> Optional[str]:
+    """Weak ETag for GET /notes/pages/{id}; None if the page is missing or not the caller's."""
+    result = await db.execute(
+        select(models.Page.overlay_version)
+        .join(models.Note)
+        .where(models.Page.id == page_id)
+        .where(models.Note.owner_id == owner_id)
+    )
+    overlay_version = result.scalar_one_or_none()
+    if overlay_version is None:
+        return None
+    digest = hashlib.sha1(
+        f"page:{page_id}:{overlay_format}:{_page_state(page_id, overlay_version)}".encode(), usedforsecurity=False
+    )
+    return f'W/"{digest.hexdigest()}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+@router.get("", response_model=schemas.NoteListResponse)
 async def get_all_notes(
-    db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user_id: int = Depends(get_current_user_id)
 ):
+    """
+    Lightweight, keyset-paginated listing: no pages or overlays.
+    Pass next_cursor back as ?cursor= to get the following page.
+    """
+    page_count = (
+        select(func.count(models.Page.id))
+        .where(models.Page.note_id == models.Note.id)
+        .correlate(models.Note)
+        .scalar_subquery()
+    )
+    thumbnail_url = (
+        select(func.coalesce(models.Page.renditions["thumb"].as_string(), models.Page.background_url))
+        .where(models.Page.note_id == models.Note.id)
+        .order_by(models.Page.page_number)
+        .limit(1)
+        .correlate(models.Note)
+        .scalar_subquery()
+    )
     query = (
-        select(models.Note)
-        .where(models.Note.owner_id == current_user.id)
-        .options(selectinload(models.Note.pages))
-        .order_by(models.Note.created_at.desc())
+        select(
+            models.Note.id,
+            models.Note.title,
+            models.Note.created_at,
+            models.Note.import_status,
+            page_count.label("page_count"),
+            thumbnail_url.label("thumbnail_url"),
+        )
+        .where(models.Note.owner_id == current_user_id)
+        .order_by(models.Note.created_at.desc(), models.Note.id.desc())
+        .limit(limit + 1)  # One extra row tells us whether there is a next page
     )
+    if cursor:
+        created_at, note_id = _decode_cursor(cursor)
+        query = query.where(
+            tuple_(models.Note.created_at, models.Note.id)
+            < tuple_(literal(created_at, models.Note.created_at.type), literal(note_id))
+        )
+
     result = await db.execute(query)
-    notes = result.scalars().all()
-    return notes
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    return schemas.NoteListResponse(
+        items=[schemas.NoteSummary.model_validate(row) for row in rows],
+        next_cursor=next_cursor,
+    )
+
+
+@router.get("/search", response_model=schemas.NoteSearchResponse)
+async def search_notes(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    db: AsyncSession = Depends(get_read_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    """
+    Ranked full-text search over the caller's note titles and page text, with snippets.
+    Declared before /{note_id} so "search" is not taken for a note id.
+    """
+    hits, has_more = await search.search_notes(db, current_user_id, q, limit, offset)
+    return schemas.NoteSearchResponse(
+        items=[schemas.NoteSearchHit.model_validate(hit) for hit in hits],
+        next_offset=offset + limit if has_more else None,
+    )
 
 
 @router.get("/{note_id}", response_model=schemas.NoteResponse)
 async def get_note(
     note_id: int,
-    db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_read_db),
+    current_user_id: int = Depends(get_current_user_id)
 ):
-    # 1. Fetch Note with Pages loaded
-    query = select(models.Note).where(models.Note.id == note_id).options(selectinload(models.Note.pages))
+    """
+    The note and its page metadata. Page bodies (overlays) are fetched on demand from
+    GET /notes/{id}/pages or GET /notes/pages/{page_id}, so opening a long document costs
+    the same as opening a short one.
+    """
+    # 0. Conditional GET: answer from version counters before loading anything else.
+    # The tag is computed before the load, so a concurrent write can only make it older than
+    # the body (the client re-fetches next time), never newer.
+    etag = await _note_etag(db, note_id, current_user_id, stroke_codec.FORMAT_JSON)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    headers = {"ETag": etag, "Cache-Control": NOTE_CACHE_CONTROL}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    if fast_json.FAST_JSON_RESPONSES:
+        # Same body as below, encoded straight from the rows without re-validating it
+        body = await fast_json.note_json(db, note_id, current_user_id)
+        if body is None:
+            raise HTTPException(status_code=404, detail="Note not found")
+        return fast_json.JSONBytesResponse(body, headers=headers)
+
+    # 1. Fetch Note with Pages loaded, scoped to the owner (Security). content and overlay_data are deferred.
+    query = (
+        select(models.Note)
+        .where(models.Note.id == note_id)
+        .where(models.Note.owner_id == current_user_id)
+        .options(selectinload(models.Note.pages))
+    )
     result = await db.execute(query)
     note = result.scalars().first()
 
-    # 2. Check if it exists
+    # 2. Check if it exists (someone else's note looks the same as a missing one)
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
 
-    # 3. Check ownership (Security)
-    if note.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized to access this note")
-    
+    # 3. Saves still in the write buffer are newer than the rows
+    for page in note.pages:
+        buffered = overlay_buffer.get(page.id)
+        if buffered is not None:
+            set_committed_value(page, "overlay_version", buffered.overlay_version)
+
     return note
 
 
+async def _load_pages(db: AsyncSession, *criteria, overlay_format: str) -> List[models.Page]:
+    """Pages with their overlays, as the client should see them (the non-fast_json path)."""
+    result = await db.execute(
+        select(models.Page).where(*criteria).options(undefer(models.Page.overlay_data)).order_by(models.Page.page_number)
+    )
+    pages = list(result.scalars().all())
+
+    # Fold in overlay deltas that have not been compacted yet, then saves still in the write buffer
+    await overlay.materialize_pages(db, pages)
+    for page in pages:
+        buffered = overlay_buffer.get(page.id)
+        if buffered is not None:
+            set_committed_value(page, "overlay_data", buffered.overlay_data)
+            set_committed_value(page, "overlay_version", buffered.overlay_version)
+        set_committed_value(page, "overlay_data", stroke_codec.for_client(page.overlay_data, overlay_format))
+    return pages
+
+
+@router.get("/{note_id}/pages", response_model=schemas.PageRangeResponse)
+async def get_note_pages(
+    note_id: int,
+    response: Response,
+    first: int = Query(1, alias="from", ge=1, description="First page number"),
+    last: Optional[int] = Query(None, alias="to", ge=1, description=f"Last page number (at most {PAGE_RANGE_MAX} pages)"),
+    if_none_match: Optional[str] = Header(None),
+    overlay_format: str = Depends(_overlay_format),
+    db: AsyncSession = Depends(get_read_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    """
+    Page bodies for page numbers from..to, inclusive. Longer ranges are cut to PAGE_RANGE_MAX
+    pages; next_from is where the following range starts (None after the last page), so
+    clients can prefetch ahead of the page being shown.
+    """
+    if last is None:
+        last = first + PAGE_RANGE_MAX - 1
+    if last < first:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    last = min(last, first + PAGE_RANGE_MAX - 1)
+
+    etag = await _note_etag(db, note_id, current_user_id, overlay_format, page_range=(first, last))
+    if etag is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    headers = {"ETag": etag, "Cache-Control": NOTE_CACHE_CONTROL, **_format_headers(overlay_format)}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    in_range = (models.Page.note_id == note_id, models.Page.page_number.between(first, last))
+    result = await db.execute(
+        select(models.Page.page_number)
+        .where(models.Page.note_id == note_id)
+        .where(models.Page.page_number > last)
+        .order_by(models.Page.page_number)
+        .limit(1)
+    )
+    next_from = result.scalar_one_or_none()
+
+    if fast_json.FAST_JSON_RESPONSES:
+        pages = await fast_json.pages_json(db, *in_range, overlay_format=overlay_format)
+        body = fast_json.encode_with_pages({"note_id": note_id, "next_from": next_from}, pages)
+        return fast_json.JSONBytesResponse(body, headers=headers)
+
+    pages = await _load_pages(db, *in_range, overlay_format=overlay_format)
+    return schemas.PageRangeResponse(note_id=note_id, pages=pages, next_from=next_from)
+
+
+@router.get("/pages/{page_id}", response_model=schemas.PageResponse)
+async def get_page(
+    page_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    overlay_format: str = Depends(_overlay_format),
+    db: AsyncSession = Depends(get_read_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    etag = await _page_etag(db, page_id, current_user_id, overlay_format)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="Page not found or unauthorized")
+    headers = {"ETag": etag, "Cache-Control": NOTE_CACHE_CONTROL, **_format_headers(overlay_format)}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    # Ownership was checked by _page_etag
+    if fast_json.FAST_JSON_RESPONSES:
+        pages = await fast_json.pages_json(db, models.Page.id == page_id, overlay_format=overlay_format)
+        if not pages:  # Deleted in between
+            raise HTTPException(status_code=404, detail="Page not found or unauthorized")
+        return fast_json.JSONBytesResponse(pages[0], headers=headers)
+
+    pages = await _load_pages(db, models.Page.id == page_id, overlay_format=overlay_format)
+    if not pages:
+        raise HTTPException(status_code=404, detail="Page not found or unauthorized")
+    return pages[0]
+
+
+@router.get("/{note_id}/import", response_model=schemas.ImportStatusResponse)
+async def get_import_status(
+    note_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    result = await db.execute(
+        select(models.Note.import_status)
+        .where(models.Note.id == note_id)
+        .where(models.Note.owner_id == current_user_id)
+    )
+    row = result.first()
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    job = await import_queue.store.get(note_id)
+    if job:
+        return job
+
+    # No live job (finished before a restart, or never queued): report from the DB
+    result = await db.execute(select(func.count(models.Page.id)).where(models.Page.note_id == note_id))
+    pages_done = result.scalar_one()
+    return schemas.ImportStatusResponse(
+        note_id=note_id,
+        status=row.import_status or "ready",
+        pages_done=pages_done,
+        pages_total=pages_done if row.import_status in (None, "ready") else None,
+    )
+
+
 @router.post("", response_model=schemas.NoteResponse)
 async def create_note(
     title: str = Form(...),
     back_type: Optional[str] = Form("plain"),
     file: Optional[UploadFile] = File(None),
+    upload_key: Optional[str] = Form(None),  # A PDF already uploaded via POST /notes/uploads, instead of file
+    background: bool = Form(False),  # Import PDF pages in the background; poll GET /notes/{id}/import
     db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
+):
+    if file and upload_key:
+        raise HTTPException(status_code=400, detail="Send either file or upload_key, not both")
+    if not (file or upload_key):
+        return await _create_note(title, back_type, None, None, background, db, current_user_id)
+
+    # PDF imports spool and render on this worker: cap how many run at once (429 beyond the queue)
+    async with admission.import_slot(current_user_id):
+        return await _create_note(title, back_type, file, upload_key, background, db, current_user_id)
+
+
+async def _create_note(
+    title: str,
+    back_type: Optional[str],
+    file: Optional[UploadFile],
+    upload_key: Optional[str],
+    background: bool,
+    db: AsyncSession,
+    current_user_id: int,
 ):
-    note = models.Note(title=title, owner_id=current_user.id)
+    background = background and bool(file or upload_key)
+    if background and import_queue.full():
+        raise _import_queue_full()
+
+    # Spool (and hash) the upload before touching the database
+    spool_dir = import_queue.spool_dir if background else None
+    if file:
+        upload = await rasterizer.spool_upload(file, spool_dir)
+    elif upload_key:
+        upload = await _spool_direct_upload(upload_key, current_user_id, spool_dir)
+    else:
+        upload = None
+
+    note = models.Note(
+        title=title,
+        owner_id=current_user_id,
+        import_status="pending" if upload else "ready"
+    )
     db.add(note)
-    await db.commit()
-    stmt = select(models.Note).options(selectinload(models.Note.pages)).where(models.Note.id == note.id)
-    result = await db.execute(stmt)
-    note = result.scalars().first()
-    
+
+    if upload and background:
+        try:
+            await db.commit()
+        except BaseException:
+            rasterizer.discard_spooled(upload.path)
+            raise
+        set_committed_value(note, "pages", [])
+        try:
+            await import_queue.submit(note.id, upload)
+        except ImportQueueFull:
+            # Filled up while this upload was spooling: the note would never get its pages
+            rasterizer.discard_spooled(upload.path)
+            await db.delete(note)
+            await db.commit()
+            raise _import_queue_full()
+        if upload_key:
+            await asyncio.to_thread(get_storage().delete, [upload_key])
+        return note
+
+    if upload:
+        note = await _import_pdf_now(note, upload, db)
+    else:
+        # A blank note and its page commit together
+        await db.flush()  # INSERT ... RETURNING id
+        result = await db.execute(insert(models.Page).returning(models.Page), [{
+            "note_id": note.id,
+            "page_number": 1,
+            "content": "",
+            "background_type": back_type or "plain",
+            "background_url": None,
+            "overlay_data": {},
+        }])
+        set_committed_value(note, "pages", result.scalars().all())
+        await db.commit()
+
+    if upload_key:
+        await asyncio.to_thread(get_storage().delete, [upload_key])
+
+    # Built from the objects in memory: no re-select
+    return note
+
+
+async def _import_pdf_now(note: models.Note, upload: SpooledUpload, db: AsyncSession) -> models.Note:
+    """
+    Imports a PDF within the request. The note is committed first (import_status "pending"),
+    so no transaction stays open, and no pooled connection is held, while pages render.
+    The pages, the blob reference and the "ready" status then commit together in one short
+    transaction. On failure the note is deleted again and the render claim released.
+    """
+    pdf_import = None
     try:
-        if file:
-            file_bytes = await file.read()
-            images = convert_from_bytes(file_bytes)
-            
-            for i, image in enumerate(images):
-                filename = f"note_{note.id}_{uuid.uuid4()}.png"
-                filepath = os.path.join(upload_dir, filename)
-                file_url = f"/static/uploads/{filename}"
-                image.save(filepath, "PNG")
-                
-                page = models.Page(
-                    note_id=note.id,
-                    page_number=i + 1,
-                    content="",
-                    background_type="image",
-                    background_url=file_url,
-                    overlay_data={}
-                )
-                db.add(page)
-        else:
-            page = models.Page(
-                note_id=note.id,
-                page_number=1,
-                content="",
-                background_type=back_type or "plain",
-                background_url=None,
-                overlay_data={}
-            )
-            db.add(page)
-            
         await db.commit()
-        
-    except Exception as e:
-        await db.delete(note)
+
+        # Reuse an identical earlier render or render page batches in the process pool
+        pdf_import = content_store.PdfImport(db, upload, note.id)
+        rendered = [page async for batch in pdf_import.batches() for page in batch]
+
+        # One bulk INSERT ... RETURNING for all pages, however many there are
+        # (No sort_by_parameter_order: it makes some backends insert row by row; sort here instead.)
+        result = await db.execute(
+            insert(models.Page).returning(models.Page), content_store.page_rows(note.id, rendered)
+        )
+        pages = sorted(result.scalars().all(), key=lambda page: page.page_number)
+        await db.execute(
+            update(models.Note)
+            .where(models.Note.id == note.id)
+            .values(import_status="ready", version=models.Note.version + 1)
+            .execution_options(synchronize_session=False)
+        )
         await db.commit()
+
+    except BaseException as e:
+        await db.rollback()
+        if pdf_import:
+            await pdf_import.abandon()  # Nothing committed: release the render claim, drop every image
+        if note.id is not None:
+            await _discard_note(note.id)
+        if not isinstance(e, Exception):
+            raise
         raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
-    
+    finally:
+        rasterizer.discard_spooled(upload.path)
+
+    set_committed_value(note, "import_status", "ready")
+    set_committed_value(note, "version", note.version + 1)
+    set_committed_value(note, "pages", pages)
+    return note
+
+
+async def _discard_note(note_id: int):
+    """Deletes a note whose synchronous import failed (it never had pages)."""
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(models.Note).where(models.Note.id == note_id))
+            await db.commit()
+    except Exception:
+        logger.exception("Could not delete note %s after its import failed", note_id)
+
+
+def _import_queue_full() -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many PDF imports queued, please retry",
+        headers={"Retry-After": str(IMPORT_RETRY_AFTER)},
+    )
+
+
+async def _spool_direct_upload(upload_key: str, owner_id: int, spool_dir: Optional[str] = None) -> SpooledUpload:
+    """Copies a PDF the caller uploaded straight to storage into a local spool file."""
+    if not upload_key.startswith(f"{INCOMING_PREFIX}{owner_id}/"):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    blob_storage = get_storage()
+    try:
+        size = await asyncio.to_thread(blob_storage.size, upload_key)
+    except StorageError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if size > UPLOAD_MAX_BYTES:
+        # Presigned S3 PUTs cannot cap the size, so it is enforced here
+        await asyncio.to_thread(blob_storage.delete, [upload_key])
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_BYTES} bytes")
+    try:
+        return await rasterizer.spool_stored(upload_key, spool_dir)
+    except StorageError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+
+@router.post("/uploads", response_model=schemas.UploadTicket)
+async def create_upload(
+    upload: schemas.UploadRequest,
+    current_user_id: int = Depends(get_current_user_id)
+):
+    """
+    Starts a direct upload: PUT the PDF to the returned URL (the bucket, or this app with local
+    storage) so the API never proxies the bytes, then create the note with POST /notes and
+    upload_key=key.
+    """
+    if upload.size is not None and upload.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_BYTES} bytes")
+    ticket = get_storage().presign_upload(incoming_key(current_user_id), upload.content_type)
+    return schemas.UploadTicket(**asdict(ticket), max_bytes=UPLOAD_MAX_BYTES)
+
+
+@router.put("/uploads/{token}", status_code=204, include_in_schema=False)
+async def receive_upload(token: str, request: Request):
+    """Target of presigned URLs with local storage. The signed token is the authorization."""
+    blob_storage = get_storage()
+    if not isinstance(blob_storage, LocalStorage):
+        raise HTTPException(status_code=404, detail="Not found")
+    try:
+        key, content_type = blob_storage.verify_upload(token)
+    except StorageError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    if request.headers.get("content-type", "").split(";")[0].strip() != content_type:
+        raise HTTPException(status_code=415, detail=f"Expected Content-Type: {content_type}")
+    if int(request.headers.get("content-length") or 0) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_BYTES} bytes")
+
+    path = blob_storage.path(key)
+    partial = f"{path}.part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    received = 0
+    try:
+        async with aiofiles.open(partial, "wb") as out:
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {UPLOAD_MAX_BYTES} bytes")
+                await out.write(chunk)
+        os.replace(partial, path)
+    except BaseException:
+        rasterizer.discard_spooled(partial)
+        raise
+    return Response(status_code=204)
+
+
+@router.delete("/{note_id}", status_code=204)
+async def delete_note(
+    note_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
     result = await db.execute(
-        select(models.Note)
-        .where(models.Note.id == note.id)
-        .options(selectinload(models.Note.pages))
+        select(models.Note.source_digest)
+        .where(models.Note.id == note_id)
+        .where(models.Note.owner_id == current_user_id)
     )
-    created_note = result.scalars().first()
-    return created_note
+    row = result.first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    # Images the note owns outright go with it; shared ones only when the last reference does
+    result = await db.execute(
+        select(models.Page.background_url, models.Page.renditions).where(models.Page.note_id == note_id)
+    )
+    own_files = content_store.page_files((dict(page._mapping) for page in result.all()), include_cas=not row.source_digest)
+
+    await db.execute(delete(models.Page).where(models.Page.note_id == note_id))
+    await db.execute(delete(models.Note).where(models.Note.id == note_id))
+    shared_prefix = await content_store.release(db, row.source_digest) if row.source_digest else None
+    await db.commit()
+    await import_queue.forget(note_id)
+
+    await content_store.remove_files(prefix=shared_prefix, files=own_files)
 
 
 @router.patch("/pages/{page_id}", response_model=schemas.PageResponse) # Ensure PageResponse is imported or defined
 async def update_page_overlay(
     page_id: int,
     update_data: PageOverlayUpdate,
+    response: Response,
+    overlay_format: str = Depends(_overlay_format),
     db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
-    # Fetch the page
+    """
+    Replaces the page overlay. Strokes may arrive plain or packed; they are stored in the
+    server's STROKE_STORAGE_FORMAT (so existing rows convert on their next save) and echoed
+    back in the client's format.
+
+    Stroke coordinates come back exactly as sent, integers as integers: a stroke is only
+    stored packed if that holds (at most three decimals at the default
+    STROKE_QUANTIZE_SCALE of 1000), otherwise it stays plain. Coordinates that are NaN,
+    infinite, or larger than 2**53 / STROKE_QUANTIZE_SCALE are rejected with 422.
+    """
+    response.headers.update(_format_headers(overlay_format))
+    overlay_data = _overlay_for_storage(update_data.overlay_data)
+
+    if OVERLAY_WRITE_BUFFER:
+        return await _buffer_page_overlay(page_id, overlay_data, overlay_format, db, current_user_id)
+
+    # Replace the JSONB column. A full replace supersedes any pending deltas. The version is bumped
+    # in SQL, as /ops does, so the two can never hand out the same number.
+    owned_notes = select(models.Note.id).where(models.Note.owner_id == current_user_id)
     result = await db.execute(
-        select(models.Page)
-        .join(models.Note)
+        update(models.Page)
         .where(models.Page.id == page_id)
-        .where(models.Note.owner_id == current_user.id)
+        .where(models.Page.note_id.in_(owned_notes))
+        .values(
+            overlay_data=overlay_data,
+            overlay_format=stroke_codec.format_of(overlay_data),
+            overlay_version=models.Page.overlay_version + 1,
+            overlay_base_version=models.Page.overlay_version + 1,
+        )
+        .returning(models.Page.id)
+        .execution_options(synchronize_session=False)
     )
-    page = result.scalars().first()
-
-    if not page:
+    if result.first() is None:
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Page not found or unauthorized")
+    await db.execute(delete(models.PageOverlayDelta).where(models.PageOverlayDelta.page_id == page_id))
 
-    # Update the JSONB column
-    page.overlay_data = update_data.overlay_data
-    
     await db.commit()
-    await db.refresh(page)
-    
-    return page
\ No newline at end of file
+    page = await db.get(models.Page, page_id, populate_existing=True)
+    set_committed_value(page, "overlay_data", stroke_codec.for_client(overlay_data, overlay_format))
+
+    return page
+
+
+async def _buffer_page_overlay(
+    page_id: int, overlay_data: Dict[str, Any], overlay_format: str, db: AsyncSession, current_user_id: int
+):
+    """Write-behind save: repeat saves of a page already in the buffer skip the DB entirely."""
+    buffered = overlay_buffer.get(page_id)
+    if buffered is None or buffered.owner_id != current_user_id:
+        result = await db.execute(
+            select(
+                models.Page.note_id,
+                models.Page.page_number,
+                models.Page.background_type,
+                models.Page.background_url,
+                models.Page.renditions,
+                models.Page.overlay_version,
+            )
+            .join(models.Note)
+            .where(models.Page.id == page_id)
+            .where(models.Note.owner_id == current_user_id)
+        )
+        row = result.first()
+        if not row:
+            raise HTTPException(status_code=404, detail="Page not found or unauthorized")
+        buffered = BufferedOverlay(
+            page_id=page_id,
+            owner_id=current_user_id,
+            note_id=row.note_id,
+            page_number=row.page_number,
+            background_type=row.background_type,
+            background_url=row.background_url,
+            renditions=row.renditions,
+            overlay_data={},
+            overlay_version=row.overlay_version + 1,
+        )
+
+    entry = await overlay_buffer.put(replace(buffered, overlay_data=overlay_data))
+    return schemas.PageResponse(
+        id=entry.page_id,
+        page_number=entry.page_number,
+        background_type=entry.background_type,
+        background_url=entry.background_url,
+        renditions=entry.renditions,
+        overlay_data=stroke_codec.for_client(entry.overlay_data, overlay_format),
+        overlay_version=entry.overlay_version,
+    )
+
+
+@router.post("/pages/{page_id}/ops", response_model=schemas.OverlayDeltaResponse)
+async def apply_page_overlay_ops(
+    page_id: int,
+    delta: schemas.OverlayDeltaRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    """
+    Appends overlay operations instead of re-uploading the whole overlay.
+    Fails with 409 if the page moved past base_version (optimistic concurrency) or a JSON Patch
+    "test" does not hold, and with 422 if an op does not apply (e.g. a path that does not exist)
+    or carries a stroke coordinate PATCH /pages/{page_id} would reject. Rejected ops are never stored.
+    Ops address the plain JSON form of the overlay (strokes unpacked), whatever the server's
+    STROKE_STORAGE_FORMAT.
+    """
+    ops = [op.model_dump(exclude_none=True) for op in delta.ops]
+    try:
+        for op in ops:
+            overlay.validate_op(op)
+    except overlay.OverlayOpError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    # Deltas apply on top of the stored overlay, so push any buffered save down first
+    await overlay_buffer.flush_page(page_id)
+
+    # 1. Claim the next version. Only touches the version columns, never the JSONB blob.
+    owned_notes = select(models.Note.id).where(models.Note.owner_id == current_user_id)
+    result = await db.execute(
+        update(models.Page)
+        .where(models.Page.id == page_id)
+        .where(models.Page.note_id.in_(owned_notes))
+        .where(models.Page.overlay_version == delta.base_version)
+        .values(overlay_version=models.Page.overlay_version + 1)
+        .returning(models.Page.overlay_version, models.Page.overlay_base_version)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.first()
+
+    if not row:
+        await db.rollback()
+        result = await db.execute(
+            select(models.Page.overlay_version)
+            .join(models.Note)
+            .where(models.Page.id == page_id)
+            .where(models.Note.owner_id == current_user_id)
+        )
+        current_version = result.scalar_one_or_none()
+        if current_version is None:
+            raise HTTPException(status_code=404, detail="Page not found or unauthorized")
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Overlay version conflict", "overlay_version": current_version}
+        )
+
+    # 2. Patches must apply, as a whole, to the overlay they land on (the row is locked now)
+    if overlay.needs_document(ops):
+        document = await overlay.load_document(db, page_id)
+        try:
+            overlay.check_ops(document, ops)
+        except overlay.OverlayConflict as e:
+            await db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail={"message": str(e), "overlay_version": delta.base_version}
+            )
+        except overlay.OverlayOpError as e:
+            await db.rollback()
+            raise HTTPException(status_code=422, detail=str(e))
+
+    # 3. Append the delta; fold the log into overlay_data once it gets long
+    compacted = await overlay.append_delta(db, page_id, row.overlay_version, row.overlay_base_version, ops)
+
+    await db.commit()
+    return schemas.OverlayDeltaResponse(page_id=page_id, overlay_version=row.overlay_version, compacted=compacted)
+
+
+# --- Live sync ---
+async def _live_page_ids(db: AsyncSession, note_id: int) -> set:
+    result = await db.execute(select(models.Page.id).where(models.Page.note_id == note_id))
+    return set(result.scalars())
+
+@router.websocket("/{note_id}/live")
+async def live_note(websocket: WebSocket, note_id: int, token: Optional[str] = Query(None)):
+    """
+    Streams overlay ops between every open session on a note, replacing save-and-poll.
+    Authenticate with ?token=<JWT> (browsers cannot set headers on a WebSocket) or a Bearer header.
+
+    Client -> server: {"type": "ops", "page_id": 1, "ops": [OverlayOp, ...], "seq": 7}
+    Server -> client: "ops" from other sessions, "ack" {seq}, "persisted" {page_id, overlay_version},
+    "presence", "error", and "resync" when this session fell behind and must re-fetch the note.
+    """
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    if not token:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Not authenticated")
+
+    # Short-lived session: holding a pooled connection for the life of the socket would cap sessions at the pool size
+    async with AsyncSessionLocal() as db:
+        try:
+            user_id = await user_id_from_token(token, db)
+        except HTTPException:
+            raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+        result = await db.execute(
+            select(models.Note.id).where(models.Note.id == note_id).where(models.Note.owner_id == user_id)
+        )
+        if result.scalar_one_or_none() is None:
+            raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Note not found or unauthorized")
+        page_ids = await _live_page_ids(db, note_id)
+
+    await websocket.accept()
+    conn = live.LiveConnection(websocket, note_id, user_id)
+    sender = asyncio.create_task(conn.run_sender())
+    await live_hub.join(conn)
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                message = schemas.LiveOpsMessage.model_validate_json(text)
+                ops = [op.model_dump(exclude_none=True) for op in message.ops]
+                for op in ops:
+                    overlay.validate_op(op)
+            except (ValidationError, overlay.OverlayOpError) as e:
+                conn.send_json({"type": "error", "detail": str(e)})
+                continue
+
+            if message.page_id not in page_ids:
+                # Pages of a background import appear after the socket opened
+                async with AsyncSessionLocal() as db:
+                    page_ids = await _live_page_ids(db, note_id)
+                if message.page_id not in page_ids:
+                    conn.send_json({"type": "error", "seq": message.seq, "detail": "Page not found in this note"})
+                    continue
+
+            await live_hub.submit(conn, message.page_id, ops)
+            conn.send_json({"type": "ack", "seq": message.seq})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await live_hub.leave(conn)
+        sender.cancel()
@@ -1,10 +1,15 @@
-from fastapi import APIRouter, Depends
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException
 from database import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import models
 import schemas
-from security import get_current_user
+from security import create_access_token, get_current_user, user_token_claims
+from services import UserSnapshot, user_cache
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/user",
@@ -13,31 +18,38 @@ router = APIRouter(
 )
 
 @router.get("/me", response_model=schemas.UserResponse)
-async def read_users_me(current_user: models.User = Depends(get_current_user)):
+async def read_users_me(current_user: UserSnapshot = Depends(get_current_user)):
     return current_user
 
-@router.put("/me", response_model=schemas.UserResponse)
+@router.put("/me", response_model=schemas.UserUpdateResponse)
 async def update_user_me(
     user_update: schemas.UserUpdate, 
-    current_user: models.User = Depends(get_current_user),
+    current_user: UserSnapshot = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    print("current_user:", current_user.email)
+    logger.debug("Updating profile of user %s", current_user.id)
+
+    # The dependency hands out a cached snapshot; load the row we are going to write
+    user = await db.get(models.User, current_user.id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
     
     if user_update.email:
-        print("Updating email to:", user_update.email)
-        current_user.email = user_update.email
+        user.email = user_update.email
         
     if user_update.name:
-        print("Updating name to:", user_update.name)
-        current_user.name = user_update.name 
+        user.name = user_update.name 
         
     if user_update.avatar_url:
-        print("Updating avatar to:", user_update.avatar_url)
-        current_user.avatar_url = user_update.avatar_url
+        user.avatar_url = user_update.avatar_url
 
-    db.add(current_user)
+    db.add(user)
     await db.commit()
-    await db.refresh(current_user)
-    
-    return current_user
\ No newline at end of file
+    await db.refresh(user)
+    user_cache.invalidate_user(user.id)
+
+    # The old token still carries the old profile in its claims
+    access_token = create_access_token(data=user_token_claims(user))
+    return schemas.UserUpdateResponse(
+        **schemas.UserResponse.model_validate(user).model_dump(), access_token=access_token
+    )
@@ -1,3 +1,3 @@
-from .user import UserCreate, UserResponse, UserUpdate
+from .user import UserCreate, UserResponse, UserUpdate, UserUpdateResponse
 from .token import Token
-from .note import NoteCreate, NoteResponse, PageResponse
\ No newline at end of file
+from .note import NoteCreate, NoteResponse, PageSummary, PageResponse, PageRangeResponse, NoteSummary, NoteListResponse, NoteSearchHit, NoteSearchResponse, ImportStatusResponse, OverlayOp, OverlayDeltaRequest, OverlayDeltaResponse, LiveOpsMessage, UploadRequest, UploadTicket
\ No newline at end of file
@@ -1,17 +1,26 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Literal, Optional
 
-class PageResponse(BaseModel):
+class PageSummary(BaseModel):
     id: int
     page_number: int
     background_type: str
     background_url: Optional[str] = None
-    overlay_data: Optional[Dict[str, Any]] = None
+    renditions: Optional[Dict[str, str]] = None  # e.g. {"thumb": url, "screen": url, "full": url}
+    overlay_version: int = 0
 
     class Config:
         from_attributes = True
 
+class PageResponse(PageSummary):
+    overlay_data: Optional[Dict[str, Any]] = None
+
+class PageRangeResponse(BaseModel):
+    note_id: int
+    pages: List[PageResponse]
+    next_from: Optional[int] = None  # First page number after this range, for prefetching
+
 class NoteCreate(BaseModel):
     title: str
     category: Optional[str] = "plain" # For blank notes
@@ -20,7 +29,81 @@ class NoteResponse(BaseModel):
     id: int
     title: str
     created_at: datetime
-    pages: List[PageResponse] = []
+    import_status: Optional[str] = "ready"
+    pages: List[PageSummary] = []  # Metadata only; bodies come from GET /notes/{id}/pages
+
+    class Config:
+        from_attributes = True
+
+class NoteSummary(BaseModel):
+    id: int
+    title: str
+    created_at: datetime
+    import_status: Optional[str] = "ready"
+    page_count: int = 0
+    thumbnail_url: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class NoteListResponse(BaseModel):
+    items: List[NoteSummary]
+    next_cursor: Optional[str] = None
+
+class NoteSearchHit(BaseModel):
+    id: int
+    title: str
+    created_at: datetime
+    rank: float
+    page_number: Optional[int] = None  # Best matching page, when the match is in page text
+    snippet: Optional[str] = None      # Excerpt with matches wrapped in <mark>...</mark>
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class NoteSearchResponse(BaseModel):
+    items: List[NoteSearchHit]
+    next_offset: Optional[int] = None
+
+class ImportStatusResponse(BaseModel):
+    note_id: int
+    status: str
+    pages_done: int
+    pages_total: Optional[int] = None
+    error: Optional[str] = None
+
+class OverlayOp(BaseModel):
+    op: Literal["add_element", "remove_elements", "json_patch"]
+    collection: str = "strokes"                      # Top-level overlay list for add/remove
+    element: Optional[Dict[str, Any]] = None         # add_element
+    ids: Optional[List[str]] = None                  # remove_elements
+    patch: Optional[List[Dict[str, Any]]] = None     # json_patch (RFC 6902: add, remove, replace, test)
+
+class OverlayDeltaRequest(BaseModel):
+    base_version: int  # The overlay_version the client last saw
+    ops: List[OverlayOp]
+
+class OverlayDeltaResponse(BaseModel):
+    page_id: int
+    overlay_version: int
+    compacted: bool = False
+
+class LiveOpsMessage(BaseModel):
+    # Client -> server on /notes/{id}/live. Ops are broadcast at once and persisted in batches.
+    type: Literal["ops"]
+    page_id: int
+    ops: List[OverlayOp]
+    seq: Optional[int] = None  # Echoed back in the "ack"
+
+class UploadRequest(BaseModel):
+    content_type: Literal["application/pdf"] = "application/pdf"
+    size: Optional[int] = None  # Bytes, if known: rejected up front when over the limit
+
+class UploadTicket(BaseModel):
+    # PUT the file to `url` with `headers`, then POST /notes with upload_key=key
+    key: str
+    url: str
+    method: str
+    headers: Dict[str, str] = {}
+    expires_at: datetime
+    max_bytes: int
@@ -14,6 +14,11 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class UserUpdateResponse(UserResponse):
+    # Tokens carry the profile as claims: the caller should use this one from now on
+    access_token: str
+    token_type: str = "bearer"
+
 class UserUpdate(BaseModel):
     email: EmailStr | None = None
     name: str | None = None
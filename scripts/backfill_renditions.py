@@ -0,0 +1,73 @@
+"""
+Generates thumbnail/screen renditions for page images uploaded before renditions existed.
+
+Usage: python -m scripts.backfill_renditions [--batch-size 100] [--dry-run]
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import select
+
+import models
+from database import AsyncSessionLocal, dispose_engines
+from services import rasterizer
+from services.storage import get_storage
+
+
+async def backfill(batch_size: int, dry_run: bool):
+    storage = get_storage()
+    done = skipped = 0
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(models.Page)
+                .where(models.Page.id > last_id)
+                .where(models.Page.background_type == "image")
+                .where(models.Page.renditions.is_(None))
+                .order_by(models.Page.id)
+                .limit(batch_size)
+            )
+            pages = result.scalars().all()
+            if not pages:
+                break
+            last_id = pages[-1].id
+
+            for page in pages:
+                url = page.background_url or ""
+                filename = storage.key_for_url(url)
+                if not filename or not await asyncio.to_thread(storage.exists, filename):
+                    print(f"⚠️ Page {page.id}: image {url!r} not found, skipping")
+                    skipped += 1
+                    continue
+                if dry_run:
+                    print(f"Would backfill page {page.id} ({filename})")
+                else:
+                    page.renditions = await rasterizer.backfill_renditions(filename)
+                done += 1
+
+            if not dry_run:
+                await db.commit()
+        print(f"… {done} pages backfilled so far")
+
+    print(f"✅ Backfilled {done} pages ({skipped} skipped)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            await backfill(args.batch_size, args.dry_run)
+        finally:
+            rasterizer.shutdown_rasterizer()
+            await dispose_engines()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Brings the database schema up to date. Run it once per deploy, before the API workers start:
+
+    python -m scripts.migrate
+
+New tables are created from the models. Everything added to a table that already exists
+(columns, indexes, triggers, backfills) is a numbered migration below, and the numbers
+already applied are recorded in schema_migrations. A fresh database gets every table in its
+current form from create_all, so it is only stamped with the latest number.
+
+The app itself runs no DDL on boot (DATABASE_MIGRATE_ON_STARTUP=true brings that back for
+local development). On Postgres the whole run is one transaction holding an advisory lock,
+so two deploys starting at once wait for each other, and a failed migration changes nothing.
+
+Adding a column or index to an existing model means adding a migration here as well.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Set, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.schema import CreateColumn
+
+import models
+from database import Base, dispose_engines, engine, wait_for_database
+from models.note import SEARCH_CONFIG, SEARCH_SOURCES, search_trigger_sql
+
+MIGRATION_LOCK_ID = 7_401_823_113  # Arbitrary, but the same for every run
+
+# Bookkeeping only, so it is not on Base.metadata
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+# --- 1. Helpers ---
+async def _has_table(conn, name: str) -> bool:
+    return await conn.run_sync(lambda sync: inspect(sync).has_table(name))
+
+
+async def _columns(conn, table: str) -> Set[str]:
+    return await conn.run_sync(lambda sync: {column["name"] for column in inspect(sync).get_columns(table)})
+
+
+async def _add_column(conn, column: Column, extra: str = ""):
+    """ALTER TABLE ... ADD COLUMN for a model column, as the model declares it, unless it exists."""
+    if column.name in await _columns(conn, column.table.name):
+        return
+    definition = CreateColumn(column).compile(dialect=conn.dialect)
+    await conn.execute(text(f"ALTER TABLE {column.table.name} ADD COLUMN {definition}{extra}"))
+
+
+async def _add_index(conn, table: Table, name: str):
+    index = next(index for index in table.indexes if index.name == name)
+    await conn.run_sync(lambda sync: index.create(sync, checkfirst=True))
+
+
+# --- 2. Migrations (append only; never renumber) ---
+Note, Page = models.Note.__table__, models.Page.__table__
+
+
+async def _import_status(conn):
+    await _add_column(conn, Note.c.import_status)
+    # Rows from before background imports are complete notes
+    await conn.execute(text("UPDATE notes SET import_status = 'ready' WHERE import_status IS NULL"))
+
+
+async def _listing_indexes(conn):
+    await _add_index(conn, Note, "ix_notes_owner_created_id")
+    await _add_index(conn, Page, "ix_pages_note_id_page_number")
+
+
+async def _overlay_versions(conn):
+    await _add_column(conn, Page.c.overlay_version)
+    await _add_column(conn, Page.c.overlay_base_version)
+
+
+async def _renditions(conn):
+    await _add_column(conn, Page.c.renditions)
+
+
+async def _source_digest(conn):
+    await _add_column(conn, Note.c.source_digest, " REFERENCES pdf_blobs (digest)")
+    await _add_index(conn, Note, "ix_notes_source_digest")
+
+
+async def _search_vectors(conn):
+    await _add_column(conn, Note.c.search_vector)
+    await _add_column(conn, Page.c.search_vector)
+    await _add_index(conn, Note, "ix_notes_search_vector")
+    await _add_index(conn, Page, "ix_pages_search_vector")
+    if conn.dialect.name != "postgresql":
+        return
+    for table, column in SEARCH_SOURCES:
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {table.name}_search_vector_update ON {table.name}"))
+        await conn.execute(text(search_trigger_sql(table.name, column)))
+        # Existing rows: what the trigger would have computed on insert
+        await conn.execute(text(
+            f"UPDATE {table.name} SET search_vector = to_tsvector('pg_catalog.{SEARCH_CONFIG}', coalesce({column}, '')) "
+            f"WHERE search_vector IS NULL"
+        ))
+
+
+async def _note_version(conn):
+    await _add_column(conn, Note.c.version)
+
+
+async def _overlay_format(conn):
+    await _add_column(conn, Page.c.overlay_format)
+
+
+Migration = Tuple[int, str, Callable[..., Awaitable[None]]]
+
+MIGRATIONS: List[Migration] = [
+    (1, "notes.import_status", _import_status),
+    (2, "keyset listing indexes", _listing_indexes),
+    (3, "pages.overlay_version, overlay_base_version", _overlay_versions),
+    (4, "pages.renditions", _renditions),
+    (5, "notes.source_digest", _source_digest),
+    (6, "full-text search vectors, triggers and backfill", _search_vectors),
+    (7, "notes.version", _note_version),
+    (8, "pages.overlay_format", _overlay_format),
+]
+
+
+# --- 3. Running ---
+async def migrate(eng=None) -> List[int]:
+    """Applies what is missing; returns the migration numbers that ran."""
+    eng = eng or engine
+    await wait_for_database(eng)
+    async with eng.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+        fresh = not await _has_table(conn, "notes")
+        await conn.run_sync(Base.metadata.create_all)  # New tables only; never alters existing ones
+        await conn.run_sync(schema_migrations.create, checkfirst=True)
+
+        applied = set((await conn.execute(select(schema_migrations.c.version))).scalars())
+        ran = []
+        for version, name, step in MIGRATIONS:
+            if version in applied:
+                continue
+            if not fresh:
+                await step(conn)
+                ran.append(version)
+            await conn.execute(schema_migrations.insert().values(version=version, name=name))
+        return ran
+
+
+def main():
+    async def run():
+        started = time.perf_counter()
+        try:
+            ran = await migrate()
+        finally:
+            await dispose_engines()
+        applied = f"applied {', '.join(map(str, ran))}" if ran else "nothing to apply"
+        print(f"✅ Schema up to date: {applied} ({time.perf_counter() - started:.2f}s)")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Where a worker's boot time goes: module imports, grouped by top-level package, then each
+lifespan step.
+
+Usage: python -m scripts.startup_profile [--top 15] [--output startup.json]
+
+Imports are measured in a fresh interpreter with `python -X importtime -c "import main"`,
+so nothing this script has already imported skews them. The lifespan is then run in this
+process against the configured database, with the timings from metrics.startup_profile.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+
+def import_times(module: str = "main") -> Tuple[float, Dict[str, float]]:
+    """(total seconds, seconds per top-level package) for importing `module` from scratch."""
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    total = time.perf_counter() - started
+
+    per_package: Dict[str, float] = defaultdict(float)
+    for line in process.stderr.splitlines():
+        # "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|", 2)
+        per_package[name.strip().split(".")[0]] += int(self_us) / 1e6
+    return total, dict(per_package)
+
+
+async def lifespan_phases() -> Dict[str, float]:
+    from main import app, lifespan
+    from services.metrics import startup_profile
+
+    async with lifespan(app):
+        pass
+    return {name: seconds for name, seconds in startup_profile.phases.items() if name != "imports"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--top", type=int, default=15, help="Packages to list, slowest first")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    total, per_package = import_times()
+    slowest: List[Tuple[str, float]] = sorted(per_package.items(), key=lambda item: item[1], reverse=True)
+    print(f"📦 import main: {total * 1000:.0f} ms (interpreter start included)")
+    for name, seconds in slowest[:args.top]:
+        print(f"   {seconds * 1000:8.1f} ms  {name}")
+
+    phases = asyncio.run(lifespan_phases())
+    print(f"🚀 Lifespan: {sum(phases.values()) * 1000:.0f} ms")
+    for name, seconds in phases.items():
+        print(f"   {seconds * 1000:8.1f} ms  {name}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as out:
+            json.dump({"import_seconds": total, "imports": per_package, "lifespan": phases}, out, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
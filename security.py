@@ -1,44 +1,121 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+import asyncio
+import httpx
 import jwt
+import logging
 import os
+import time
 from dotenv import load_dotenv
-from authlib.integrations.starlette_client import OAuth
 
 import models
 import database
+from services.user_cache import UserSnapshot, user_cache, USER_CACHE_TRUST_CLAIMS
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # CONFIGURATION
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
+# Migration window: still accept tokens whose subject is an email instead of a user id
+ACCEPT_EMAIL_SUBJECT_TOKENS = os.getenv("ACCEPT_EMAIL_SUBJECT_TOKENS", "true").lower() in ("1", "true", "yes")
 
 # Google Credentials
 GOOGLE_CLIENT_ID = os.getenv("CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+OIDC_DISCOVERY_TTL = int(os.getenv("OIDC_DISCOVERY_TTL", 86400))  # Seconds before the discovery document is refetched
+
+# Password Hashing
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 4))      # bcrypt releases the GIL, so threads suffice
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 64))  # Waiting hashes before we answer 503
 
-# Setup Password Hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Setup Password Hashing. Hashes with any other cost are flagged by needs_update and re-hashed at login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_desired_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_desired_rounds=BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 # --- 1. CONFIGURE GOOGLE OAUTH (Back-channel Flow) ---
-oauth = OAuth()
-
-oauth.register(
-    name='google',
-    client_id=GOOGLE_CLIENT_ID,
-    client_secret=GOOGLE_CLIENT_SECRET,
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-    client_kwargs={
-        'scope': 'openid email profile'
-    }
-)
+# Nothing happens at import: authlib and Google's discovery document are loaded on the first
+# Google sign-in, so booting a worker costs neither the import nor a network round trip.
+class DiscoveryCache:
+    """
+    OIDC discovery documents, fetched once per TTL and shared by every request. Concurrent
+    first callers wait for a single fetch; if a refresh fails, the stale copy keeps serving.
+    """
+
+    def __init__(self, ttl: int = OIDC_DISCOVERY_TTL):
+        self.ttl = ttl
+        self.fetches = 0
+        self._documents: Dict[str, Tuple[float, dict]] = {}
+        self._lock = asyncio.Lock()
+
+    def _fresh(self, url: str) -> Optional[dict]:
+        cached = self._documents.get(url)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        return None
+
+    async def get(self, url: str) -> dict:
+        document = self._fresh(url)
+        if document is not None:
+            return document
+        async with self._lock:
+            document = self._fresh(url)
+            if document is not None:
+                return document
+            try:
+                async with httpx.AsyncClient(timeout=10) as client:
+                    response = await client.get(url)
+                    response.raise_for_status()
+                    document = response.json()
+            except (httpx.HTTPError, ValueError):
+                stale = self._documents.get(url)
+                if stale is None:
+                    raise
+                logger.warning("Refreshing %s failed; using the cached copy", url, exc_info=True)
+                return stale[1]
+            self.fetches += 1
+            self._documents[url] = (time.monotonic(), document)
+            return document
+
+oidc_discovery = DiscoveryCache()
+_google_client = None
+
+async def google_oauth():
+    """The Google OAuth client, created on first use and primed with the cached discovery document."""
+    global _google_client
+    metadata = await oidc_discovery.get(GOOGLE_DISCOVERY_URL)
+    if _google_client is None:
+        from authlib.integrations.starlette_client import OAuth
+
+        _google_client = OAuth().register(
+            name='google',
+            client_id=GOOGLE_CLIENT_ID,
+            client_secret=GOOGLE_CLIENT_SECRET,
+            server_metadata_url=GOOGLE_DISCOVERY_URL,
+            client_kwargs={
+                'scope': 'openid email profile'
+            }
+        )
+    # With _loaded_at set, authlib uses this copy instead of fetching the document itself
+    _google_client.server_metadata.update(metadata, _loaded_at=time.time())
+    return _google_client
 
 # --- 2. Password Helpers ---
 def verify_password(plain_password, hashed_password):
@@ -47,6 +124,60 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+class PasswordHashingPool:
+    """
+    Runs bcrypt off the event loop on a bounded thread pool. Beyond
+    workers + max_queue outstanding calls, callers get a 503 instead of queueing forever.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def run(self, fn, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent sign-ins, please retry",
+                headers={"Retry-After": "1"},
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": max(self.in_flight - self.workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+password_pool = PasswordHashingPool()
+
+async def hash_password(password: str) -> str:
+    return await password_pool.run(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Returns (valid, new_hash). new_hash is set when the stored hash uses an outdated cost."""
+    return await password_pool.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
 # --- 3. JWT Helpers ---
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -55,23 +186,91 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# --- 4. Dependency: Get Current User (Protects Routes) ---
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def user_token_claims(user) -> dict:
+    # The subject is the numeric user id, so routes can scope queries without a lookup.
+    # Profile claims let USER_CACHE_TRUST_CLAIMS skip the DB entirely.
+    return {
+        "sub": str(user.id),
+        "email": user.email,
+        "name": user.name,
+        "picture": user.avatar_url,
+        "provider": user.provider,
+    }
+
+# --- 4. Dependencies: Current User (Protects Routes) ---
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+def decode_access_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except jwt.PyJWTError:
         raise credentials_exception
-    
-    result = await db.execute(select(models.User).where(models.User.email == email))
-    user = result.scalars().first()
+
+    subject = payload.get("sub")
+    if subject is None:
+        raise credentials_exception
+    if not subject.isdigit() and not ACCEPT_EMAIL_SUBJECT_TOKENS:
+        raise credentials_exception
+    return payload
+
+async def _load_user(subject: str, db: AsyncSession) -> UserSnapshot:
+    snapshot = user_cache.get(subject)
+    if snapshot is not None:
+        return snapshot
+
+    if subject.isdigit():
+        user = await db.get(models.User, int(subject))
+    else:
+        # Legacy token issued before ids were embedded: sub is the email
+        result = await db.execute(select(models.User).where(models.User.email == subject))
+        user = result.scalars().first()
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+
+    snapshot = UserSnapshot.from_user(user)
+    user_cache.set(subject, snapshot)
+    return snapshot
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_db)) -> UserSnapshot:
+    """Full profile of the caller. Prefer get_current_user_id when only ownership matters."""
+    payload = decode_access_token(token)
+
+    if USER_CACHE_TRUST_CLAIMS:
+        snapshot = UserSnapshot.from_claims(payload)
+        if snapshot is not None:
+            return snapshot
+
+    return await _load_user(payload["sub"], db)
+
+async def get_current_user_id(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_db)) -> int:
+    """Id of the caller, read straight from the token. Only legacy email tokens touch the DB."""
+    return await user_id_from_token(token, db)
+
+async def user_id_from_token(token: str, db: AsyncSession) -> int:
+    """get_current_user_id outside of a request (e.g. WebSocket handshakes)."""
+    payload = decode_access_token(token)
+    subject = payload["sub"]
+    if subject.isdigit():
+        return int(subject)
+
+    snapshot = await _load_user(subject, db)
+    return snapshot.id
+
+# --- 5. Admission Control ---
+def token_user_id(authorization: Optional[str]) -> Optional[int]:
+    """
+    The user id in an "Authorization: Bearer" header, without touching the database; None if
+    there is no valid token with an id subject. AdmissionMiddleware keys per-user limits on it.
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        subject = decode_access_token(token)["sub"]
+    except HTTPException:
+        return None
+    return int(subject) if subject.isdigit() else None
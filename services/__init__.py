@@ -0,0 +1,5 @@
+from . import rasterizer, overlay, content_store, search, live, admission
+from .imports import ImportJob, ImportJobStore, InMemoryImportJobStore, import_queue
+from .user_cache import UserSnapshot, user_cache
+from .write_buffer import BufferedOverlay, OVERLAY_WRITE_BUFFER, overlay_buffer
+from .live import LiveBackend, InProcessLiveBackend, LiveConnection, live_hub
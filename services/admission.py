@@ -0,0 +1,437 @@
+"""
+Admission control: keeps one user or one client from taking over the workers and the DB pool.
+
+Rate limits are token buckets, one per (route, user id or client IP). A limit is written
+"<requests>/<second|minute|hour>[:burst]", e.g. "10/minute" or "30/minute:60", and an empty
+setting turns it off. Buckets live in the rate-limit store: in memory (per worker process) by
+default, or in Redis with RATE_LIMIT_BACKEND=redis so all workers share them (needs redis).
+
+PDF imports also get concurrency caps per worker, per user and overall. A request over the cap
+waits in a short bounded queue; when the queue is full or the wait times out it is turned away.
+
+Either way the request is rejected with Rejected, which the app answers with 429 and a
+Retry-After header. AdmissionMiddleware checks the limits in ROUTE_LIMITS before the
+endpoint runs, so an over-limit client is turned away before its request body is read.
+ADMISSION_CONTROL=false turns everything off (e.g. for load tests).
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Hashable, Iterable, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURATION
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()  # memory or redis
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_MEMORY_KEYS = int(os.getenv("RATE_LIMIT_MEMORY_KEYS", 100000))  # Buckets kept in memory (LRU beyond this)
+
+# Per-route limits
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "10/minute")              # Per client IP
+RATE_LIMIT_REGISTER = os.getenv("RATE_LIMIT_REGISTER", "5/minute")        # Per client IP
+RATE_LIMIT_NOTE_CREATE = os.getenv("RATE_LIMIT_NOTE_CREATE", "30/minute") # Per user, POST /notes
+RATE_LIMIT_UPLOAD = os.getenv("RATE_LIMIT_UPLOAD", "30/minute")           # Per user, POST /notes/uploads
+
+# PDF imports in flight (spool + render), per worker process
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", 4))                    # All users together
+IMPORT_CONCURRENCY_PER_USER = int(os.getenv("IMPORT_CONCURRENCY_PER_USER", 1))
+IMPORT_QUEUE = int(os.getenv("IMPORT_QUEUE", 8))                                # Requests waiting for a slot
+IMPORT_QUEUE_PER_USER = int(os.getenv("IMPORT_QUEUE_PER_USER", 2))
+IMPORT_QUEUE_TIMEOUT = float(os.getenv("IMPORT_QUEUE_TIMEOUT", 30))             # Seconds a request may wait
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 5))              # Retry-After when a queue is full
+IMPORT_EARLY_REJECT_BYTES = int(os.getenv("IMPORT_EARLY_REJECT_BYTES", 64 * 1024))  # POST /notes bodies refused up front on full queues
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+
+class Rejected(Exception):
+    """A request turned away by a rate limit or a full queue; answered with 429."""
+
+    def __init__(self, limit: str, retry_after: float):
+        super().__init__(f"Too many requests ({limit}); retry in {math.ceil(retry_after)}s")
+        self.limit = limit
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+@dataclass(frozen=True)
+class Rate:
+    capacity: int       # Burst: requests admitted at once from a full bucket
+    per_second: float   # Refill
+
+    @property
+    def ttl(self) -> float:
+        """Seconds for an empty bucket to fill up again (after that it can be forgotten)."""
+        return self.capacity / self.per_second
+
+
+def parse_rate(spec: Optional[str]) -> Optional[Rate]:
+    """"10/minute" or "10/minute:20" (burst of 20); None for an empty spec (no limit)."""
+    if not spec or not spec.strip():
+        return None
+    try:
+        rate, _, burst = spec.strip().partition(":")
+        count, _, period = rate.partition("/")
+        count = int(count)
+        seconds = _PERIODS[period.strip().lower().rstrip("s")] if period else 1
+        capacity = int(burst) if burst else count
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid rate limit: {spec!r} (expected e.g. 10/minute or 10/minute:20)")
+    if count <= 0 or capacity <= 0:
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    return Rate(capacity=capacity, per_second=count / seconds)
+
+
+# --- 1. Rate-Limit Stores ---
+class RateLimitStore(ABC):
+    """Token buckets by key. Swap in a shared store when several workers serve the same clients."""
+
+    @abstractmethod
+    async def take(self, key: str, rate: Rate) -> float:
+        """Takes a token: 0.0 if there was one, otherwise seconds until there will be."""
+
+    async def close(self) -> None: ...
+
+
+class InMemoryRateLimitStore(RateLimitStore):
+    def __init__(self, maxsize: int = RATE_LIMIT_MEMORY_KEYS):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, updated)
+
+    async def take(self, key: str, rate: Rate) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (rate.capacity, now))
+        tokens = min(rate.capacity, tokens + (now - updated) * rate.per_second)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate.per_second
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)  # Oldest first: likely full again anyway
+        return wait
+
+
+# Same arithmetic as the in-memory store, atomically on the server and on the server's clock.
+# Returns whole milliseconds: Redis truncates Lua numbers to integers.
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * per_second)
+local wait_ms = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait_ms = math.ceil((1 - tokens) / per_second * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / per_second * 1000))
+return wait_ms
+"""
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """
+    Buckets shared by every worker, one hash per key updated by a Lua script. Pass `client`
+    to use an existing redis.asyncio client (or a compatible fake).
+    """
+
+    def __init__(self, client: Any = None, url: str = RATE_LIMIT_REDIS_URL, prefix: str = "ratelimit:"):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("RATE_LIMIT_BACKEND=redis needs redis (pip install redis)")
+            client = redis.from_url(url)
+        self.prefix = prefix
+        self._client = client
+        self._take = client.register_script(_TAKE_SCRIPT)
+
+    async def take(self, key: str, rate: Rate) -> float:
+        wait_ms = await self._take(keys=[self.prefix + key], args=[rate.capacity, rate.per_second])
+        return int(wait_ms) / 1000
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+_store: Optional[RateLimitStore] = None
+
+
+def get_rate_store() -> RateLimitStore:
+    """The store chosen by RATE_LIMIT_BACKEND, created on first use."""
+    global _store
+    if _store is None:
+        if RATE_LIMIT_BACKEND == "redis":
+            _store = RedisRateLimitStore()
+        elif RATE_LIMIT_BACKEND == "memory":
+            _store = InMemoryRateLimitStore()
+        else:
+            raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND}")
+    return _store
+
+
+async def close_rate_store():
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+
+# --- 2. Rate Limits ---
+class RateLimiter:
+    """One route's limit. check(subject) admits the request or raises Rejected."""
+
+    def __init__(self, name: str, spec: Optional[str], store: Optional[RateLimitStore] = None):
+        self.name = name
+        self.rate = parse_rate(spec)
+        self.store = store
+        self.allowed = 0
+        self.limited = 0
+        self.store_errors = 0
+
+    async def check(self, subject: str):
+        if self.rate is None or not ADMISSION_CONTROL:
+            return
+        store = self.store or get_rate_store()
+        try:
+            wait = await store.take(f"{self.name}:{subject}", self.rate)
+        except Exception:
+            # A broken shared store must not take the API down with it: admit and say so
+            self.store_errors += 1
+            logger.warning("Rate-limit store failed; admitting %s", self.name, exc_info=True)
+            return
+        if wait > 0:
+            self.limited += 1
+            raise Rejected(self.name, wait)
+        self.allowed += 1
+
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "limited": self.limited, "store_errors": self.store_errors}
+
+
+# --- 3. Concurrency Caps ---
+class ConcurrencyLimiter:
+    """
+    At most `limit` holders per key (a user id, or None for everyone) in this process. Up to
+    `queue` more wait in arrival order for up to `timeout` seconds; beyond that, Rejected.
+    """
+
+    def __init__(
+        self, name: str, limit: int, queue: int, timeout: float,
+        per_user: bool = False, retry_after: int = ADMISSION_RETRY_AFTER,
+    ):
+        self.name = name
+        self.per_user = per_user  # Keyed by user id; otherwise one pool for everyone (key None)
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._active: Dict[Hashable, int] = {}
+        self._waiters: Dict[Hashable, Deque[asyncio.Future]] = {}
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable = None):
+        if self.limit <= 0 or not ADMISSION_CONTROL:  # Uncapped
+            yield
+            return
+        await self._acquire(key)
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    def check_queue(self, key: Hashable = None):
+        """Raises Rejected if slot(key) would be refused right now because the queue is full."""
+        if self.limit <= 0 or not ADMISSION_CONTROL:
+            return
+        if self._active.get(key, 0) >= self.limit and len(self._waiters.get(key, ())) >= self.queue:
+            self.rejected += 1
+            raise Rejected(self.name, self.retry_after)
+
+    async def _acquire(self, key: Hashable):
+        waiters = self._waiters.get(key)
+        if self._active.get(key, 0) < self.limit and not waiters:
+            self._active[key] = self._active.get(key, 0) + 1
+            self.admitted += 1
+            return
+        if waiters is None:
+            waiters = self._waiters[key] = deque()
+        if len(waiters) >= self.queue:
+            self.rejected += 1
+            raise Rejected(self.name, self.retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done() or waiter.cancelled():
+                self.timeouts += 1
+                raise Rejected(self.name, self.retry_after)
+            # Handed a slot just as the wait ran out: keep it
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self._release(key)  # Cancelled after being handed a slot: pass it on
+            raise
+        finally:
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters and self._waiters.get(key) is waiters:
+                del self._waiters[key]
+        self.admitted += 1
+
+    def _release(self, key: Hashable):
+        waiters = self._waiters.get(key)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # The slot moves to the next in line; the count stays
+                return
+        remaining = self._active.get(key, 0) - 1
+        if remaining > 0:
+            self._active[key] = remaining
+        else:
+            self._active.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "active": sum(self._active.values()),
+            "waiting": sum(len(waiters) for waiters in self._waiters.values()),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+
+# --- 4. The Configured Limits ---
+login_limit = RateLimiter("login", RATE_LIMIT_LOGIN)
+register_limit = RateLimiter("register", RATE_LIMIT_REGISTER)
+note_create_limit = RateLimiter("note_create", RATE_LIMIT_NOTE_CREATE)
+upload_limit = RateLimiter("upload", RATE_LIMIT_UPLOAD)
+RATE_LIMITERS = (login_limit, register_limit, note_create_limit, upload_limit)
+
+import_user_slots = ConcurrencyLimiter(
+    "import_per_user", IMPORT_CONCURRENCY_PER_USER, IMPORT_QUEUE_PER_USER, IMPORT_QUEUE_TIMEOUT, per_user=True
+)
+import_slots = ConcurrencyLimiter("import", IMPORT_CONCURRENCY, IMPORT_QUEUE, IMPORT_QUEUE_TIMEOUT)
+CONCURRENCY_LIMITERS = (import_user_slots, import_slots)
+
+
+@asynccontextmanager
+async def import_slot(user_id: int):
+    """Holds one PDF import slot for this user, and one of the worker's."""
+    async with import_user_slots.slot(user_id):
+        async with import_slots.slot():
+            yield
+
+
+BY_IP = "ip"
+BY_USER = "user"  # Falls back to the IP for requests without a usable token
+
+
+@dataclass(frozen=True)
+class RouteLimit:
+    method: str
+    path: str
+    limiter: RateLimiter
+    by: str = BY_USER
+    queues: Tuple[ConcurrencyLimiter, ...] = ()  # Also refused up front while these queues are full...
+    queue_min_bytes: int = 0                     # ...if the body is at least this big (or of unknown size)
+
+
+ROUTE_LIMITS = (
+    RouteLimit("POST", "/auth/login", login_limit, by=BY_IP),
+    RouteLimit("POST", "/auth/register", register_limit, by=BY_IP),
+    # Only a request big enough to carry a PDF is refused for full import queues: blank notes
+    # never wait on imports, and a small import (upload_key) is capped by the endpoint itself
+    RouteLimit("POST", "/notes", note_create_limit, queues=CONCURRENCY_LIMITERS, queue_min_bytes=IMPORT_EARLY_REJECT_BYTES),
+    RouteLimit("POST", "/notes/uploads", upload_limit),
+)
+
+
+def rate_limit_stats() -> dict:
+    return {limiter.name: limiter.stats() for limiter in RATE_LIMITERS}
+
+
+def concurrency_stats() -> dict:
+    return {limiter.name: limiter.stats() for limiter in CONCURRENCY_LIMITERS}
+
+
+# --- 5. Middleware ---
+def rejection_response(rejected: Rejected) -> JSONResponse:
+    return JSONResponse({"detail": str(rejected)}, status_code=429, headers={"Retry-After": str(rejected.retry_after)})
+
+
+def client_ip(scope) -> str:
+    """The caller's address (behind a proxy, run uvicorn with --proxy-headers so this is the client's)."""
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _route_path(path: str) -> str:
+    """/notes and /notes/ are the same route."""
+    return path.rstrip("/") or "/"
+
+
+def _content_length(headers: Headers) -> float:
+    try:
+        return int(headers["content-length"])
+    except (KeyError, ValueError):
+        return math.inf  # Chunked: could be anything
+
+
+class AdmissionMiddleware:
+    """
+    Applies route limits before the endpoint runs, and so before the request body is read:
+    an over-limit client costs a header parse, not an upload. user_id(authorization header)
+    names the user behind a request, or returns None (then the IP is limited instead).
+    """
+
+    def __init__(self, app, user_id: Callable[[Optional[str]], Optional[int]], routes: Iterable[RouteLimit] = ROUTE_LIMITS):
+        self.app = app
+        self.user_id = user_id
+        self.routes = {(route.method, _route_path(route.path)): route for route in routes}
+
+    async def __call__(self, scope, receive, send):
+        route = self.routes.get((scope.get("method"), _route_path(scope.get("path", "")))) if scope["type"] == "http" else None
+        if route is not None and ADMISSION_CONTROL:
+            try:
+                await self._admit(route, scope)
+            except Rejected as e:
+                return await rejection_response(e)(scope, receive, send)
+        await self.app(scope, receive, send)
+
+    async def _admit(self, route: RouteLimit, scope):
+        headers = Headers(scope=scope)
+        user_id = self.user_id(headers.get("authorization")) if route.by == BY_USER else None
+        await route.limiter.check(f"user:{user_id}" if user_id is not None else f"ip:{client_ip(scope)}")
+        if route.queue_min_bytes and _content_length(headers) < route.queue_min_bytes:
+            return
+        for queue in route.queues:
+            if not queue.per_user:
+                queue.check_queue()
+            elif user_id is not None:
+                queue.check_queue(user_id)
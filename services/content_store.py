@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import uuid
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, List, Optional
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import AsyncSessionLocal
+from services import rasterizer
+from services.rasterizer import RenderedPage, SpooledUpload
+from services.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURATION
+REUSE_BATCH_SIZE = 100
+PDF_CLAIM_TIMEOUT = int(os.getenv("PDF_CLAIM_TIMEOUT", 3600))  # Seconds before an unfinished render counts as dead
+
+
+# --- 1. Blob Bookkeeping ---
+async def _acquire(db: AsyncSession, digest: str) -> Optional[List[dict]]:
+    """Takes a reference on a finished render of this digest, if there is one."""
+    # Only a finished blob is locked: a claim row may yet be taken over from another session
+    result = await db.execute(
+        select(models.PdfBlob)
+        .where(models.PdfBlob.digest == digest)
+        .where(models.PdfBlob.status == "ready")
+        .with_for_update()
+    )
+    blob = result.scalars().first()
+    if blob is None:
+        return None
+    blob.ref_count = blob.ref_count + 1
+    return blob.pages
+
+
+async def _is_ready(digest: str) -> bool:
+    """
+    Whether a finished render exists, asked on a connection of its own: the caller's session
+    stays out of a transaction (and off the pool) while a missing render is produced.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(models.PdfBlob.digest).where(models.PdfBlob.digest == digest).where(models.PdfBlob.status == "ready")
+        )
+        return result.first() is not None
+
+
+async def _claim(digest: str) -> Optional[str]:
+    """
+    Registers this process as the renderer of a digest and returns the directory to render into,
+    or None if someone else got there first. Commits on its own so concurrent uploads see it.
+    A claim older than PDF_CLAIM_TIMEOUT was left by a renderer that died, and is taken over.
+    """
+    prefix = f"cas/{digest[:2]}/{digest}/{uuid.uuid4().hex[:8]}"
+    async with AsyncSessionLocal() as db:
+        db.add(models.PdfBlob(digest=digest, status="rendering", prefix=prefix, ref_count=0))
+        try:
+            await db.commit()
+            return prefix
+        except IntegrityError:
+            await db.rollback()
+        return prefix if await _take_over(db, digest, prefix) else None
+
+
+async def _take_over(db: AsyncSession, digest: str, prefix: str) -> bool:
+    result = await db.execute(
+        select(models.PdfBlob.prefix, models.PdfBlob.created_at)
+        .where(models.PdfBlob.digest == digest)
+        .where(models.PdfBlob.status == "rendering")
+    )
+    stale = result.first()
+    if stale is None or _age(stale.created_at) < PDF_CLAIM_TIMEOUT:
+        return False
+    result = await db.execute(
+        update(models.PdfBlob)
+        .where(models.PdfBlob.digest == digest)
+        .where(models.PdfBlob.status == "rendering")
+        .where(models.PdfBlob.prefix == stale.prefix)  # Unless another upload took it over first
+        .values(prefix=prefix, created_at=datetime.now(timezone.utc))
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        return False
+    # A background import commits pages as it goes: those rows keep their images
+    referenced = await _referenced(db, stale.prefix)
+    await db.commit()
+    logger.warning("Took over a stale render of %s (left by a dead renderer)", digest)
+    if not referenced:
+        await remove_files(prefix=stale.prefix)
+    return True
+
+
+def _age(created_at: Optional[datetime]) -> float:
+    if created_at is None:
+        return float("inf")
+    if created_at.tzinfo is None:  # SQLite hands back naive UTC
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created_at).total_seconds()
+
+
+async def _referenced(db: AsyncSession, prefix: str) -> bool:
+    """Whether any page row points at an image under this directory."""
+    result = await db.execute(
+        select(models.Page.id).where(models.Page.background_url.like(f"%{prefix}/%")).limit(1)
+    )
+    return result.first() is not None
+
+
+async def _publish(db: AsyncSession, digest: str, prefix: str, note_id: int, pages: List[RenderedPage]):
+    result = await db.execute(
+        update(models.PdfBlob)
+        .where(models.PdfBlob.digest == digest)
+        .where(models.PdfBlob.prefix == prefix)
+        .where(models.PdfBlob.status == "rendering")
+        .values(
+            status="ready",
+            page_count=len(pages),
+            pages=[asdict(page) for page in pages],
+            ref_count=models.PdfBlob.ref_count + 1,
+        )
+    )
+    if result.rowcount != 1:
+        raise RuntimeError(f"Render of {digest} was taken over before it finished")
+    await _link_note(db, note_id, digest)
+
+
+async def _release_claim(digest: str, prefix: str):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(models.PdfBlob)
+            .where(models.PdfBlob.digest == digest)
+            .where(models.PdfBlob.prefix == prefix)
+            .where(models.PdfBlob.status == "rendering")
+        )
+        await db.commit()
+
+
+async def _link_note(db: AsyncSession, note_id: int, digest: str):
+    result = await db.execute(
+        update(models.Note)
+        .where(models.Note.id == note_id)
+        .values(source_digest=digest)
+    )
+    if result.rowcount != 1:
+        raise RuntimeError(f"Note {note_id} was deleted during its import")
+
+
+# --- 2. Importing ---
+class PdfImport:
+    """
+    The pages of one uploaded PDF, going into one note. batches() yields them in page batches,
+    reusing the images of an identical earlier upload when there is one. Reference-count changes
+    are made in `db` and commit with the caller's Page rows. While pages are being rendered,
+    `db` is not used, so the caller's session holds no connection unless it opened a transaction.
+
+    If that fails, the caller rolls back first and then calls abandon() with the number of pages
+    it had already committed: the render claim is released, and images no committed row points
+    at are deleted.
+    """
+
+    def __init__(self, db: AsyncSession, upload: SpooledUpload, note_id: int, total_pages: Optional[int] = None):
+        self.db = db
+        self.upload = upload
+        self.note_id = note_id
+        self.total_pages = total_pages
+        self.prefix: Optional[str] = None  # Directory of our render claim, while we hold one
+        self.rendered: List[RenderedPage] = []
+
+    async def batches(self) -> AsyncIterator[List[RenderedPage]]:
+        digest = self.upload.digest
+        cached = await _acquire(self.db, digest) if await _is_ready(digest) else None
+        if cached is not None:
+            await _link_note(self.db, self.note_id, digest)
+            for start in range(0, len(cached), REUSE_BATCH_SIZE):
+                yield [RenderedPage(**page) for page in cached[start:start + REUSE_BATCH_SIZE]]
+            return
+
+        # Someone else rendering the same bytes right now: render a private copy instead of waiting
+        self.prefix = await _claim(digest)
+        async for batch in rasterizer.rasterize_pdf(self.upload.path, self.note_id, self.total_pages, base_dir=self.prefix):
+            self.rendered.extend(batch)
+            yield batch
+        if self.prefix:
+            await _publish(self.db, digest, self.prefix, self.note_id, self.rendered)
+
+    async def abandon(self, committed: int = 0):
+        if self.prefix:
+            await _release_claim(self.upload.digest, self.prefix)
+            if not committed:
+                await remove_files(prefix=self.prefix)  # Including any half-written batch
+                return
+        leftover = (asdict(page) for page in self.rendered[committed:])
+        await remove_files(files=page_files(leftover, include_cas=True))
+
+
+def page_rows(note_id: int, pages: Iterable[RenderedPage]) -> List[dict]:
+    """Page column values for rendered pages, ready for a bulk insert(models.Page)."""
+    return [
+        {
+            "note_id": note_id,
+            "page_number": page.page_number,
+            "content": page.text,
+            "background_type": "image",
+            "background_url": page.background_url,
+            "renditions": page.renditions,
+            "overlay_data": {},
+        }
+        for page in pages
+    ]
+
+
+# --- 3. Releasing ---
+async def release(db: AsyncSession, digest: str) -> Optional[str]:
+    """
+    Drops one reference. Returns the blob's directory if that was the last one; delete it
+    with remove_files() after the caller's transaction commits.
+    """
+    result = await db.execute(
+        update(models.PdfBlob)
+        .where(models.PdfBlob.digest == digest)
+        .values(ref_count=models.PdfBlob.ref_count - 1)
+        .returning(models.PdfBlob.ref_count, models.PdfBlob.prefix)
+    )
+    row = result.first()
+    if row is None or row.ref_count > 0:
+        return None
+    await db.execute(delete(models.PdfBlob).where(models.PdfBlob.digest == digest))
+    return row.prefix
+
+
+def page_files(pages: Iterable[dict], include_cas: bool = False) -> List[str]:
+    """
+    Storage keys of a note's own page images. Content-addressed (cas/) ones belong to the shared
+    blob once the note holds a reference to it; a note whose import never published its render
+    (no source_digest) owns those too, so pass include_cas for it.
+    """
+    storage = get_storage()
+    files = set()
+    for page in pages:
+        urls = list((page.get("renditions") or {}).values()) + [page.get("background_url")]
+        for url in urls:
+            key = storage.key_for_url(url)
+            if key and (include_cas or not key.startswith("cas/")):
+                files.add(key)
+    return sorted(files)
+
+
+def _remove(prefix: Optional[str], files: List[str]):
+    storage = get_storage()
+    if prefix:
+        storage.delete_prefix(prefix)
+    if files:
+        storage.delete(files)
+
+
+async def remove_files(prefix: Optional[str] = None, files: Iterable[str] = ()):
+    await asyncio.to_thread(_remove, prefix, list(files))
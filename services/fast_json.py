@@ -0,0 +1,134 @@
+"""
+Fast response path for notes and page bodies: rows go straight from the database to JSON bytes.
+
+Going through response_model=PageResponse validates every page again (from_attributes, then
+a recursive walk of overlay_data as Dict[str, Any]) before encoding. Rows we wrote ourselves
+need none of that, so the body is assembled here with orjson instead. On Postgres,
+overlay_data is selected as jsonb::text and spliced into the output unchanged, so megabytes
+of stroke coordinates are never decoded into Python objects.
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+import orjson
+from sqlalchemy import Text, cast, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import Response
+
+import models
+from services import overlay, stroke_codec
+from services.write_buffer import overlay_buffer
+
+# CONFIGURATION
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "true").lower() in ("1", "true", "yes")
+RAW_JSONB_PASSTHROUGH = os.getenv("RAW_JSONB_PASSTHROUGH", "true").lower() in ("1", "true", "yes")
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z  # "Z" suffix, like Pydantic
+
+
+class JSONBytesResponse(Response):
+    """A body that is already encoded JSON."""
+    media_type = "application/json"
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=_OPTIONS)
+
+
+# --- 1. Encoding (byte splicing: orjson 3.8 has no Fragment type for embedding raw JSON) ---
+def encode_page(fields: Dict[str, Any], overlay_json: bytes) -> bytes:
+    """A PageResponse object from its scalar fields plus overlay_data that is already JSON."""
+    return dumps(fields)[:-1] + b',"overlay_data":' + overlay_json + b"}"
+
+
+def encode_with_pages(fields: Dict[str, Any], pages: List[bytes]) -> bytes:
+    """An object from its scalar fields plus a "pages" list of already encoded pages."""
+    return dumps(fields)[:-1] + b',"pages":[' + b",".join(pages) + b"]}"
+
+
+# --- 2. Loading ---
+def _page_fields(row, overlay_version: int) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "page_number": row.page_number,
+        "background_type": row.background_type,
+        "background_url": row.background_url,
+        "renditions": row.renditions,
+        "overlay_version": overlay_version or 0,
+    }
+
+
+_PAGE_COLUMNS = (
+    models.Page.id,
+    models.Page.page_number,
+    models.Page.background_type,
+    models.Page.background_url,
+    models.Page.renditions,
+    models.Page.overlay_version,
+)
+
+
+async def note_json(db: AsyncSession, note_id: int, owner_id: int) -> Optional[bytes]:
+    """The GET /notes/{id} body (page metadata, no overlays), or None if there is no such note."""
+    result = await db.execute(
+        select(models.Note.id, models.Note.title, models.Note.created_at, models.Note.import_status)
+        .where(models.Note.id == note_id)
+        .where(models.Note.owner_id == owner_id)
+    )
+    note = result.first()
+    if note is None:
+        return None
+
+    result = await db.execute(
+        select(*_PAGE_COLUMNS).where(models.Page.note_id == note_id).order_by(models.Page.page_number)
+    )
+    pages = []
+    for row in result:
+        buffered = overlay_buffer.get(row.id)
+        pages.append(_page_fields(row, buffered.overlay_version if buffered is not None else row.overlay_version))
+
+    return dumps({
+        "id": note.id, "title": note.title, "created_at": note.created_at, "import_status": note.import_status,
+        "pages": pages,
+    })
+
+
+async def pages_json(db: AsyncSession, *criteria, overlay_format: str = stroke_codec.FORMAT_JSON) -> List[bytes]:
+    """Encoded PageResponse objects for the pages matching `criteria`, in page order."""
+    raw = RAW_JSONB_PASSTHROUGH and db.bind.dialect.name == "postgresql"
+    overlay_column = cast(models.Page.overlay_data, Text) if raw else models.Page.overlay_data
+    result = await db.execute(
+        select(
+            *_PAGE_COLUMNS,
+            overlay_column.label("overlay_data"),
+            models.Page.overlay_format,
+            models.Page.overlay_base_version,
+        )
+        .where(*criteria)
+        .order_by(models.Page.page_number)
+    )
+    rows = result.all()
+
+    # Pages with deltas not yet compacted have to be decoded to apply them; nothing else does
+    stale = [row.id for row in rows if (row.overlay_version or 0) > (row.overlay_base_version or 0)]
+    pending = await overlay.load_pending_ops(db, stale)
+
+    pages = []
+    for row in rows:
+        buffered = overlay_buffer.get(row.id)
+        if buffered is not None:
+            overlay_data, version = buffered.overlay_data, buffered.overlay_version
+        elif raw and row.id not in pending and (
+            overlay_format == stroke_codec.FORMAT_PACKED or row.overlay_format != stroke_codec.FORMAT_PACKED
+        ):
+            # Stored form is what the client wants: pass the text through untouched
+            pages.append(encode_page(_page_fields(row, row.overlay_version), (row.overlay_data or "null").encode()))
+            continue
+        else:
+            overlay_data = orjson.loads(row.overlay_data) if raw and row.overlay_data is not None else row.overlay_data
+            if row.id in pending:
+                overlay_data = overlay.apply_ops(overlay_data, pending[row.id])
+            version = row.overlay_version
+        overlay_json = dumps(stroke_codec.for_client(overlay_data, overlay_format))
+        pages.append(encode_page(_page_fields(row, version), overlay_json))
+    return pages
@@ -0,0 +1,315 @@
+import asyncio
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, update
+
+import models
+from database import AsyncSessionLocal, wait_for_database
+from services import rasterizer, content_store
+from services.rasterizer import SpooledUpload
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURATION
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", 2))          # Background import jobs running at once
+IMPORT_QUEUE_SIZE = int(os.getenv("IMPORT_QUEUE_SIZE", 100))  # Jobs waiting for a worker, beyond which 429 (0: no cap)
+IMPORT_JOB_TTL = float(os.getenv("IMPORT_JOB_TTL", 3600))     # Seconds a finished job's progress is kept
+IMPORT_RETRY_AFTER = int(os.getenv("IMPORT_RETRY_AFTER", 30))  # Retry-After when the queue is full
+IMPORT_SPOOL_DIR = os.getenv("IMPORT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "neurolearn-imports"))
+# On start, fail every import left unfinished in the database. Only safe while a single process
+# runs background imports: with several workers, or during a rolling deploy, it would fail the
+# live imports of the others.
+IMPORT_RECOVER_ON_STARTUP = os.getenv("IMPORT_RECOVER_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+
+FINISHED = ("ready", "failed")
+
+
+class ImportQueueFull(Exception):
+    """Every queue slot is taken; the caller should retry later (429)."""
+
+
+@dataclass(frozen=True)
+class ImportJob:
+    note_id: int
+    status: str = "pending"  # pending, running, ready, failed
+    pages_done: int = 0
+    pages_total: Optional[int] = None
+    error: Optional[str] = None
+
+
+# --- 1. Job Stores ---
+class ImportJobStore(ABC):
+    """
+    Where import progress lives. Swap in a shared store (e.g. Redis)
+    when several workers need to report on each other's jobs.
+    """
+
+    @abstractmethod
+    async def save(self, job: ImportJob, ttl: Optional[float] = None) -> None:
+        """Stores the job; with a ttl it may be forgotten after that many seconds."""
+
+    @abstractmethod
+    async def get(self, note_id: int) -> Optional[ImportJob]: ...
+
+    @abstractmethod
+    async def delete(self, note_id: int) -> None: ...
+
+
+class InMemoryImportJobStore(ImportJobStore):
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self):
+        self._jobs: Dict[int, Tuple[ImportJob, Optional[float]]] = {}  # note id -> (job, expires at)
+        self._next_sweep = 0.0
+
+    async def save(self, job: ImportJob, ttl: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self._jobs[job.note_id] = (job, now + ttl if ttl is not None else None)
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.SWEEP_INTERVAL
+            expired = [note_id for note_id, (_, expires) in self._jobs.items() if expires is not None and expires <= now]
+            for note_id in expired:
+                del self._jobs[note_id]
+
+    async def get(self, note_id: int) -> Optional[ImportJob]:
+        entry = self._jobs.get(note_id)
+        if entry is None:
+            return None
+        job, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._jobs[note_id]
+            return None
+        return job
+
+    async def delete(self, note_id: int) -> None:
+        self._jobs.pop(note_id, None)
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+
+# --- 2. The Queue ---
+class ImportQueue:
+    """
+    Renders spooled PDFs in the background and inserts Page rows batch by batch,
+    so POST /notes can return as soon as the Note exists.
+
+    Jobs live in this process only: stopping fails the ones still queued or running, and
+    (with IMPORT_RECOVER_ON_STARTUP) starting fails whatever a crashed run left behind.
+
+    Uploads for background imports are spooled into spool_dir, a directory of this queue's
+    own under the shared spool root. The queue holds a lock on it while it runs, so starting
+    only clears the directories of processes that are gone, never those of live ones.
+    """
+
+    def __init__(
+        self, store: ImportJobStore, workers: int = IMPORT_WORKERS, maxsize: int = IMPORT_QUEUE_SIZE,
+        spool_dir: str = IMPORT_SPOOL_DIR, job_ttl: float = IMPORT_JOB_TTL,
+    ):
+        self.store = store
+        self.workers = workers
+        self.maxsize = maxsize
+        self.spool_root = spool_dir
+        self.spool_dir = os.path.join(spool_dir, uuid.uuid4().hex)
+        self.job_ttl = job_ttl
+        self.rejected = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._tasks: List[asyncio.Task] = []
+        self._recovery: Optional[asyncio.Task] = None
+        self._submitted: Optional[Set[int]] = None  # Note ids queued while recovery runs
+        self._spool_lock = None  # Open, locked file marking spool_dir as in use
+
+    async def start(self, recover: bool = IMPORT_RECOVER_ON_STARTUP):
+        await asyncio.to_thread(self._claim_spool_dir)
+        if recover:
+            # In the background: startup does not wait for the database
+            self._submitted = set()
+            self._recovery = asyncio.create_task(self._recover())
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        tasks = self._tasks + ([self._recovery] if self._recovery else [])
+        for task in tasks:
+            task.cancel()  # Running jobs fail themselves ("Import interrupted")
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._recovery = None
+        while not self._queue.empty():
+            note_id, upload = self._queue.get_nowait()
+            rasterizer.discard_spooled(upload.path)
+            await self._fail(ImportJob(note_id=note_id), None, "Import interrupted")
+        await asyncio.to_thread(self._release_spool_dir)
+
+    def full(self) -> bool:
+        return self._queue.full()
+
+    async def submit(self, note_id: int, upload: SpooledUpload):
+        """Takes ownership of the spooled upload file, or raises ImportQueueFull and leaves it with the caller."""
+        try:
+            self._queue.put_nowait((note_id, upload))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise ImportQueueFull(f"{self._queue.qsize()} imports already queued")
+        if self._submitted is not None:
+            self._submitted.add(note_id)
+        await self.store.save(ImportJob(note_id=note_id))
+
+    async def forget(self, note_id: int):
+        """Drops a note's progress (the note is gone); a queued job notices and skips it."""
+        await self.store.delete(note_id)
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "workers": len(self._tasks), "rejected": self.rejected}
+
+    async def _worker(self):
+        while True:
+            note_id, upload = await self._queue.get()
+            try:
+                await self._run(note_id, upload)
+            except Exception:
+                logger.exception("Unexpected error importing note %s", note_id)  # The worker carries on
+            finally:
+                rasterizer.discard_spooled(upload.path)
+                self._queue.task_done()
+
+    async def _run(self, note_id: int, upload: SpooledUpload):
+        job = ImportJob(note_id=note_id, status="running")
+        pdf_import = None
+        try:
+            if not await self._set_note_status(note_id, "running"):
+                await self.store.delete(note_id)  # Deleted while queued
+                return
+            await self.store.save(job)
+
+            total_pages = await rasterizer.count_pdf_pages(upload.path)
+            job = replace(job, pages_total=total_pages)
+            await self.store.save(job)
+
+            async with AsyncSessionLocal() as db:
+                pdf_import = content_store.PdfImport(db, upload, note_id, total_pages)
+                async for batch in pdf_import.batches():
+                    await db.execute(insert(models.Page), content_store.page_rows(note_id, batch))
+                    await db.execute(
+                        update(models.Note)
+                        .where(models.Note.id == note_id)
+                        .values(version=models.Note.version + 1)
+                    )
+                    await db.commit()  # Pages become visible as they are rendered
+                    job = replace(job, pages_done=job.pages_done + len(batch))
+                    await self.store.save(job)
+                await db.commit()  # Blob reference taken once the last page is in
+
+            await self._set_note_status(note_id, "ready")
+            await self.store.save(replace(job, status="ready"), ttl=self.job_ttl)
+
+        except asyncio.CancelledError:
+            await self._fail(job, pdf_import, "Import interrupted")
+            raise
+        except Exception as e:
+            await self._fail(job, pdf_import, str(e))
+
+    async def _fail(self, job: ImportJob, pdf_import: Optional[content_store.PdfImport], error: str):
+        """Records the failure as far as it can, and never raises: the database may be what failed."""
+        try:
+            if pdf_import:
+                # The session has rolled back by now; pages committed so far stay, with their images
+                await pdf_import.abandon(committed=job.pages_done)
+        except Exception:
+            logger.exception("Could not clean up the failed import of note %s", job.note_id)
+        try:
+            await self._set_note_status(job.note_id, "failed")
+        except Exception:
+            logger.exception("Could not mark note %s failed", job.note_id)
+        try:
+            # Last, as for "ready": whoever polls the job then finds the note in its final state
+            await self.store.save(replace(job, status="failed", error=error), ttl=self.job_ttl)
+        except Exception:
+            logger.exception("Could not record the failed import of note %s", job.note_id)
+
+    async def _set_note_status(self, note_id: int, status: str) -> bool:
+        """False if the note no longer exists."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(models.Note)
+                .where(models.Note.id == note_id)
+                .values(import_status=status, version=models.Note.version + 1)
+            )
+            await db.commit()
+        return result.rowcount > 0
+
+    def _claim_spool_dir(self):
+        """Creates and locks spool_dir, then removes the spool directories no live queue holds."""
+        os.makedirs(self.spool_root, exist_ok=True)
+        with open(os.path.join(self.spool_root, ".lock"), "a") as root_lock:
+            fcntl.flock(root_lock, fcntl.LOCK_EX)  # One process creating or clearing at a time
+            self._spool_lock = open(self.spool_dir + ".lock", "a")
+            fcntl.flock(self._spool_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.makedirs(self.spool_dir, exist_ok=True)
+            for name in os.listdir(self.spool_root):
+                path = os.path.join(self.spool_root, name)
+                if name == ".lock" or path in (self.spool_dir, self.spool_dir + ".lock"):
+                    continue
+                if name.endswith(".lock"):
+                    self._remove_if_orphaned(path)
+                elif not os.path.exists(path + ".lock"):  # Its owner is gone (or predates the locks)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        rasterizer.discard_spooled(path)
+
+    @staticmethod
+    def _remove_if_orphaned(lock_path: str):
+        with open(lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # A live queue's
+            shutil.rmtree(lock_path[:-len(".lock")], ignore_errors=True)
+            try:
+                os.unlink(lock_path)
+            except FileNotFoundError:
+                pass  # Its owner stopped cleanly meanwhile
+
+    def _release_spool_dir(self):
+        if self._spool_lock is None:
+            return
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+        try:
+            os.unlink(self.spool_dir + ".lock")
+        except FileNotFoundError:
+            pass
+        self._spool_lock.close()
+        self._spool_lock = None
+
+    async def _recover(self):
+        """Fails the imports a previous run never finished (start() has cleared their spool files)."""
+        try:
+            await wait_for_database()
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    update(models.Note)
+                    .where(models.Note.import_status.not_in(FINISHED))
+                    .where(models.Note.id.not_in(self._submitted))  # Queued by this run meanwhile
+                    .values(import_status="failed", version=models.Note.version + 1)
+                )
+                await db.commit()
+        except Exception:
+            logger.warning("Could not fail the imports left by a previous run", exc_info=True)
+            return
+        finally:
+            self._submitted = None
+        if result.rowcount:
+            logger.warning("Marked %d unfinished imports from a previous run as failed", result.rowcount)
+
+
+import_queue = ImportQueue(InMemoryImportJobStore())
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import orjson
+from sqlalchemy import update
+from starlette.websockets import WebSocket
+
+import models
+from database import AsyncSessionLocal
+from services import overlay
+from services.write_buffer import overlay_buffer
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURATION
+LIVE_SEND_QUEUE = int(os.getenv("LIVE_SEND_QUEUE", 256))              # Outbound messages a connection may lag behind
+LIVE_FLUSH_INTERVAL = float(os.getenv("LIVE_FLUSH_INTERVAL", 0.5))    # Seconds between batched writes of live ops
+LIVE_FLUSH_MAX_OPS = int(os.getenv("LIVE_FLUSH_MAX_OPS", 1000))       # Write early once this many ops are pending
+
+Deliver = Callable[[int, dict], Awaitable[None]]
+
+RESYNC = orjson.dumps({"type": "resync"}).decode()
+
+
+# --- 1. Backends ---
+class LiveBackend(ABC):
+    """
+    Carries room messages to the hubs that have sessions in the room. The in-process backend
+    only reaches this worker; a shared one (e.g. Redis pub/sub, a channel per note) lets
+    several workers serve the same note.
+    """
+
+    @abstractmethod
+    async def start(self, deliver: Deliver) -> None:
+        """deliver(note_id, message) hands a published message to this worker's hub."""
+
+    @abstractmethod
+    async def publish(self, note_id: int, message: dict) -> None: ...
+
+    async def join(self, note_id: int) -> None:
+        """The first local session for a note arrived (subscribe to its channel)."""
+
+    async def leave(self, note_id: int) -> None:
+        """The last local session for a note left (unsubscribe)."""
+
+    async def stop(self) -> None: ...
+
+
+class InProcessLiveBackend(LiveBackend):
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def publish(self, note_id: int, message: dict) -> None:
+        if self._deliver is not None:
+            await self._deliver(note_id, message)
+
+
+# --- 2. Connections ---
+class LiveConnection:
+    """
+    One WebSocket session. Outbound messages go through a bounded queue drained by its own
+    task, so a slow client never blocks the hub or the other sessions. One that falls
+    LIVE_SEND_QUEUE messages behind loses its backlog and is told to resync (re-fetch the note).
+    """
+
+    def __init__(self, websocket: WebSocket, note_id: int, user_id: int, queue_size: int = LIVE_SEND_QUEUE):
+        self.id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.note_id = note_id
+        self.user_id = user_id
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def send(self, text: str) -> bool:
+        """Queues a message without waiting. False if the connection had to be resynced."""
+        try:
+            self._queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+                self.dropped += 1
+            self._queue.put_nowait(RESYNC)
+            return False
+
+    def send_json(self, message: dict) -> bool:
+        return self.send(orjson.dumps(message).decode())
+
+    async def run_sender(self):
+        try:
+            while True:
+                text = await self._queue.get()
+                await self.websocket.send_text(text)
+        except Exception:
+            return  # Socket gone: the receive loop sees the disconnect and leaves the room
+
+
+# --- 3. The Hub ---
+class LiveHub:
+    """
+    Fans stroke-level ops out to every session on a note and persists them in batches:
+    ops are appended to the page's delta log every LIVE_FLUSH_INTERVAL, one delta per page
+    per batch, instead of one write per message.
+    """
+
+    def __init__(self, backend: LiveBackend, interval: float = LIVE_FLUSH_INTERVAL, max_ops: int = LIVE_FLUSH_MAX_OPS):
+        self.backend = backend
+        self.interval = interval
+        self.max_ops = max_ops
+        self.messages_received = 0
+        self.messages_delivered = 0
+        self.resyncs = 0
+        self.ops_persisted = 0
+        self.flushes = 0
+        self._rooms: Dict[int, Set[LiveConnection]] = {}
+        self._pending: Dict[int, Tuple[int, List[dict]]] = {}  # page_id -> (note_id, ops)
+        self._pending_ops = 0
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Lifecycle ---
+    async def start(self):
+        if self._task is None:
+            await self.backend.start(self._deliver)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        await self.backend.stop()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Live ops flush failed; will retry")
+
+    # --- Sessions ---
+    async def join(self, conn: LiveConnection):
+        room = self._rooms.setdefault(conn.note_id, set())
+        room.add(conn)
+        if len(room) == 1:
+            await self.backend.join(conn.note_id)
+        await self._presence(conn, "join")
+
+    async def leave(self, conn: LiveConnection):
+        room = self._rooms.get(conn.note_id)
+        if room is None or conn not in room:
+            return
+        room.discard(conn)
+        if not room:
+            del self._rooms[conn.note_id]
+            await self.backend.leave(conn.note_id)
+        await self._presence(conn, "leave")
+
+    async def _presence(self, conn: LiveConnection, event: str):
+        await self.backend.publish(conn.note_id, {
+            "type": "presence", "event": event, "connection_id": conn.id, "user_id": conn.user_id,
+        })
+
+    # --- Messages ---
+    async def submit(self, conn: LiveConnection, page_id: int, ops: List[dict]):
+        """Broadcasts validated ops from `conn` to the other sessions and queues them for persistence."""
+        self.messages_received += 1
+        note_id, pending = self._pending.setdefault(page_id, (conn.note_id, []))
+        pending.extend(ops)
+        self._pending_ops += len(ops)
+
+        await self.backend.publish(conn.note_id, {
+            "type": "ops", "page_id": page_id, "ops": ops, "user_id": conn.user_id, "origin": conn.id,
+        })
+        if self._pending_ops >= self.max_ops:
+            await self.flush()
+
+    async def _deliver(self, note_id: int, message: dict):
+        room = self._rooms.get(note_id)
+        if not room:
+            return
+        text = orjson.dumps(message).decode()  # Encoded once per room, not per session
+        origin = message.get("origin")
+        for conn in room:
+            if conn.id == origin:
+                continue
+            if not conn.send(text):
+                self.resyncs += 1
+            self.messages_delivered += 1
+
+    # --- Persistence ---
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._pending_ops = 0
+            try:
+                versions = await self._write(batch)
+            except BaseException:
+                # Keep the batch, ahead of anything that arrived while it was being written
+                for page_id, (note_id, ops) in batch.items():
+                    later = self._pending.pop(page_id, (note_id, []))[1]
+                    self._pending[page_id] = (note_id, ops + later)
+                    self._pending_ops += len(ops) + len(later)
+                raise
+            self.flushes += 1
+            self.ops_persisted += sum(len(ops) for _, ops in batch.values())
+
+        for page_id, version in versions.items():
+            await self.backend.publish(batch[page_id][0], {
+                "type": "persisted", "page_id": page_id, "overlay_version": version,
+            })
+
+    async def _write(self, batch: Dict[int, Tuple[int, List[dict]]]) -> Dict[int, int]:
+        for page_id in batch:
+            # Deltas apply on top of the stored overlay, so push any buffered save down first
+            await overlay_buffer.flush_page(page_id)
+
+        versions = {}
+        async with AsyncSessionLocal() as db:
+            for page_id, (_, ops) in batch.items():
+                # Live ops are ordered by arrival here, so there is no base_version check
+                result = await db.execute(
+                    update(models.Page)
+                    .where(models.Page.id == page_id)
+                    .values(overlay_version=models.Page.overlay_version + 1)
+                    .returning(models.Page.overlay_version, models.Page.overlay_base_version)
+                    .execution_options(synchronize_session=False)
+                )
+                row = result.first()
+                if row is None:  # Page deleted since
+                    continue
+                if overlay.needs_document(ops):
+                    # Already broadcast, but only patches that still apply are stored
+                    ops = overlay.applicable_ops(await overlay.load_document(db, page_id), ops)
+                await overlay.append_delta(db, page_id, row.overlay_version, row.overlay_base_version, ops)
+                versions[page_id] = row.overlay_version
+            await db.commit()
+        return versions
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self._rooms),
+            "connections": sum(len(room) for room in self._rooms.values()),
+            "messages_received": self.messages_received,
+            "messages_delivered": self.messages_delivered,
+            "resyncs": self.resyncs,
+            "pending_ops": self._pending_ops,
+            "ops_persisted": self.ops_persisted,
+            "flushes": self.flushes,
+        }
+
+
+live_hub = LiveHub(InProcessLiveBackend())
@@ -0,0 +1,299 @@
+import contextvars
+import logging
+import os
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURATION
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))  # Log requests slower than this with their SQL (0 = off)
+SLOW_REQUEST_MAX_STATEMENTS = 50
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# --- 1. Prometheus Primitives ---
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1.0):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, *label_values: str):
+        counts = self._counts.setdefault(label_values, [0] * (len(self.buckets) + 1))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        self._sums[label_values] = self._sums.get(label_values, 0.0) + value
+
+    def _samples(self):
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labels, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {self._sums[key]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[str]]):
+        """collector() returns exposition lines, computed at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception:
+                logger.exception("Metrics collector failed")
+        return "\n".join(lines) + "\n"
+
+
+def stats_gauges(prefix: str, stats: dict, label: Optional[str] = None) -> List[str]:
+    """
+    Turns a component's stats() dict into gauge lines. With `label`, the top level is
+    {label_value: {metric: value}} (e.g. pool_stats() keyed by engine).
+    """
+    rows = stats.items() if label else [(None, stats)]
+    grouped: Dict[str, List[str]] = {}
+    for label_value, values in rows:
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            labels = f'{{{label}="{_escape(label_value)}"}}' if label else ""
+            grouped.setdefault(f"{prefix}_{key}", []).append(f"{prefix}_{key}{labels} {value}")
+    lines = []
+    for name, samples in grouped.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(samples)
+    return lines
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route and status.", ("method", "route", "status")))
+http_latency = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency.", ("method", "route")))
+http_response_size = registry.register(Histogram(
+    "http_response_size_bytes", "HTTP response body size.", ("method", "route"), buckets=SIZE_BUCKETS))
+http_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served."))
+http_db_time = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in SQL per request.", ("method", "route")))
+http_db_queries = registry.register(Histogram(
+    "http_request_db_queries", "SQL statements per request.", ("method", "route"),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100)))
+db_queries = registry.register(Counter(
+    "db_queries_total", "SQL statements executed."))
+db_query_latency = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement latency."))
+
+
+# --- 2. Per-Request SQL Accounting ---
+@dataclass
+class RequestStats:
+    db_seconds: float = 0.0
+    queries: int = 0
+    statements: List[str] = field(default_factory=list)
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def instrument_engine(engine):
+    """Counts and times every SQL statement, globally and for the current request."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_started
+        db_queries.inc()
+        db_query_latency.observe(elapsed)
+
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.db_seconds += elapsed
+            stats.queries += 1
+            if SLOW_REQUEST_MS and len(stats.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+                stats.statements.append(statement)
+
+
+# --- 3. ASGI Middleware ---
+class MetricsMiddleware:
+    """Records latency, status, response size, in-flight count and SQL time per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status_code = 500
+        body_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, body_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                body_size += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            _request_stats.reset(token)
+
+            method = scope["method"]
+            route = _route_template(scope)
+            http_requests.inc(method, route, str(status_code))
+            http_latency.observe(elapsed, method, route)
+            http_response_size.observe(body_size, method, route)
+            http_db_time.observe(stats.db_seconds, method, route)
+            http_db_queries.observe(stats.queries, method, route)
+
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                _log_slow_request(method, scope.get("path", ""), route, elapsed, stats)
+
+
+def _route_template(scope) -> str:
+    # Route templates keep label cardinality bounded; raw paths would not
+    route = scope.get("route")
+    return getattr(route, "path_format", None) or getattr(route, "path", None) or "unmatched"
+
+
+def _log_slow_request(method: str, path: str, route: str, elapsed: float, stats: RequestStats):
+    repeated = [(sql, n) for sql, n in _Tally(stats.statements).most_common() if n > 1]
+    logger.warning(
+        "Slow request %s %s (%s): %.1f ms, %d queries, %.1f ms in SQL%s\n%s",
+        method, path, route, elapsed * 1000, stats.queries, stats.db_seconds * 1000,
+        "".join(f"\n  possible N+1 ({n}x): {sql}" for sql, n in repeated),
+        "\n".join(f"  {sql}" for sql in stats.statements),
+    )
+
+
+# --- 4. Startup Profile ---
+class StartupProfile:
+    """
+    Wall time of each boot phase (module imports, then each lifespan step), logged once the
+    app is up and exported as startup_phase_seconds. See scripts/startup_profile.py for an
+    import-by-import breakdown.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def summary(self) -> str:
+        total = sum(self.phases.values())
+        parts = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases.items())
+        return f"{total * 1000:.0f} ms ({parts})"
+
+    def collect(self) -> List[str]:
+        lines = ["# TYPE startup_phase_seconds gauge"]
+        lines.extend(f'startup_phase_seconds{{phase="{_escape(name)}"}} {seconds}' for name, seconds in self.phases.items())
+        return lines
+
+
+startup_profile = StartupProfile()
+registry.add_collector(startup_profile.collect)
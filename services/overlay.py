@@ -0,0 +1,296 @@
+import copy
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+import models
+from services import stroke_codec
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURATION
+OVERLAY_COMPACT_THRESHOLD = int(os.getenv("OVERLAY_COMPACT_THRESHOLD", 50))  # Pending deltas before folding into overlay_data
+
+
+class OverlayOpError(ValueError):
+    pass
+
+
+class OverlayConflict(OverlayOpError):
+    """A JSON Patch "test" that does not hold against the current overlay."""
+
+
+# --- 1. JSON Pointer / JSON Patch (RFC 6901 / 6902 subset: add, remove, replace, test) ---
+def _split_pointer(pointer: str) -> List[str]:
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise OverlayOpError(f"Invalid JSON pointer: {pointer!r}")
+    return [part.replace("~1", "/").replace("~0", "~") for part in pointer[1:].split("/")]
+
+
+def _index(part: str, length: int, allow_end: bool = False) -> int:
+    """An array index from a pointer token: digits only, within the array (or at its end for add)."""
+    if part == "-" and allow_end:
+        return length
+    if not part.isdigit() or (len(part) > 1 and part[0] == "0"):
+        raise OverlayOpError(f"Invalid array index: {part!r}")
+    index = int(part)
+    if index > length or (index == length and not allow_end):
+        raise OverlayOpError(f"Array index out of range: {index}")
+    return index
+
+
+def _resolve_parent(doc: Any, parts: List[str]):
+    target = doc
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[_index(part, len(target))]
+        else:
+            target = target[part]
+    return target
+
+
+def _apply_json_patch_op(doc: Any, op: Dict[str, Any]) -> Any:
+    parts = _split_pointer(op["path"])
+    if not parts:
+        if op["op"] in ("add", "replace"):
+            return copy.deepcopy(op["value"])
+        raise OverlayOpError("Cannot remove or test the document root")
+
+    parent = _resolve_parent(doc, parts)
+    key = parts[-1]
+    if isinstance(parent, list):
+        index = _index(key, len(parent), allow_end=op["op"] == "add")
+        if op["op"] == "add":
+            parent.insert(index, copy.deepcopy(op["value"]))
+        elif op["op"] == "remove":
+            del parent[index]
+        elif op["op"] == "replace":
+            parent[index] = copy.deepcopy(op["value"])
+        elif op["op"] == "test" and parent[index] != op["value"]:
+            raise OverlayConflict(f"Test failed at {op['path']}")
+    else:
+        if op["op"] in ("add", "replace"):
+            if op["op"] == "replace" and key not in parent:
+                raise KeyError(key)
+            parent[key] = copy.deepcopy(op["value"])
+        elif op["op"] == "remove":
+            del parent[key]
+        elif op["op"] == "test" and parent.get(key) != op["value"]:
+            raise OverlayConflict(f"Test failed at {op['path']}")
+    return doc
+
+
+def _needs_copy(patch: List[Dict[str, Any]]) -> bool:
+    """
+    Whether a failure part-way through could leave the patch half applied: only if some op
+    follows a change. A single op fails before it changes anything, and tests change nothing.
+    """
+    changed = False
+    for patch_op in patch:
+        if changed:
+            return True
+        changed = patch_op["op"] != "test"
+    return False
+
+
+def _apply_json_patch(doc: Dict[str, Any], patch: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """A whole patch or nothing (RFC 6902): doc is untouched if any op fails."""
+    patched = copy.deepcopy(doc) if _needs_copy(patch) else doc
+    for patch_op in patch:
+        patched = _apply_json_patch_op(patched, patch_op)
+    if not isinstance(patched, dict):
+        raise OverlayOpError("A patch must leave the overlay an object")
+    return patched
+
+
+# --- 2. Overlay Operations ---
+def _check_written(value: Any, path: List[str]):
+    """Strokes an op writes pass the same checks as a full overlay save."""
+    try:
+        stroke_codec.check_at(path, value)
+    except stroke_codec.StrokeCodecError as e:
+        raise OverlayOpError(str(e))
+
+
+def validate_op(op: Dict[str, Any]):
+    """Structural checks done at write time, before an op is persisted."""
+    kind = op.get("op")
+    if kind == "add_element":
+        if not isinstance(op.get("element"), dict):
+            raise OverlayOpError("add_element requires an 'element' object")
+        _check_written(op["element"], [op.get("collection") or "strokes", "-"])
+    elif kind == "remove_elements":
+        if not isinstance(op.get("ids"), list):
+            raise OverlayOpError("remove_elements requires an 'ids' list")
+    elif kind == "json_patch":
+        if not isinstance(op.get("patch"), list):
+            raise OverlayOpError("json_patch requires a 'patch' list")
+        for patch_op in op["patch"]:
+            if not isinstance(patch_op, dict) or patch_op.get("op") not in ("add", "remove", "replace", "test") or "path" not in patch_op:
+                raise OverlayOpError(f"Unsupported JSON Patch operation: {patch_op!r}")
+            if patch_op["op"] in ("add", "replace", "test") and "value" not in patch_op:
+                raise OverlayOpError(f"JSON Patch '{patch_op['op']}' requires a value")
+            path = _split_pointer(patch_op["path"])
+            if patch_op["op"] in ("add", "replace"):
+                _check_written(patch_op["value"], path)
+    else:
+        raise OverlayOpError(f"Unknown overlay operation: {kind!r}")
+
+
+def apply_op(doc: Dict[str, Any], op: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Applies one op to doc (in place where possible) and returns the result. All or nothing:
+    if the op does not fit the document, OverlayOpError (OverlayConflict for a failed
+    "test") is raised and doc is unchanged.
+    """
+    kind = op["op"]
+    collection = op.get("collection") or "strokes"
+    try:
+        if kind in ("add_element", "remove_elements"):
+            elements = doc.get(collection, [])
+            if not isinstance(elements, list):
+                raise OverlayOpError(f"Overlay {collection!r} is not a list")
+            if kind == "add_element":
+                doc[collection] = elements
+                elements.append(copy.deepcopy(op["element"]))
+            else:
+                ids = set(op["ids"])
+                doc[collection] = [e for e in elements if not (isinstance(e, dict) and e.get("id") in ids)]
+        elif kind == "json_patch":
+            doc = _apply_json_patch(doc, op["patch"])
+    except OverlayOpError:
+        raise
+    except (KeyError, IndexError, ValueError, TypeError) as e:
+        raise OverlayOpError(f"{kind} does not apply to the overlay: {e!r}")
+    return doc
+
+
+def _working_copy(doc: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    A private copy of doc in the form ops address: plain JSON, with packed strokes unpacked.
+    Clients write ops against that form whatever STROKE_STORAGE_FORMAT is; compaction packs
+    the result again.
+    """
+    return copy.deepcopy(stroke_codec.unpack_overlay(doc or {}))
+
+
+def check_ops(doc: Dict[str, Any], ops: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Applies ops to a copy of doc, raising OverlayOpError on the first one that does not fit."""
+    doc = _working_copy(doc)
+    for op in ops:
+        doc = apply_op(doc, op)
+    return doc
+
+
+def applicable_ops(doc: Dict[str, Any], ops: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The ops that apply, in order, each on top of the ones before; the rest are dropped."""
+    doc = _working_copy(doc)
+    kept = []
+    for op in ops:
+        try:
+            doc = apply_op(doc, op)
+            kept.append(op)
+        except OverlayOpError as e:
+            logger.info("Dropping overlay op %s: %s", op.get("op"), e)
+    return kept
+
+
+def apply_ops(doc: Dict[str, Any], ops: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Applies ops to a copy of doc. Ops are checked against the overlay when they are written,
+    so they normally all apply; one that does not is skipped (as a whole), not fatal.
+    """
+    doc = _working_copy(doc)
+    for op in ops:
+        try:
+            doc = apply_op(doc, op)
+        except OverlayOpError as e:
+            logger.warning("Skipping overlay op %s: %s", op.get("op"), e)
+    return doc
+
+
+def needs_document(ops: Iterable[Dict[str, Any]]) -> bool:
+    """
+    Whether ops can fail against the current overlay and so have to be checked at write time.
+    JSON Patch paths and tests can; appending or removing elements by id always applies.
+    """
+    return any(op.get("op") == "json_patch" for op in ops)
+
+
+# --- 3. Persistence Helpers ---
+async def load_pending_ops(db: AsyncSession, page_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """Pending ops per page, in version order."""
+    pending: Dict[int, List[Dict[str, Any]]] = {}
+    if not page_ids:
+        return pending
+    result = await db.execute(
+        select(models.PageOverlayDelta.page_id, models.PageOverlayDelta.ops)
+        .where(models.PageOverlayDelta.page_id.in_(page_ids))
+        .order_by(models.PageOverlayDelta.page_id, models.PageOverlayDelta.version)
+    )
+    for page_id, ops in result.all():
+        pending.setdefault(page_id, []).extend(ops)
+    return pending
+
+
+async def load_document(db: AsyncSession, page_id: int) -> Dict[str, Any]:
+    """The page's current overlay: stored overlay_data with its pending deltas applied."""
+    result = await db.execute(select(models.Page.overlay_data).where(models.Page.id == page_id))
+    pending = await load_pending_ops(db, [page_id])
+    return apply_ops(result.scalar_one(), pending.get(page_id, []))
+
+
+async def materialize_pages(db: AsyncSession, pages: List["models.Page"]):
+    """
+    Folds pending deltas into the loaded pages' overlay_data for the response,
+    without marking them dirty (nothing is written back).
+    """
+    stale = [page for page in pages if (page.overlay_version or 0) > (page.overlay_base_version or 0)]
+    pending = await load_pending_ops(db, [page.id for page in stale])
+    for page in stale:
+        set_committed_value(page, "overlay_data", apply_ops(page.overlay_data, pending.get(page.id, [])))
+
+
+async def compact_page(db: AsyncSession, page_id: int, version: int):
+    """
+    Rewrites overlay_data once with every pending delta up to `version` and drops them.
+    Call inside the transaction that holds the page row lock.
+    """
+    result = await db.execute(select(models.Page.overlay_data).where(models.Page.id == page_id))
+    overlay_data = result.scalar_one()
+    pending = await load_pending_ops(db, [page_id])
+
+    compacted = stroke_codec.for_storage(apply_ops(overlay_data, pending.get(page_id, [])))
+    await db.execute(
+        update(models.Page)
+        .where(models.Page.id == page_id)
+        .values(
+            overlay_data=compacted,
+            overlay_format=stroke_codec.format_of(compacted),
+            overlay_base_version=version,
+        )
+    )
+    await db.execute(
+        delete(models.PageOverlayDelta)
+        .where(models.PageOverlayDelta.page_id == page_id)
+        .where(models.PageOverlayDelta.version <= version)
+    )
+
+
+async def append_delta(db: AsyncSession, page_id: int, version: int, base_version: int, ops: List[Dict[str, Any]]) -> bool:
+    """
+    Records ops as delta `version` of the page, whose version the caller has just claimed,
+    and folds the log into overlay_data once it gets long. Returns True if it compacted.
+    """
+    db.add(models.PageOverlayDelta(page_id=page_id, version=version, ops=ops))
+    compacted = version - base_version >= OVERLAY_COMPACT_THRESHOLD
+    if compacted:
+        await db.flush()
+        await compact_page(db, page_id, version)
+    return compacted
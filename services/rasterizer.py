@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import io
+import os
+import subprocess
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiofiles
+from fastapi import UploadFile
+
+from services.storage import get_storage
+
+# CONFIGURATION
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", 2))          # Processes in the render pool
+PDF_MAX_CONCURRENT_RENDERS = int(os.getenv("PDF_MAX_CONCURRENT_RENDERS", 4))  # PDFs rendering at once
+PDF_RENDER_BATCH_SIZE = int(os.getenv("PDF_RENDER_BATCH_SIZE", 4))     # Pages per pool task
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", 200))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Renditions written per page as name:max_width (0 = native size). "full" becomes background_url.
+PAGE_RENDITIONS = os.getenv("PAGE_RENDITIONS", "thumb:320,screen:1280,full:0")
+PAGE_IMAGE_FORMAT = os.getenv("PAGE_IMAGE_FORMAT", "png").lower()  # png or webp
+PAGE_WEBP_QUALITY = int(os.getenv("PAGE_WEBP_QUALITY", 80))
+
+# Store each page's text layer (poppler's pdftotext) as Page.content, so image pages are searchable
+PDF_EXTRACT_TEXT = os.getenv("PDF_EXTRACT_TEXT", "true").lower() in ("1", "true", "yes")
+
+
+def _parse_renditions(spec: str) -> List[Tuple[str, int]]:
+    renditions = []
+    for item in spec.split(","):
+        name, _, width = item.strip().partition(":")
+        if name:
+            renditions.append((name, int(width or 0)))
+    return renditions
+
+RENDITIONS = _parse_renditions(PAGE_RENDITIONS)
+
+
+@dataclass(frozen=True)
+class RenderedPage:
+    page_number: int
+    background_url: str         # The "full" rendition (or the largest one configured)
+    renditions: Dict[str, str]  # Rendition name -> URL
+    text: str = ""              # Extracted text layer (empty for scans or when extraction is off)
+
+
+@dataclass(frozen=True)
+class SpooledUpload:
+    path: str    # Temporary file; remove with discard_spooled()
+    digest: str  # SHA-256 of the uploaded bytes
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_render_slots = asyncio.Semaphore(PDF_MAX_CONCURRENT_RENDERS)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS)
+    return _executor
+
+
+def shutdown_rasterizer():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+# --- 1. Spooling ---
+async def spool_upload(file: UploadFile, directory: Optional[str] = None) -> SpooledUpload:
+    """
+    Streams an upload to a temporary file on disk (in `directory`, or the system temp dir),
+    chunk by chunk, hashing it on the way. The caller owns the returned path and must remove it.
+    """
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=directory)
+    os.close(fd)
+    digest = hashlib.sha256()
+    try:
+        async with aiofiles.open(path, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return SpooledUpload(path=path, digest=digest.hexdigest())
+
+
+def _spool_stored(key: str, directory: Optional[str]) -> SpooledUpload:
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=directory)
+    os.close(fd)
+    try:
+        get_storage().download(key, path)
+        digest = hashlib.sha256()
+        with open(path, "rb") as source:
+            while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return SpooledUpload(path=path, digest=digest.hexdigest())
+
+
+async def spool_stored(key: str, directory: Optional[str] = None) -> SpooledUpload:
+    """spool_upload for a PDF the client uploaded straight to storage."""
+    return await asyncio.to_thread(_spool_stored, key, directory)
+
+
+def discard_spooled(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# --- 2. Worker Functions (run inside the process pool) ---
+def _count_pages(pdf_path: str) -> int:
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def save_renditions(image, base_name: str, skip: Tuple[str, ...] = ()) -> Dict[str, str]:
+    """
+    Stores every configured rendition of one page image and returns name -> storage key.
+    The native-size rendition keeps the historic name ({base_name}.png); others get a suffix.
+    """
+    from PIL import Image
+
+    extension = "webp" if PAGE_IMAGE_FORMAT == "webp" else "png"
+    filenames = {}
+    for name, max_width in RENDITIONS:
+        if name in skip:
+            continue
+        if max_width and image.width > max_width:
+            height = max(1, round(image.height * max_width / image.width))
+            rendition = image.resize((max_width, height), Image.LANCZOS)
+        else:
+            rendition = image
+
+        filename = f"{base_name}.{extension}" if max_width == 0 else f"{base_name}_{name}.{extension}"
+        encoded = io.BytesIO()
+        if extension == "webp":
+            rendition.save(encoded, "WEBP", quality=PAGE_WEBP_QUALITY, method=4)
+        else:
+            rendition.save(encoded, "PNG")
+        if rendition is not image:
+            rendition.close()
+        get_storage().put_bytes(filename, encoded.getvalue(), f"image/{extension}")
+        filenames[name] = filename
+    return filenames
+
+
+def _extract_text(pdf_path: str, first_page: int, last_page: int) -> List[str]:
+    """Text of pages [first_page, last_page]; empty strings if pdftotext is unavailable or fails."""
+    count = last_page - first_page + 1
+    if not PDF_EXTRACT_TEXT:
+        return [""] * count
+    try:
+        output = subprocess.run(
+            ["pdftotext", "-f", str(first_page), "-l", str(last_page), "-enc", "UTF-8", pdf_path, "-"],
+            capture_output=True, check=True, timeout=60,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return [""] * count
+    # Pages come back separated by form feeds; Postgres text cannot hold NUL bytes
+    texts = [text.replace("\x00", "").strip() for text in output.decode("utf-8", "replace").split("\f")]
+    return (texts + [""] * count)[:count]
+
+
+def _render_batch(
+    pdf_path: str, note_id: int, first_page: int, last_page: int, dpi: int, base_dir: Optional[str]
+) -> List[Tuple[Dict[str, str], str]]:
+    """
+    Renders pages [first_page, last_page] and writes each page's renditions as soon as it is produced.
+    Only one batch of PIL images lives in memory at a time. With base_dir (content-addressed
+    renders) pages are named by position; otherwise they get per-note uuid names.
+    Returns (rendition filenames, page text) per page.
+    """
+    from pdf2image import convert_from_path
+
+    pages = []
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page)
+    texts = _extract_text(pdf_path, first_page, last_page)
+    for page_number, image in enumerate(images, start=first_page):
+        if base_dir:
+            base_name = f"{base_dir}/page_{page_number:04d}"
+        else:
+            base_name = f"note_{note_id}_{uuid.uuid4()}"
+        pages.append((save_renditions(image, base_name), texts[page_number - first_page]))
+        image.close()
+    return pages
+
+
+def _renditions_for_file(filename: str) -> Dict[str, str]:
+    """Backfill: derives the scaled renditions of an already-stored full-size page image."""
+    from PIL import Image
+
+    base_name = os.path.splitext(filename)[0]
+    native = tuple(name for name, max_width in RENDITIONS if max_width == 0)
+    with Image.open(io.BytesIO(get_storage().get_bytes(filename))) as image:
+        image.load()
+        filenames = save_renditions(image, base_name, skip=native)
+    filenames.update({name: filename for name in native})
+    return filenames
+
+
+def _to_rendered_page(page_number: int, filenames: Dict[str, str], text: str = "") -> RenderedPage:
+    storage = get_storage()
+    urls = {name: storage.url(filename) for name, filename in filenames.items()}
+    # Prefer "full"; otherwise the last (largest, by convention) configured rendition
+    background_url = urls.get("full") or list(urls.values())[-1]
+    return RenderedPage(page_number=page_number, background_url=background_url, renditions=urls, text=text)
+
+
+# --- 3. Async API (never blocks the event loop) ---
+async def count_pdf_pages(pdf_path: str) -> int:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _count_pages, pdf_path)
+
+
+async def backfill_renditions(filename: str) -> Dict[str, str]:
+    """Rendition name -> URL for an existing upload, generating the missing sizes in the pool."""
+    loop = asyncio.get_running_loop()
+    filenames = await loop.run_in_executor(_get_executor(), _renditions_for_file, filename)
+    storage = get_storage()
+    return {name: storage.url(rendition) for name, rendition in filenames.items()}
+
+
+async def rasterize_pdf(
+    pdf_path: str, note_id: int, total_pages: Optional[int] = None, base_dir: Optional[str] = None
+) -> AsyncIterator[List[RenderedPage]]:
+    """
+    Yields batches of RenderedPage as pages are rendered in the process pool.
+    At most PDF_MAX_CONCURRENT_RENDERS documents render at once; the rest wait here.
+    """
+    async with _render_slots:
+        if total_pages is None:
+            total_pages = await count_pdf_pages(pdf_path)
+
+        loop = asyncio.get_running_loop()
+        for first_page in range(1, total_pages + 1, PDF_RENDER_BATCH_SIZE):
+            last_page = min(first_page + PDF_RENDER_BATCH_SIZE - 1, total_pages)
+            pages = await loop.run_in_executor(
+                _get_executor(), _render_batch, pdf_path, note_id, first_page, last_page, PDF_RENDER_DPI, base_dir
+            )
+            yield [_to_rendered_page(first_page + i, filenames, text) for i, (filenames, text) in enumerate(pages)]
@@ -0,0 +1,118 @@
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import case, exists, func, literal, literal_column, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from models.note import SEARCH_CONFIG
+
+# CONFIGURATION
+SEARCH_TITLE_WEIGHT = float(os.getenv("SEARCH_TITLE_WEIGHT", 2.0))  # A title match outranks the same match in page text
+SEARCH_HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=30, MinWords=10, MaxFragments=2"
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    id: int
+    title: str
+    created_at: datetime
+    rank: float
+    page_number: Optional[int] = None  # Best matching page, if the match is in page text
+    snippet: Optional[str] = None      # Excerpt of that page with matches wrapped in <mark>
+
+
+def _config():
+    return literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+
+
+async def search_notes(
+    db: AsyncSession, owner_id: int, text: str, limit: int, offset: int = 0
+) -> Tuple[List[SearchHit], bool]:
+    """
+    The owner's notes matching `text` in their title or page text, best first.
+    Returns (hits, has_more).
+    """
+    if db.bind.dialect.name != "postgresql":
+        return await _search_like(db, owner_id, text, limit, offset)
+
+    Note, Page = models.Note, models.Page
+    query = func.websearch_to_tsquery(_config(), text)  # Accepts user syntax: "quoted phrases", or, -not
+
+    # 1. Rank notes: best matching page plus a weighted title match, both served by GIN indexes
+    page_hits = (
+        select(Page.note_id, func.max(func.ts_rank(Page.search_vector, query)).label("rank"))
+        .join(Note, Note.id == Page.note_id)
+        .where(Note.owner_id == owner_id)
+        .where(Page.search_vector.bool_op("@@")(query))
+        .group_by(Page.note_id)
+        .subquery()
+    )
+    title_match = Note.search_vector.bool_op("@@")(query)
+    rank = (
+        case((title_match, func.ts_rank(Note.search_vector, query) * SEARCH_TITLE_WEIGHT), else_=0.0)
+        + func.coalesce(page_hits.c.rank, 0.0)
+    ).label("rank")
+
+    result = await db.execute(
+        select(Note.id, Note.title, Note.created_at, rank)
+        .outerjoin(page_hits, page_hits.c.note_id == Note.id)
+        .where(Note.owner_id == owner_id)
+        .where(or_(title_match, page_hits.c.note_id.is_not(None)))
+        .order_by(rank.desc(), Note.id.desc())
+        .offset(offset)
+        .limit(limit + 1)  # One extra row tells us whether there is a next page
+    )
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], False
+
+    # 2. Snippets only for the notes on this page of results: ts_headline re-parses the text
+    result = await db.execute(
+        select(
+            Page.note_id,
+            Page.page_number,
+            func.ts_headline(_config(), Page.content, query, SEARCH_HEADLINE_OPTIONS).label("snippet"),
+        )
+        .where(Page.note_id.in_([row.id for row in rows]))
+        .where(Page.search_vector.bool_op("@@")(query))
+        .order_by(Page.note_id, func.ts_rank(Page.search_vector, query).desc(), Page.page_number)
+        .distinct(Page.note_id)
+    )
+    snippets = {row.note_id: row for row in result}
+
+    hits = []
+    for row in rows:
+        best = snippets.get(row.id)
+        hits.append(SearchHit(
+            id=row.id,
+            title=row.title,
+            created_at=row.created_at,
+            rank=float(row.rank),
+            page_number=best.page_number if best else None,
+            snippet=best.snippet if best else None,
+        ))
+    return hits, has_more
+
+
+async def _search_like(
+    db: AsyncSession, owner_id: int, text: str, limit: int, offset: int
+) -> Tuple[List[SearchHit], bool]:
+    """Substring fallback for databases without full-text search (local SQLite runs). Unranked."""
+    Note, Page = models.Note, models.Page
+    in_pages = exists().where(Page.note_id == Note.id).where(Page.content.contains(text, autoescape=True))
+    result = await db.execute(
+        select(Note.id, Note.title, Note.created_at, literal(0.0).label("rank"))
+        .where(Note.owner_id == owner_id)
+        .where(or_(Note.title.contains(text, autoescape=True), in_pages))
+        .order_by(Note.created_at.desc(), Note.id.desc())
+        .offset(offset)
+        .limit(limit + 1)
+    )
+    rows = result.all()
+    hits = [SearchHit(id=row.id, title=row.title, created_at=row.created_at, rank=0.0) for row in rows[:limit]]
+    return hits, len(rows) > limit
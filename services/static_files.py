@@ -0,0 +1,65 @@
+import hashlib
+import mimetypes
+import os
+import re
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+# CONFIGURATION
+UPLOAD_CACHE_MAX_AGE = int(os.getenv("UPLOAD_CACHE_MAX_AGE", 3600))  # Seconds, for files whose name is not content-addressed
+# e.g. "/_uploads/": let nginx serve the bytes from an `internal` location with that prefix
+UPLOAD_ACCEL_REDIRECT_PREFIX = os.getenv("UPLOAD_ACCEL_REDIRECT_PREFIX")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# cas/<digest>/... renders, and note_<id>_<uuid>[_rendition].<ext> pages: never rewritten in place
+_IMMUTABLE_NAME = re.compile(
+    r"^(cas/[0-9a-f]{2}/[0-9a-f]{64}/.+"
+    r"|note_\d+_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(_\w+)?\.\w+)$"
+)
+
+
+def is_immutable(relative_path: str) -> bool:
+    return bool(_IMMUTABLE_NAME.match(relative_path.replace(os.sep, "/")))
+
+
+class UploadFiles(StaticFiles):
+    """
+    StaticFiles for uploaded page images.
+
+    - Content-addressed / uuid-named files get a one-year immutable Cache-Control.
+    - ETags are strong and derived from the path and size for immutable files, so they
+      stay stable across nodes and copies (mtime is not part of the identity).
+    - Range and If-None-Match are handled by FileResponse / StaticFiles; the body goes
+      out via the server's zero-copy "http.response.pathsend" extension when offered.
+    - With UPLOAD_ACCEL_REDIRECT_PREFIX set, the response is an empty X-Accel-Redirect
+      so nginx streams the file (sendfile) instead of the Python worker.
+    """
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        relative_path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        immutable = is_immutable(relative_path)
+
+        identity = f"{relative_path}:{stat_result.st_size}"
+        if not immutable:
+            identity += f":{stat_result.st_mtime_ns}"
+        etag = f'"{hashlib.sha1(identity.encode(), usedforsecurity=False).hexdigest()}"'
+
+        headers = {
+            "cache-control": IMMUTABLE_CACHE_CONTROL if immutable else f"public, max-age={UPLOAD_CACHE_MAX_AGE}",
+            "etag": etag,
+        }
+
+        if UPLOAD_ACCEL_REDIRECT_PREFIX:
+            media_type = mimetypes.guess_type(relative_path)[0] or "application/octet-stream"
+            headers["x-accel-redirect"] = UPLOAD_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative_path
+            response = Response(status_code=status_code, headers=headers, media_type=media_type)
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
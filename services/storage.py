@@ -0,0 +1,311 @@
+"""
+Where uploaded PDFs and rendered page images live.
+
+STORAGE_BACKEND=local (the default) keeps objects under UPLOAD_DIRECTORY, served by the app
+itself at /static/uploads/. STORAGE_BACKEND=s3 puts them in an S3-compatible bucket (AWS,
+MinIO, R2, ...; needs boto3), so API nodes and render workers share one store and page
+URLs point at the bucket or a CDN in front of it.
+
+Keys are relative paths ("cas/ab/<digest>/1f2e3d4c/page_0001.png"). The interface is
+synchronous because it also runs inside the render worker processes; async code calls
+it through asyncio.to_thread.
+
+Clients can upload PDFs straight to storage: presign_upload() returns a URL for one PUT of
+at most UPLOAD_MAX_BYTES. On S3 that is a presigned PUT to the bucket; locally it is a
+signed, expiring URL back to this app (PUT /notes/uploads/{token}).
+"""
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from services.static_files import IMMUTABLE_CACHE_CONTROL, is_immutable
+
+# CONFIGURATION
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()  # local or s3
+UPLOAD_DIRECTORY = os.getenv("UPLOAD_DIRECTORY", "static/uploads")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 200 * 1024 * 1024))  # Largest direct upload accepted
+UPLOAD_URL_EXPIRES = int(os.getenv("UPLOAD_URL_EXPIRES", 900))             # Seconds a presigned upload URL stays valid
+
+# S3-compatible backend
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_REGION = os.getenv("S3_REGION")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")                  # e.g. http://minio:9000; unset for AWS
+S3_PRESIGN_ENDPOINT_URL = os.getenv("S3_PRESIGN_ENDPOINT_URL")  # Endpoint as clients reach it, if different
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL")                      # Base URL page images are served from (bucket or CDN)
+
+LOCAL_URL_PREFIX = "/static/uploads/"
+LOCAL_UPLOAD_URL_PREFIX = "/notes/uploads/"
+INCOMING_PREFIX = "incoming/"  # Direct uploads, deleted once imported (add a bucket lifecycle rule for strays)
+
+
+class StorageError(Exception):
+    """A missing object, an invalid key, or an upload token that does not verify."""
+
+
+@dataclass(frozen=True)
+class PresignedUpload:
+    key: str
+    url: str
+    method: str
+    expires_at: datetime
+    headers: Dict[str, str] = field(default_factory=dict)  # Send these with the upload
+
+
+def incoming_key(owner_id: int) -> str:
+    """A fresh key for one direct PDF upload by this user."""
+    return f"{INCOMING_PREFIX}{owner_id}/{uuid.uuid4().hex}.pdf"
+
+
+def content_type_for(key: str) -> str:
+    extension = os.path.splitext(key)[1].lower()
+    return {".png": "image/png", ".webp": "image/webp", ".pdf": "application/pdf"}.get(
+        extension, "application/octet-stream"
+    )
+
+
+class BlobStorage(ABC):
+    url_prefix: str
+
+    @abstractmethod
+    def put_bytes(self, key: str, data: bytes, content_type: Optional[str] = None): ...
+
+    @abstractmethod
+    def get_bytes(self, key: str) -> bytes: ...
+
+    @abstractmethod
+    def download(self, key: str, path: str):
+        """Copies an object to a local file (pdf2image and poppler need a real path)."""
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        """Size in bytes; StorageError if there is no such object."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool: ...
+
+    @abstractmethod
+    def delete(self, keys: Iterable[str]):
+        """Deletes objects; missing ones are ignored."""
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str): ...
+
+    @abstractmethod
+    def presign_upload(self, key: str, content_type: str, expires: int = UPLOAD_URL_EXPIRES) -> PresignedUpload: ...
+
+    def url(self, key: str) -> str:
+        return self.url_prefix + key
+
+    def key_for_url(self, url: Optional[str]) -> Optional[str]:
+        """The key behind a URL this storage handed out, or None for anything else."""
+        if url and url.startswith(self.url_prefix):
+            return url[len(self.url_prefix):]
+        return None
+
+
+# --- 1. Local Filesystem ---
+class LocalStorage(BlobStorage):
+    def __init__(self, root: str = UPLOAD_DIRECTORY, url_prefix: str = LOCAL_URL_PREFIX):
+        self.root = root
+        self.url_prefix = url_prefix
+
+    def path(self, key: str) -> str:
+        normalized = os.path.normpath(key)
+        if os.path.isabs(normalized) or normalized == "." or normalized.startswith(".."):
+            raise StorageError(f"Invalid key: {key!r}")
+        return os.path.join(self.root, normalized)
+
+    def put_bytes(self, key: str, data: bytes, content_type: Optional[str] = None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{uuid.uuid4().hex[:8]}.part"  # Readers never see a half-written file
+        with open(partial, "wb") as out:
+            out.write(data)
+        os.replace(partial, path)
+
+    def get_bytes(self, key: str) -> bytes:
+        try:
+            with open(self.path(key), "rb") as source:
+                return source.read()
+        except FileNotFoundError:
+            raise StorageError(f"No such object: {key}")
+
+    def download(self, key: str, path: str):
+        try:
+            shutil.copyfile(self.path(key), path)
+        except FileNotFoundError:
+            raise StorageError(f"No such object: {key}")
+
+    def size(self, key: str) -> int:
+        try:
+            return os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            raise StorageError(f"No such object: {key}")
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path(key))
+
+    def delete(self, keys: Iterable[str]):
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def delete_prefix(self, prefix: str):
+        shutil.rmtree(self.path(prefix), ignore_errors=True)
+
+    # Direct uploads come back to this app, authorized by a signed token instead of a session
+    def _serializer(self) -> URLSafeSerializer:
+        from security import SECRET_KEY  # The app's signing key; imported here, not in render workers
+
+        if not SECRET_KEY:
+            raise RuntimeError("SECRET_KEY is not set: direct upload URLs cannot be signed")
+        return URLSafeSerializer(SECRET_KEY, salt="direct-upload")
+
+    def presign_upload(self, key: str, content_type: str, expires: int = UPLOAD_URL_EXPIRES) -> PresignedUpload:
+        expires_at = int(time.time()) + expires
+        token = self._serializer().dumps({"key": key, "content_type": content_type, "exp": expires_at})
+        return PresignedUpload(
+            key=key,
+            url=LOCAL_UPLOAD_URL_PREFIX + token,
+            method="PUT",
+            expires_at=datetime.fromtimestamp(expires_at, timezone.utc),
+            headers={"Content-Type": content_type},
+        )
+
+    def verify_upload(self, token: str) -> Tuple[str, str]:
+        """(key, content_type) of a token from presign_upload, if it is genuine and unexpired."""
+        try:
+            claims = self._serializer().loads(token)
+        except BadSignature:
+            raise StorageError("Invalid upload URL")
+        if claims["exp"] < time.time():
+            raise StorageError("Upload URL has expired")
+        return claims["key"], claims["content_type"]
+
+
+# --- 2. S3-compatible ---
+class S3Storage(BlobStorage):
+    def __init__(
+        self,
+        bucket: Optional[str] = S3_BUCKET,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+        region: Optional[str] = S3_REGION,
+        public_url: Optional[str] = S3_PUBLIC_URL,
+        presign_endpoint_url: Optional[str] = S3_PRESIGN_ENDPOINT_URL,
+    ):
+        try:
+            import boto3
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs S3_BUCKET")
+
+        # Path-style addressing for custom endpoints (MinIO and friends do not do virtual hosts)
+        config = Config(signature_version="s3v4", s3={"addressing_style": "path" if endpoint_url else "auto"})
+        self.bucket = bucket
+        self._client_error = ClientError
+        self._client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region, config=config)
+        self._presign_client = (
+            boto3.client("s3", endpoint_url=presign_endpoint_url, region_name=region, config=config)
+            if presign_endpoint_url else self._client
+        )
+        if public_url:
+            self.url_prefix = public_url.rstrip("/") + "/"
+        elif endpoint_url:
+            self.url_prefix = f"{(presign_endpoint_url or endpoint_url).rstrip('/')}/{bucket}/"
+        else:
+            self.url_prefix = f"https://{bucket}.s3.amazonaws.com/"
+
+    def _missing(self, error) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def put_bytes(self, key: str, data: bytes, content_type: Optional[str] = None):
+        extra = {"ContentType": content_type or content_type_for(key)}
+        if is_immutable(key):
+            extra["CacheControl"] = IMMUTABLE_CACHE_CONTROL
+        self._client.put_object(Bucket=self.bucket, Key=key, Body=data, **extra)
+
+    def get_bytes(self, key: str) -> bytes:
+        try:
+            return self._client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        except self._client_error as e:
+            if self._missing(e):
+                raise StorageError(f"No such object: {key}")
+            raise
+
+    def download(self, key: str, path: str):
+        try:
+            self._client.download_file(self.bucket, key, path)
+        except self._client_error as e:
+            if self._missing(e):
+                raise StorageError(f"No such object: {key}")
+            raise
+
+    def size(self, key: str) -> int:
+        try:
+            return self._client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except self._client_error as e:
+            if self._missing(e):
+                raise StorageError(f"No such object: {key}")
+            raise
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.size(key)
+            return True
+        except StorageError:
+            return False
+
+    def delete(self, keys: Iterable[str]):
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):  # DeleteObjects takes up to 1000 keys
+            batch = [{"Key": key} for key in keys[start:start + 1000]]
+            self._client.delete_objects(Bucket=self.bucket, Delete={"Objects": batch, "Quiet": True})
+
+    def delete_prefix(self, prefix: str):
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix.rstrip("/") + "/"):
+            self.delete(item["Key"] for item in page.get("Contents", []))
+
+    def presign_upload(self, key: str, content_type: str, expires: int = UPLOAD_URL_EXPIRES) -> PresignedUpload:
+        # A plain PUT cannot cap its size; the import checks it (size()) before reading anything
+        url = self._presign_client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": key, "ContentType": content_type},
+            ExpiresIn=expires,
+        )
+        return PresignedUpload(
+            key=key,
+            url=url,
+            method="PUT",
+            expires_at=datetime.now(timezone.utc) + timedelta(seconds=expires),
+            headers={"Content-Type": content_type},
+        )
+
+
+# --- 3. The Configured Backend ---
+_storage: Optional[BlobStorage] = None
+
+
+def get_storage() -> BlobStorage:
+    """The backend chosen by STORAGE_BACKEND, created on first use (also in worker processes)."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "s3":
+            _storage = S3Storage()
+        elif STORAGE_BACKEND == "local":
+            _storage = LocalStorage()
+        else:
+            raise RuntimeError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _storage
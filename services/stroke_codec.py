@@ -0,0 +1,334 @@
+"""
+Compact stroke encoding for overlay_data.
+
+A stroke's "points" ([[x, y, ...], ...]) can be stored and sent packed, still inside the JSON:
+
+    {"$packed": "qdelta/1", "dims": 3, "count": 120, "scale": 1000, "ints": true,
+     "origin": [412345, 80210, 512], "dtype": "i2", "data": "<base64>"}
+
+Coordinates are quantized to 1/scale. The first point is kept as integers in "origin"; the
+rest are deltas from their predecessor, written as little-endian int16 (int32 when a jump
+does not fit).
+
+Packing never changes a stroke. A stroke is only packed if every coordinate comes back
+exactly (at the default scale of 1000: at most three decimals) and with its JSON type: with
+"ints" set, whole values decode as integers and the rest as floats; without it, all decode
+as floats. A stroke that cannot be packed that way (more decimals, or 2.0 next to 2) stays
+plain. Coordinates must be finite numbers with |value| * scale <= 2**53, packed or not;
+check_overlay rejects anything else, and the API answers 422.
+
+Anything that is not a plain numeric point list is left alone, so an overlay may mix packed
+and plain strokes. Overlay ops always address the plain form: services.overlay unpacks
+before checking or applying them, and compaction packs the result again (for_storage).
+
+NumPy is used when installed (imported on first use, not at startup); otherwise the same
+bytes are produced with the array module.
+"""
+import array
+import base64
+import binascii
+import math
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+# CONFIGURATION
+STROKE_STORAGE_FORMAT = os.getenv("STROKE_STORAGE_FORMAT", "json").lower()  # json, or packed (applied on write)
+STROKE_QUANTIZE_SCALE = int(os.getenv("STROKE_QUANTIZE_SCALE", 1000))        # Steps per unit (1000 = 0.001 px)
+
+FORMAT_JSON = "json"      # Every stroke has plain point lists
+FORMAT_PACKED = "packed"  # Strokes may be packed (clients asking for this accept both forms)
+FORMATS = (FORMAT_JSON, FORMAT_PACKED)
+
+PACKED_TAG = "qdelta/1"
+STROKE_COLLECTIONS = ("strokes",)  # Top-level overlay lists whose elements carry "points"
+
+_ITEM_SIZES = {"i2": 2, "i4": 4}
+_INT16 = (-(2 ** 15), 2 ** 15 - 1)
+_INT32 = (-(2 ** 31), 2 ** 31 - 1)
+_QUANTIZED_MAX = 2 ** 53  # Largest |value| * scale: exact in a float64, so unpacking divides back exactly
+
+
+class StrokeCodecError(ValueError):
+    """A packed point list that does not decode, or a coordinate that is not a finite number in range."""
+
+
+_np = False  # Not looked up yet
+
+
+def _numpy():
+    """NumPy, or None if it is not installed (the pure-Python codec is slower but byte-identical)."""
+    global _np
+    if _np is False:
+        try:
+            import numpy
+            _np = numpy
+        except ImportError:
+            _np = None
+    return _np
+
+
+# --- 1. Points ---
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _in_range(value, scale: int) -> bool:
+    if isinstance(value, float) and not math.isfinite(value):
+        return False
+    return abs(value) * scale <= _QUANTIZED_MAX
+
+
+def _is_point_list(points: Any) -> Optional[int]:
+    """The number of dimensions if points is a non-empty list of equal-length numeric lists."""
+    if not isinstance(points, list) or not points or not isinstance(points[0], list):
+        return None
+    dims = len(points[0])
+    if not 1 <= dims <= 8:
+        return None
+    for point in points:
+        if not isinstance(point, list) or len(point) != dims:
+            return None
+        for value in point:
+            if not _is_number(value):
+                return None
+    return dims
+
+
+def _ints_flag(points: List[List[float]]) -> Optional[bool]:
+    """
+    The "ints" header that brings every value back with its own type: False if all are
+    floats, True if no float is whole (so whole means int), None if neither holds.
+    """
+    has_int = has_whole_float = False
+    for point in points:
+        for value in point:
+            if isinstance(value, int):
+                has_int = True
+            elif value.is_integer():
+                has_whole_float = True
+            if has_int and has_whole_float:
+                return None
+    return has_int
+
+
+def _pick_dtype(low: int, high: int) -> Optional[str]:
+    if _INT16[0] <= low and high <= _INT16[1]:
+        return "i2"
+    if _INT32[0] <= low and high <= _INT32[1]:
+        return "i4"
+    return None
+
+
+def pack_points(points: List[List[float]], scale: int = STROKE_QUANTIZE_SCALE) -> Optional[Dict[str, Any]]:
+    """
+    The packed form of a point list, or None if it cannot be packed without changing it
+    (not numeric, out of range, finer than 1/scale, or types that would not survive).
+    """
+    dims = _is_point_list(points)
+    if dims is None or not all(_in_range(value, scale) for point in points for value in point):
+        return None
+    ints = _ints_flag(points)
+    if ints is None:
+        return None
+    np = _numpy()
+    if np is not None:
+        values = np.asarray(points, dtype=np.float64)
+        quantized = np.rint(values * scale).astype(np.int64)
+        if not np.array_equal(quantized / scale, values):
+            return None
+        origin = quantized[0].tolist()
+        deltas = np.diff(quantized, axis=0)
+        dtype = _pick_dtype(int(deltas.min()), int(deltas.max())) if deltas.size else "i2"
+        if dtype is None:
+            return None
+        data = deltas.astype("<" + dtype).tobytes()
+    else:
+        quantized = [[round(value * scale) for value in point] for point in points]
+        if any(q / scale != value for point, row in zip(points, quantized) for value, q in zip(point, row)):
+            return None
+        origin = quantized[0]
+        deltas = [q - p for previous, row in zip(quantized, quantized[1:]) for p, q in zip(previous, row)]
+        dtype = _pick_dtype(min(deltas), max(deltas)) if deltas else "i2"
+        if dtype is None:
+            return None
+        packed = array.array("h" if dtype == "i2" else "i", deltas)
+        if sys.byteorder == "big":
+            packed.byteswap()
+        data = packed.tobytes()
+    result = {
+        "$packed": PACKED_TAG,
+        "dims": dims,
+        "count": len(points),
+        "scale": scale,
+        "origin": origin,
+        "dtype": dtype,
+        "data": base64.b64encode(data).decode("ascii"),
+    }
+    if ints:
+        result["ints"] = True
+    return result
+
+
+def is_packed(points: Any) -> bool:
+    return isinstance(points, dict) and points.get("$packed") == PACKED_TAG
+
+
+def _decode(packed: Dict[str, Any]) -> bytes:
+    """The raw delta bytes, after checking the header against them."""
+    try:
+        dims, count, scale, origin = packed["dims"], packed["count"], packed["scale"], packed["origin"]
+        data = base64.b64decode(packed["data"], validate=True)
+        item_size = _ITEM_SIZES[packed["dtype"]]
+    except (KeyError, TypeError, binascii.Error) as e:
+        raise StrokeCodecError(f"Malformed packed points: {e!r}")
+    if not (isinstance(dims, int) and isinstance(count, int) and dims >= 1 and count >= 1
+            and isinstance(scale, int) and scale > 0
+            and isinstance(origin, list) and len(origin) == dims
+            and all(isinstance(value, int) and not isinstance(value, bool) for value in origin)
+            and all(abs(value) <= _QUANTIZED_MAX for value in origin)
+            and isinstance(packed.get("ints", False), bool)
+            and len(data) == (count - 1) * dims * item_size):
+        raise StrokeCodecError("Packed points header does not match the data")
+    return data
+
+
+def check_points(points: Any):
+    """
+    Raises StrokeCodecError if points claims to be packed but would not decode, or is a
+    plain point list with a coordinate that is not finite or out of range.
+    """
+    if is_packed(points):
+        _decode(points)
+    elif isinstance(points, list):
+        for point in points:
+            for value in point if isinstance(point, list) else ():
+                if _is_number(value) and not _in_range(value, STROKE_QUANTIZE_SCALE):
+                    raise StrokeCodecError(f"Stroke coordinate out of range: {value!r}")
+
+
+def _from_quantized(rows: List[List[int]], scale: int, ints: bool) -> List[List[float]]:
+    if ints:
+        return [[q // scale if q % scale == 0 else q / scale for q in row] for row in rows]
+    return [[q / scale for q in row] for row in rows]
+
+
+def unpack_points(packed: Dict[str, Any]) -> List[List[float]]:
+    data = _decode(packed)
+    dims, count, scale, origin = packed["dims"], packed["count"], packed["scale"], packed["origin"]
+    ints = packed.get("ints", False)
+    np = _numpy()
+    if np is not None:
+        quantized = np.empty((count, dims), dtype=np.int64)
+        quantized[0] = origin
+        quantized[1:] = np.frombuffer(data, dtype="<" + packed["dtype"]).reshape(count - 1, dims)
+        quantized = np.cumsum(quantized, axis=0)
+        return _from_quantized(quantized.tolist(), scale, ints) if ints else (quantized / scale).tolist()
+    deltas = array.array("h" if packed["dtype"] == "i2" else "i")
+    deltas.frombytes(data)
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    current = list(origin)
+    rows = [list(current)]
+    for i in range(count - 1):
+        for d in range(dims):
+            current[d] += deltas[i * dims + d]
+        rows.append(list(current))
+    return _from_quantized(rows, scale, ints)
+
+
+# --- 2. Overlays ---
+def _map_strokes(overlay: Optional[Dict[str, Any]], convert) -> Optional[Dict[str, Any]]:
+    """A shallow copy of overlay with convert(points) applied to every stroke that changes."""
+    if not isinstance(overlay, dict):
+        return overlay
+    result = overlay
+    for collection in STROKE_COLLECTIONS:
+        strokes = overlay.get(collection)
+        if not isinstance(strokes, list):
+            continue
+        converted = []
+        changed = False
+        for stroke in strokes:
+            points = stroke.get("points") if isinstance(stroke, dict) else None
+            new_points = convert(points) if points is not None else None
+            if new_points is not None and new_points is not points:
+                stroke = {**stroke, "points": new_points}
+                changed = True
+            converted.append(stroke)
+        if changed:
+            if result is overlay:
+                result = dict(overlay)
+            result[collection] = converted
+    return result
+
+
+def pack_overlay(overlay: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    def pack(points):
+        if is_packed(points):
+            check_points(points)  # Already packed by the client: keep, but only if it decodes
+            return None
+        return pack_points(points)  # None (stays plain) unless it round-trips exactly
+    return _map_strokes(overlay, pack)
+
+
+def unpack_overlay(overlay: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return _map_strokes(overlay, lambda points: unpack_points(points) if is_packed(points) else None)
+
+
+def format_of(overlay: Optional[Dict[str, Any]]) -> str:
+    """FORMAT_PACKED if any stroke is packed, for Page.overlay_format."""
+    if isinstance(overlay, dict):
+        for collection in STROKE_COLLECTIONS:
+            strokes = overlay.get(collection)
+            if isinstance(strokes, list):
+                for stroke in strokes:
+                    if isinstance(stroke, dict) and is_packed(stroke.get("points")):
+                        return FORMAT_PACKED
+    return FORMAT_JSON
+
+
+def check_overlay(overlay: Optional[Dict[str, Any]]):
+    """Raises StrokeCodecError for the first stroke check_points rejects."""
+    def check(points):
+        check_points(points)
+        return None
+    _map_strokes(overlay, check)
+
+
+def check_at(path: List[str], value: Any):
+    """
+    check_overlay for a value an op writes at a (split) JSON pointer path: the same rules as
+    for a whole overlay, applied to whatever part of one the value is.
+    """
+    if not path:
+        check_overlay(value)
+    elif path[0] in STROKE_COLLECTIONS:
+        if len(path) <= 2:
+            check_overlay({path[0]: value if len(path) == 1 else [value]})
+        elif path[2] == "points" and len(path) <= 5:
+            points = value
+            for _ in range(len(path) - 3):  # A point, or a single coordinate
+                points = [points]
+            check_points(points)
+
+
+def for_storage(overlay: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    What a write stores: packed when STROKE_STORAGE_FORMAT=packed, otherwise plain points.
+    Raises StrokeCodecError if a stroke does not pass check_points.
+    """
+    check_overlay(overlay)
+    if STROKE_STORAGE_FORMAT == FORMAT_PACKED:
+        return pack_overlay(overlay)
+    return unpack_overlay(overlay)
+
+
+def for_client(overlay: Optional[Dict[str, Any]], overlay_format: str) -> Optional[Dict[str, Any]]:
+    """
+    An overlay in the format the client asked for. Reads never pack: packed clients
+    accept plain strokes, and rows are converted lazily on their next write.
+    """
+    if overlay_format == FORMAT_PACKED:
+        return overlay
+    return unpack_overlay(overlay)
@@ -0,0 +1,105 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+# CONFIGURATION
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))       # Max cached subjects (LRU beyond this)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))          # Seconds before a snapshot is re-read
+# Serve the profile from signed token claims, without a lookup. A token keeps the profile it was
+# issued with until it expires: PUT /user/me hands the caller a fresh one, other sessions lag.
+USER_CACHE_TRUST_CLAIMS = os.getenv("USER_CACHE_TRUST_CLAIMS", "false").lower() in ("1", "true", "yes")
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """
+    Detached, read-only copy of a User row. Safe to share between requests
+    because it is not bound to any session.
+    """
+    id: int
+    email: str
+    name: Optional[str] = None
+    avatar_url: Optional[str] = None
+    provider: str = "email"
+
+    @classmethod
+    def from_user(cls, user) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            email=user.email,
+            name=user.name,
+            avatar_url=user.avatar_url,
+            provider=user.provider or "email",
+        )
+
+    @classmethod
+    def from_claims(cls, payload: dict) -> Optional["UserSnapshot"]:
+        """Builds a snapshot from signed token claims, or None if they are missing."""
+        subject = str(payload.get("sub", ""))
+        if not subject.isdigit() or payload.get("email") is None:
+            return None
+        return cls(
+            id=int(subject),
+            email=payload["email"],
+            name=payload.get("name"),
+            avatar_url=payload.get("picture"),
+            provider=payload.get("provider", "email"),
+        )
+
+
+class UserCache:
+    """In-process TTL + LRU cache of UserSnapshots keyed by token subject."""
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, UserSnapshot]]" = OrderedDict()
+        self._keys_by_user: Dict[int, Set[str]] = {}  # A user may be cached under an id and a legacy email subject
+
+    def get(self, key: str) -> Optional[UserSnapshot]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.invalidate(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, user: UserSnapshot):
+        if self.maxsize <= 0:
+            return
+        self.invalidate(key)  # The key may have pointed at another user before
+        self._entries[key] = (time.monotonic() + self.ttl, user)
+        self._keys_by_user.setdefault(user.id, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self.invalidate(next(iter(self._entries)))
+
+    def invalidate(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[1].id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[1].id]
+
+    def invalidate_user(self, user_id: int):
+        for key in self._keys_by_user.pop(user_id, ()):
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache()
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Integer, bindparam, case, delete, update
+
+import models
+from database import AsyncSessionLocal
+from services import stroke_codec
+
+logger = logging.getLogger(__name__)
+
+# CONFIGURATION
+# Single-process deployments only: see OverlayWriteBuffer
+OVERLAY_WRITE_BUFFER = os.getenv("OVERLAY_WRITE_BUFFER", "false").lower() in ("1", "true", "yes")
+OVERLAY_FLUSH_INTERVAL = float(os.getenv("OVERLAY_FLUSH_INTERVAL", 1.0))   # Seconds between background flushes
+OVERLAY_BUFFER_MAX_PAGES = int(os.getenv("OVERLAY_BUFFER_MAX_PAGES", 500))  # Flush early once this many pages are dirty
+
+
+@dataclass
+class BufferedOverlay:
+    page_id: int
+    owner_id: int
+    note_id: int
+    page_number: int
+    background_type: str
+    background_url: Optional[str]
+    renditions: Optional[Dict[str, str]]
+    overlay_data: Dict[str, Any]  # As it will be stored (see stroke_codec.for_storage)
+    overlay_version: int  # What Page.overlay_version will be once this entry is flushed (written as is)
+    revision: int = 0     # Changes with every save merged into the entry (overlay_version may not)
+
+
+class OverlayWriteBuffer:
+    """
+    Write-behind buffer for full overlay saves. Keeps only the latest overlay per
+    page and writes it to Postgres on an interval, on a size threshold, and on
+    shutdown. Reads consult it first (read-your-writes).
+
+    The buffer lives in one process, and so does read-your-writes: with several workers,
+    a save buffered by one is invisible to the others until it is flushed, and their
+    versions can disagree. Enable it only where one process serves all overlay traffic.
+
+    Versions are handed out here: a flush stores each entry's overlay_version as it was
+    promised, instead of counting increments, so a failed flush cannot leave the stored
+    version behind what clients were told.
+    """
+
+    def __init__(self, interval: float = OVERLAY_FLUSH_INTERVAL, max_pages: int = OVERLAY_BUFFER_MAX_PAGES):
+        self.interval = interval
+        self.max_pages = max_pages
+        self.writes_received = 0
+        self.rows_flushed = 0
+        self.flushes = 0
+        self._pending: Dict[int, BufferedOverlay] = {}
+        self._in_flight: Dict[int, BufferedOverlay] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Lifecycle ---
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        logger.info("Overlay write buffer stopped: %s", self.stats())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Overlay write buffer flush failed; will retry")
+
+    # --- Reads / Writes ---
+    def get(self, page_id: int) -> Optional[BufferedOverlay]:
+        return self._pending.get(page_id) or self._in_flight.get(page_id)
+
+    async def put(self, entry: BufferedOverlay) -> BufferedOverlay:
+        previous = self.get(entry.page_id)
+        if previous is not None:
+            # Saves merged into a pending entry share its version; one already being written gets the next
+            bump = 0 if entry.page_id in self._pending else 1
+            entry = replace(entry, overlay_version=previous.overlay_version + bump)
+
+        self.writes_received += 1
+        entry = replace(entry, revision=self.writes_received)
+        self._pending[entry.page_id] = entry
+        if len(self._pending) >= self.max_pages:
+            await self.flush()
+        return entry
+
+    # --- Flushing ---
+    async def flush_page(self, page_id: int):
+        """Forces one page to disk, e.g. before applying deltas on top of it."""
+        if self.get(page_id) is not None:
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._in_flight, self._pending = self._pending, {}
+            entries: List[BufferedOverlay] = list(self._in_flight.values())
+            try:
+                await self._write(entries)
+            except BaseException:
+                # Put back whatever was not overwritten by a newer save in the meantime
+                for entry in entries:
+                    self._pending.setdefault(entry.page_id, entry)
+                raise
+            finally:
+                self._in_flight = {}
+            self.flushes += 1
+            self.rows_flushed += len(entries)
+
+    async def _write(self, entries: List[BufferedOverlay]):
+        pages = models.Page.__table__
+        promised = bindparam("b_overlay_version", type_=Integer)
+        # Another writer (e.g. the ops endpoint) may have moved past the promise meanwhile: stay ahead of it
+        version = case((pages.c.overlay_version < promised, promised), else_=pages.c.overlay_version + 1)
+        stmt = (
+            update(pages)
+            .where(pages.c.id == bindparam("b_page_id"))
+            .values(
+                overlay_data=bindparam("b_overlay_data", type_=pages.c.overlay_data.type),
+                overlay_format=bindparam("b_overlay_format"),
+                overlay_version=version,
+                overlay_base_version=version,
+            )
+        )
+        async with AsyncSessionLocal() as db:
+            await db.execute(stmt, [
+                {
+                    "b_page_id": entry.page_id,
+                    "b_overlay_data": entry.overlay_data,
+                    "b_overlay_format": stroke_codec.format_of(entry.overlay_data),
+                    "b_overlay_version": entry.overlay_version,
+                }
+                for entry in entries
+            ])
+            # A full overlay supersedes any pending deltas
+            await db.execute(
+                delete(models.PageOverlayDelta)
+                .where(models.PageOverlayDelta.page_id.in_([entry.page_id for entry in entries]))
+            )
+            await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "writes_received": self.writes_received,
+            "writes_absorbed": self.writes_received - self.rows_flushed - len(self._pending) - len(self._in_flight),
+            "rows_flushed": self.rows_flushed,
+            "flushes": self.flushes,
+            "pending_pages": len(self._pending),
+        }
+
+
+overlay_buffer = OverlayWriteBuffer()
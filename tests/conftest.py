@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Settings are read at import time: point everything at throwaway local backends first
+_scratch = tempfile.mkdtemp(prefix="neurolearn-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_scratch}/test.db")
+os.environ.setdefault("SECRET_KEY", "test-secret-for-the-suite-only-0123456789")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("IMPORT_SPOOL_DIR", os.path.join(_scratch, "imports"))
+os.environ.setdefault("UPLOAD_DIRECTORY", os.path.join(_scratch, "uploads"))
+os.environ.setdefault("SESSION_SECRET_KEY", "test-session-secret")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def database():
+    """Empty tables for one test (SQLite unless DATABASE_URL says otherwise)."""
+    import models  # noqa: F401  (registers the tables)
+    from database import Base, engine
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()  # Pooled connections belong to this test's event loop
+
+
+async def _user_token(email: str) -> str:
+    import models
+    import security
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as db:
+        user = models.User(email=email, hashed_password="x", name=email.split("@")[0])
+        db.add(user)
+        await db.commit()
+        return security.create_access_token(security.user_token_claims(user))
+
+
+@pytest.fixture
+async def client(database):
+    """
+    An httpx client for the app, signed in as a fresh user. The lifespan does not run, so the
+    import queue, write buffer and live hub are only started by tests that need them.
+    """
+    import httpx
+    from main import app
+
+    headers = {"Authorization": f"Bearer {await _user_token('api@test.local')}"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", headers=headers) as client:
+        yield client
@@ -0,0 +1,226 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from services import admission
+from services.admission import (
+    AdmissionMiddleware, ConcurrencyLimiter, InMemoryRateLimitStore, RateLimiter, RedisRateLimitStore,
+    Rejected, RouteLimit, parse_rate,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def test_parse_rate():
+    assert parse_rate("10/minute").capacity == 10
+    assert parse_rate("10/minute").per_second == pytest.approx(10 / 60)
+    assert parse_rate("30/minutes:60").capacity == 60
+    assert parse_rate("") is None
+    with pytest.raises(ValueError):
+        parse_rate("10/fortnight")
+    with pytest.raises(ValueError):
+        parse_rate("0/second")
+
+
+async def test_memory_store_bucket():
+    store = InMemoryRateLimitStore()
+    rate = parse_rate("2/second")
+    assert await store.take("k", rate) == 0
+    assert await store.take("k", rate) == 0
+    assert 0 < await store.take("k", rate) <= 0.5
+    assert await store.take("other", rate) == 0  # Keys are separate buckets
+
+
+async def test_memory_store_evicts_oldest():
+    store = InMemoryRateLimitStore(maxsize=2)
+    rate = parse_rate("1/hour")
+    for key in ("a", "b", "c"):
+        await store.take(key, rate)
+    assert await store.take("a", rate) == 0  # Forgotten, so full again
+    assert await store.take("c", rate) > 0
+
+
+async def test_redis_store():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    client = fakeredis.FakeAsyncRedis()
+    store = RedisRateLimitStore(client=client)
+    rate = parse_rate("1/minute:2")
+    assert await store.take("k", rate) == 0
+    assert await store.take("k", rate) == 0
+    assert 59 <= await store.take("k", rate) <= 60
+    assert await client.pttl("ratelimit:k") > 0  # Idle buckets expire
+    await store.close()
+
+
+async def test_rate_limiter_rejects_and_counts():
+    limiter = RateLimiter("t", "1/minute", store=InMemoryRateLimitStore())
+    await limiter.check("user:1")
+    with pytest.raises(Rejected) as e:
+        await limiter.check("user:1")
+    assert e.value.retry_after == 60
+    await limiter.check("user:2")
+    assert limiter.stats() == {"allowed": 2, "limited": 1, "store_errors": 0}
+
+
+async def test_rate_limiter_admits_when_store_fails():
+    class Broken(InMemoryRateLimitStore):
+        async def take(self, key, rate):
+            raise ConnectionError
+
+    limiter = RateLimiter("t", "1/minute", store=Broken())
+    await limiter.check("x")
+    await limiter.check("x")
+    assert limiter.stats()["store_errors"] == 2
+
+
+async def test_rate_limiter_off(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_CONTROL", False)
+    limiter = RateLimiter("t", "1/hour", store=InMemoryRateLimitStore())
+    for _ in range(3):
+        await limiter.check("x")
+
+
+async def test_concurrency_queue_in_order():
+    limiter = ConcurrencyLimiter("t", limit=1, queue=2, timeout=5)
+    order = []
+    release = asyncio.Event()
+
+    async def hold(name):
+        async with limiter.slot("u"):
+            order.append(name)
+            await release.wait()
+
+    tasks = [asyncio.create_task(hold(name)) for name in ("a", "b", "c")]
+    await asyncio.sleep(0)
+    assert order == ["a"]
+    assert limiter.stats()["waiting"] == 2
+    with pytest.raises(Rejected):
+        limiter.check_queue("u")
+    with pytest.raises(Rejected):
+        async with limiter.slot("u"):
+            pass
+    limiter.check_queue("other")  # Other keys are not affected
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == ["a", "b", "c"]
+    assert limiter.stats() == {"active": 0, "waiting": 0, "admitted": 3, "queued": 2, "rejected": 2, "timeouts": 0}
+
+
+async def test_concurrency_timeout():
+    limiter = ConcurrencyLimiter("t", limit=1, queue=1, timeout=0.01)
+    async with limiter.slot():
+        with pytest.raises(Rejected):
+            async with limiter.slot():
+                pass
+    assert limiter.stats()["timeouts"] == 1
+    async with limiter.slot():  # The slot came back
+        pass
+
+
+async def test_concurrency_cancelled_waiter_frees_its_place():
+    limiter = ConcurrencyLimiter("t", limit=1, queue=1, timeout=5)
+    async with limiter.slot():
+        waiter = asyncio.create_task(limiter.slot().__aenter__())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+    assert limiter.stats()["active"] == 0
+    assert limiter.stats()["waiting"] == 0
+
+
+# --- Middleware ---
+@pytest.fixture
+def app_and_calls():
+    calls = []
+
+    async def upload(request):
+        body = await request.body()
+        calls.append(len(body))
+        return JSONResponse({"size": len(body)})
+
+    limit = RateLimiter("upload", "1/minute", store=InMemoryRateLimitStore())
+    queue = ConcurrencyLimiter("import", limit=1, queue=0, timeout=1)
+    routes = [RouteLimit("POST", "/upload", limit, queues=(queue,))]
+    app = Starlette(routes=[Route("/upload", upload, methods=["POST"])])
+    app.add_middleware(AdmissionMiddleware, user_id=lambda header: 7 if header == "Bearer seven" else None, routes=routes)
+    return app, calls, queue
+
+
+def _client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def test_middleware_rejects_before_reading_body(app_and_calls):
+    app, calls, _ = app_and_calls
+    received = []
+
+    async def counting(scope, receive, send):
+        async def counted_receive():
+            message = await receive()
+            received.append(message["type"])
+            return message
+        await app(scope, counted_receive, send)
+
+    async with _client(counting) as client:
+        ok = await client.post("/upload", content=b"x" * 1000, headers={"Authorization": "Bearer seven"})
+        assert ok.status_code == 200
+        received.clear()
+        over = await client.post("/upload", content=b"x" * 1000, headers={"Authorization": "Bearer seven"})
+
+    assert over.status_code == 429
+    assert over.headers["Retry-After"] == "60"
+    assert calls == [1000]
+    assert "http.request" not in received
+
+
+async def test_middleware_keys_by_user_then_ip(app_and_calls):
+    app, calls, _ = app_and_calls
+    async with _client(app) as client:
+        assert (await client.post("/upload", headers={"Authorization": "Bearer seven"})).status_code == 200
+        assert (await client.post("/upload")).status_code == 200  # Anonymous: limited by IP instead
+        assert (await client.post("/upload")).status_code == 429
+        assert (await client.get("/upload")).status_code == 405  # Other methods are not limited
+
+
+async def test_middleware_rejects_when_queue_full(app_and_calls):
+    app, calls, queue = app_and_calls
+    async with queue.slot():
+        async with _client(app) as client:
+            response = await client.post("/upload", headers={"Authorization": "Bearer seven"})
+    assert response.status_code == 429
+    assert calls == []
+
+
+async def test_middleware_ignores_a_trailing_slash(app_and_calls):
+    app, calls, _ = app_and_calls
+    async with _client(app) as client:
+        assert (await client.post("/upload", headers={"Authorization": "Bearer seven"})).status_code == 200
+        assert (await client.post("/upload/", headers={"Authorization": "Bearer seven"})).status_code == 429
+
+
+async def test_middleware_queue_check_only_for_large_bodies():
+    async def create(request):
+        return JSONResponse({"size": len(await request.body())})
+
+    queue = ConcurrencyLimiter("import", limit=1, queue=0, timeout=1)
+    limit = RateLimiter("create", "100/minute", store=InMemoryRateLimitStore())
+    app = Starlette(routes=[Route("/notes", create, methods=["POST"])])
+    app.add_middleware(
+        AdmissionMiddleware, user_id=lambda header: 7,
+        routes=[RouteLimit("POST", "/notes", limit, queues=(queue,), queue_min_bytes=100)],
+    )
+    async with queue.slot():
+        async with _client(app) as client:
+            assert (await client.post("/notes", data={"title": "blank"})).status_code == 200
+            assert (await client.post("/notes", content=b"x" * 100)).status_code == 429
+
+            async def chunked():
+                yield b"x"
+            assert (await client.post("/notes", content=chunked())).status_code == 429  # Size unknown
@@ -0,0 +1,55 @@
+import httpx
+import pytest
+
+from benchmarks.harness import Scenario, compare, run_scenario
+
+pytestmark = pytest.mark.anyio
+
+
+def _client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://test")
+
+
+async def test_unexpected_statuses_are_reported_separately():
+    async def request(client, seq):
+        return await client.get(f"/{seq}")
+
+    # Every fourth request is rate limited
+    handler = lambda request: httpx.Response(429 if int(request.url.path[1:]) % 4 == 0 else 200)
+    async with _client(handler) as client:
+        result = await run_scenario(client, Scenario("s", request, requests=40, concurrency=4, warmup=0))
+
+    assert result["requests"] == 30
+    assert result["unexpected_status"] == 10
+    assert result["status_codes"] == {"200": 30, "429": 10}
+    assert result["errors"] == 0
+    assert result["unexpected_latency_ms"] is not None
+
+
+async def test_expected_statuses():
+    async def request(client, seq):
+        return await client.get("/")
+
+    async with _client(lambda request: httpx.Response(202)) as client:
+        result = await run_scenario(client, Scenario("s", request, requests=5, warmup=0, expected_statuses=(200, 202)))
+    assert result["requests"] == 5
+    assert result["unexpected_status"] == 0
+    assert result["unexpected_latency_ms"] is None
+
+
+def _result(p50, statuses, errors=0):
+    latency = {"p50": p50, "p95": p50, "p99": p50}
+    return {"latency_ms": latency, "throughput_rps": 100.0, "status_codes": statuses, "errors": errors}
+
+
+def test_compare_same_mix():
+    lines = compare({"s": _result(10, {"200": 100})}, {"s": _result(20, {"200": 50})})
+    assert lines == ["s: p50 20→10 ms (-50.0%), p95 20→10 ms (-50.0%), p99 20→10 ms (-50.0%), "
+                     "100.0→100.0 req/s (+0.0%)"]
+
+
+def test_compare_refuses_different_mix():
+    lines = compare({"s": _result(1, {"200": 76, "429": 24})}, {"s": _result(20, {"200": 100})})
+    assert lines == ["s: not compared, status mix differs (200: 100% → 200: 76%, 429: 24%)"]
+    lines = compare({"s": _result(1, {"200": 90}, errors=10)}, {"s": _result(20, {"200": 100})})
+    assert "not compared" in lines[0]
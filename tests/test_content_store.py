@@ -0,0 +1,125 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete, insert
+
+import models
+from database import AsyncSessionLocal
+from services import content_store, rasterizer
+from services.rasterizer import RenderedPage, SpooledUpload
+
+pytestmark = pytest.mark.anyio
+
+DIGEST = "ab" * 32
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """Fake rasterizer (two pages, no files) and a log of what would be deleted from storage."""
+    async def rasterize(pdf_path, note_id, total_pages=None, base_dir=None, **kwargs):
+        rendered.calls += 1
+        for number in (1, 2):
+            yield [RenderedPage(page_number=number, background_url=f"/static/uploads/{base_dir}/page_{number}.png", renditions={})]
+
+    async def remove_files(prefix=None, files=()):
+        rendered.removed.append((prefix, sorted(files)))
+
+    rendered.calls = 0
+    rendered.removed = []
+    monkeypatch.setattr(rasterizer, "rasterize_pdf", rasterize)
+    monkeypatch.setattr(content_store, "remove_files", remove_files)
+    return rendered
+
+
+async def _note() -> int:
+    async with AsyncSessionLocal() as db:
+        user = models.User(email=f"{os.urandom(4).hex()}@test.local", hashed_password="x")
+        db.add(user)
+        await db.flush()
+        note = models.Note(title="PDF", owner_id=user.id)
+        db.add(note)
+        await db.commit()
+        return note.id
+
+
+async def _import(note_id: int):
+    """Runs an import of DIGEST into note_id and commits it like the notes router does."""
+    async with AsyncSessionLocal() as db:
+        pdf_import = content_store.PdfImport(db, SpooledUpload(path="unused.pdf", digest=DIGEST), note_id)
+        pages = [page async for batch in pdf_import.batches() for page in batch]
+        await db.execute(insert(models.Page), content_store.page_rows(note_id, pages))
+        await db.commit()
+        return pages
+
+
+async def _blob():
+    async with AsyncSessionLocal() as db:
+        return await db.get(models.PdfBlob, DIGEST)
+
+
+async def _delete_note(note_id: int) -> str:
+    """Drops the note and its reference, as DELETE /notes/{id} does; the prefix if it was the last."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(models.Page).where(models.Page.note_id == note_id))
+        await db.execute(delete(models.Note).where(models.Note.id == note_id))
+        prefix = await content_store.release(db, DIGEST)
+        await db.commit()
+        return prefix
+
+
+async def test_identical_uploads_share_one_render(database, rendered):
+    first_note, second_note = await _note(), await _note()
+    first = await _import(first_note)
+    second = await _import(second_note)
+
+    assert rendered.calls == 1
+    assert [page.background_url for page in second] == [page.background_url for page in first]
+    blob = await _blob()
+    assert blob.status == "ready" and blob.ref_count == 2
+
+    assert await _delete_note(first_note) is None
+    assert (await _blob()).ref_count == 1
+    assert await _delete_note(second_note) == blob.prefix  # The last reference: the caller deletes the files
+    assert await _blob() is None
+
+
+async def test_abandoned_render_releases_the_claim(database, rendered):
+    note_id = await _note()
+    async with AsyncSessionLocal() as db:
+        pdf_import = content_store.PdfImport(db, SpooledUpload(path="unused.pdf", digest=DIGEST), note_id)
+        async for _ in pdf_import.batches():
+            break  # The caller fails before committing anything
+        await db.rollback()
+        await pdf_import.abandon()
+
+    assert await _blob() is None
+    assert rendered.removed == [(pdf_import.prefix, [])]
+    await _import(note_id)  # The next upload claims the digest again
+    assert rendered.calls == 2
+
+
+async def test_live_claim_is_left_alone_and_stale_one_taken_over(database, rendered):
+    async with AsyncSessionLocal() as db:
+        db.add(models.PdfBlob(digest=DIGEST, status="rendering", prefix="cas/ab/old", ref_count=0))
+        await db.commit()
+    assert await content_store._claim(DIGEST) is None
+
+    async with AsyncSessionLocal() as db:
+        blob = await db.get(models.PdfBlob, DIGEST)
+        blob.created_at = datetime.now(timezone.utc) - timedelta(seconds=content_store.PDF_CLAIM_TIMEOUT + 1)
+        await db.commit()
+    prefix = await content_store._claim(DIGEST)
+
+    assert prefix and prefix != "cas/ab/old"
+    assert (await _blob()).prefix == prefix
+    assert rendered.removed == [("cas/ab/old", [])]
+
+
+async def test_page_files_skip_shared_images_unless_asked(database):
+    pages = [
+        {"background_url": "/static/uploads/cas/ab/x/page_1.png", "renditions": {"thumb": "/static/uploads/note_1_thumb.webp"}},
+        {"background_url": "/static/uploads/note_1_2.png", "renditions": {}},
+    ]
+    assert content_store.page_files(pages) == ["note_1_2.png", "note_1_thumb.webp"]
+    assert "cas/ab/x/page_1.png" in content_store.page_files(pages, include_cas=True)
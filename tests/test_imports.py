@@ -0,0 +1,200 @@
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import func, select
+
+import models
+from database import AsyncSessionLocal
+from services import rasterizer
+from services.imports import ImportJob, ImportQueue, ImportQueueFull, InMemoryImportJobStore
+from services.rasterizer import RenderedPage, SpooledUpload
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def render(monkeypatch):
+    """Fake rasterizer: two one-page batches, no files. Set render.fail_on to break a page."""
+    async def rasterize(pdf_path, note_id, total_pages=None, base_dir=None, **kwargs):
+        for number in (1, 2):
+            if number == render.fail_on:
+                raise RuntimeError("render broke")
+            name = f"{base_dir}/page_{number:04d}" if base_dir else f"note_{note_id}_{number}"
+            yield [RenderedPage(page_number=number, background_url=f"/static/uploads/{name}.png", renditions={})]
+
+    async def count(pdf_path):
+        return 2
+
+    render.fail_on = None
+    monkeypatch.setattr(rasterizer, "rasterize_pdf", rasterize)
+    monkeypatch.setattr(rasterizer, "count_pdf_pages", count)
+    return render
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return ImportQueue(InMemoryImportJobStore(), workers=1, maxsize=2, spool_dir=str(tmp_path / "spool"), job_ttl=60)
+
+
+async def _note(status="pending") -> int:
+    async with AsyncSessionLocal() as db:
+        user = models.User(email=f"{os.urandom(4).hex()}@test.local", hashed_password="x")
+        db.add(user)
+        await db.flush()
+        note = models.Note(title="Imported", owner_id=user.id, import_status=status)
+        db.add(note)
+        await db.commit()
+        return note.id
+
+
+async def _status(note_id: int):
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(models.Note.import_status).where(models.Note.id == note_id))
+
+
+async def _page_count(note_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count(models.Page.id)).where(models.Page.note_id == note_id))
+
+
+def _spool(queue: ImportQueue, digest: str = "ab" * 32) -> SpooledUpload:
+    os.makedirs(queue.spool_dir, exist_ok=True)
+    path = os.path.join(queue.spool_dir, f"{os.urandom(4).hex()}.pdf")
+    open(path, "wb").close()
+    return SpooledUpload(path=path, digest=digest)
+
+
+async def _finished(queue: ImportQueue, note_id: int) -> ImportJob:
+    for _ in range(200):
+        job = await queue.store.get(note_id)
+        if job and job.status in ("ready", "failed"):
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"import of note {note_id} did not finish")
+
+
+async def test_import_runs_to_ready(database, render, queue):
+    await queue.start(recover=False)
+    note_id = await _note()
+    upload = _spool(queue)
+    await queue.submit(note_id, upload)
+    assert (await queue.store.get(note_id)).status in ("pending", "running")
+
+    job = await _finished(queue, note_id)
+    await queue.stop()
+    assert job == ImportJob(note_id=note_id, status="ready", pages_done=2, pages_total=2)
+    assert await _status(note_id) == "ready"
+    assert await _page_count(note_id) == 2
+    assert not os.path.exists(upload.path)
+
+
+async def test_failed_import_keeps_committed_pages(database, render, queue):
+    render.fail_on = 2
+    await queue.start(recover=False)
+    note_id = await _note()
+    await queue.submit(note_id, _spool(queue))
+
+    job = await _finished(queue, note_id)
+    await queue.stop()
+    assert (job.status, job.pages_done, job.error) == ("failed", 1, "render broke")
+    assert await _status(note_id) == "failed"
+    assert await _page_count(note_id) == 1
+    async with AsyncSessionLocal() as db:
+        assert await db.scalar(select(func.count()).select_from(models.PdfBlob)) == 0  # Claim released
+
+
+async def test_full_queue_refuses(database, queue):
+    for _ in range(2):
+        await queue.submit(await _note(), _spool(queue))
+    upload = _spool(queue)
+    assert queue.full()
+    with pytest.raises(ImportQueueFull):
+        await queue.submit(await _note(), upload)
+    assert os.path.exists(upload.path)  # Still the caller's
+    assert queue.stats()["rejected"] == 1
+
+
+async def test_stop_fails_queued_jobs(database, queue):
+    note_id = await _note()
+    upload = _spool(queue)
+    await queue.submit(note_id, upload)  # No workers started: stays queued
+
+    await queue.stop()
+    assert (await queue.store.get(note_id)).status == "failed"
+    assert await _status(note_id) == "failed"
+    assert not os.path.exists(upload.path)
+    assert queue.stats()["queued"] == 0
+
+
+async def test_start_fails_leftover_imports(database, render, queue):
+    leftover = await _note("running")
+    done = await _note("ready")
+    stale = _spool(ImportQueue(InMemoryImportJobStore(), spool_dir=queue.spool_root))  # Never started, so unlocked
+
+    await queue.start(recover=True)
+    assert not os.path.exists(stale.path)
+    await asyncio.wait_for(queue._recovery, 5)
+    await queue.stop()
+    assert await _status(leftover) == "failed"
+    assert await _status(done) == "ready"
+
+
+async def test_queues_sharing_a_spool_dir_leave_each_other_alone(database, render, queue):
+    await queue.start(recover=False)
+    note_id = await _note()
+    upload = _spool(queue)
+
+    other = ImportQueue(InMemoryImportJobStore(), workers=1, spool_dir=queue.spool_root)
+    await other.start(recover=False)
+    await other.stop()
+    assert os.path.exists(upload.path)
+
+    await queue.submit(note_id, upload)
+    assert (await _finished(queue, note_id)).status == "ready"
+    await queue.stop()
+    assert not os.path.exists(queue.spool_dir)
+
+
+async def test_worker_survives_a_database_error(database, render, queue, monkeypatch):
+    broken = await _note()
+    set_note_status = queue._set_note_status
+
+    async def flaky(note_id, status):
+        if note_id == broken:
+            raise ConnectionError("database went away")
+        return await set_note_status(note_id, status)
+
+    monkeypatch.setattr(queue, "_set_note_status", flaky)
+    await queue.start(recover=False)
+    await queue.submit(broken, _spool(queue))
+    assert (await _finished(queue, broken)).error == "database went away"
+
+    note_id = await _note()
+    await queue.submit(note_id, _spool(queue))
+    assert (await _finished(queue, note_id)).status == "ready"
+    await queue.stop()
+
+
+async def test_deleted_note_is_skipped(database, render, queue):
+    note_id = await _note()
+    await queue.submit(note_id, _spool(queue))
+    async with AsyncSessionLocal() as db:
+        await db.delete(await db.get(models.Note, note_id))
+        await db.commit()
+    await queue.forget(note_id)
+
+    await queue.start(recover=False)
+    await asyncio.sleep(0.1)
+    await queue.stop()
+    assert await queue.store.get(note_id) is None
+    assert await _page_count(note_id) == 0
+
+
+async def test_finished_jobs_expire():
+    store = InMemoryImportJobStore()
+    await store.save(ImportJob(note_id=1, status="running"))
+    await store.save(ImportJob(note_id=2, status="ready"), ttl=0)
+    assert await store.get(1) is not None
+    assert await store.get(2) is None
+    assert len(store) == 1
@@ -0,0 +1,272 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import update
+
+from database import engine
+from services import rasterizer
+from services.rasterizer import RenderedPage
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def render(monkeypatch):
+    """Fake two-page rasterizer that records how many pooled connections were in use meanwhile."""
+    async def rasterize(pdf_path, note_id, total_pages=None, base_dir=None, **kwargs):
+        for number in (1, 2):
+            render.connections.append(engine.pool.checkedout())
+            if number == render.fail_on:
+                raise RuntimeError("render broke")
+            yield [RenderedPage(page_number=number, background_url=f"/static/uploads/{base_dir}/page_{number}.png", renditions={})]
+
+    render.fail_on = None
+    render.connections = []
+    monkeypatch.setattr(rasterizer, "rasterize_pdf", rasterize)
+    return render
+
+
+async def _blank_note(client, title: str = "Note") -> dict:
+    response = await client.post("/notes", data={"title": title})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def _upload_pdf(client, title: str = "Paper"):
+    return await client.post("/notes", data={"title": title}, files={"file": ("paper.pdf", b"%PDF-1.4 test", "application/pdf")})
+
+
+async def test_pdf_note_renders_without_holding_a_connection(client, render):
+    response = await _upload_pdf(client)
+    assert response.status_code == 200, response.text
+    note = response.json()
+    assert [page["page_number"] for page in note["pages"]] == [1, 2]
+    assert note["import_status"] == "ready"
+    assert render.connections == [0, 0]
+
+
+async def test_failed_pdf_import_leaves_no_note(client, render):
+    render.fail_on = 2
+    response = await _upload_pdf(client)
+    assert response.status_code == 500
+    assert (await client.get("/notes")).json()["items"] == []
+
+
+async def test_full_import_queue_is_429_for_pdfs_only(client, render, monkeypatch):
+    from services import import_queue
+
+    monkeypatch.setattr(import_queue, "full", lambda: True)
+    response = await client.post(
+        "/notes", data={"title": "Paper", "background": "true"}, files={"file": ("paper.pdf", b"%PDF-1.4", "application/pdf")}
+    )
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    assert (await _blank_note(client))["pages"]
+
+
+async def test_full_render_queues_refuse_pdf_uploads_up_front_but_not_blank_notes(client, render, monkeypatch):
+    from services import admission
+
+    def full(key=None):
+        raise admission.Rejected("import", 5)
+
+    monkeypatch.setattr(admission.import_slots, "check_queue", full)
+    big_pdf = b"%PDF-1.4" + b" " * admission.IMPORT_EARLY_REJECT_BYTES
+    response = await client.post("/notes/", data={"title": "Paper"}, files={"file": ("paper.pdf", big_pdf, "application/pdf")})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "5"
+    assert (await _blank_note(client))["pages"]
+
+
+async def test_overlay_replace_and_ops_share_one_version_sequence(client):
+    page_id = (await _blank_note(client))["pages"][0]["id"]
+
+    response = await client.post(f"/notes/pages/{page_id}/ops", json={
+        "base_version": 0, "ops": [{"op": "add_element", "element": {"id": "a", "points": [[1, 2]]}}],
+    })
+    assert response.json()["overlay_version"] == 1
+
+    response = await client.patch(f"/notes/pages/{page_id}", json={"overlay_data": {"strokes": []}})
+    assert response.status_code == 200
+    assert response.json()["overlay_version"] == 2
+
+    # The replace superseded the delta at version 1: an op on top of it gets 3, never a reused number
+    stale = await client.post(f"/notes/pages/{page_id}/ops", json={"base_version": 1, "ops": []})
+    assert stale.status_code == 409
+    response = await client.post(f"/notes/pages/{page_id}/ops", json={
+        "base_version": 2, "ops": [{"op": "add_element", "element": {"id": "b", "points": [[3, 4]]}}],
+    })
+    assert response.json()["overlay_version"] == 3
+
+
+async def test_overlay_replace_of_someone_elses_page_is_404(client):
+    response = await client.patch("/notes/pages/12345", json={"overlay_data": {}})
+    assert response.status_code == 404
+
+
+async def test_ops_on_packed_storage_address_plain_points(client, monkeypatch):
+    from services import stroke_codec
+
+    monkeypatch.setattr(stroke_codec, "STROKE_STORAGE_FORMAT", stroke_codec.FORMAT_PACKED)
+    note = await _blank_note(client)
+    page_id = note["pages"][0]["id"]
+    stroke = {"id": "a", "ts": 1.7e16, "points": [[1, 2], [3.5, 4]]}
+    response = await client.patch(f"/notes/pages/{page_id}", json={"overlay_data": {"strokes": [stroke]}})
+    assert response.status_code == 200
+
+    response = await client.post(f"/notes/pages/{page_id}/ops", json={"base_version": 1, "ops": [
+        {"op": "json_patch", "patch": [{"op": "replace", "path": "/strokes/0/points/0/0", "value": 9}]},
+        {"op": "add_element", "element": {**stroke, "id": "b"}},
+    ]})
+    assert response.status_code == 200, response.text
+
+    strokes = (await client.get(f"/notes/pages/{page_id}")).json()["overlay_data"]["strokes"]
+    assert strokes[0]["points"] == [[9, 2], [3.5, 4]]
+    assert strokes[1]["ts"] == 1.7e16
+
+
+async def test_non_finite_coordinates_are_422_on_both_write_paths(client):
+    page_id = (await _blank_note(client))["pages"][0]["id"]
+    body = '{"overlay_data": {"strokes": [{"id": "a", "points": [[NaN, 1]]}]}}'
+    response = await client.patch(f"/notes/pages/{page_id}", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 422
+    body = '{"base_version": 0, "ops": [{"op": "add_element", "element": {"id": "a", "points": [[Infinity, 1]]}}]}'
+    response = await client.post(f"/notes/pages/{page_id}/ops", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 422
+
+
+async def _list_all(client, limit: int) -> list:
+    ids, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/notes", params=params)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        assert len(body["items"]) <= limit
+        ids += [item["id"] for item in body["items"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+async def test_keyset_pages_cover_every_note_once(client):
+    import models
+    from database import AsyncSessionLocal
+    from routers.notes import _decode_cursor, _encode_cursor
+
+    ids = [(await _blank_note(client, f"Note {n}"))["id"] for n in range(7)]
+    async with AsyncSessionLocal() as db:  # Ties on created_at must be broken by id, not skipped
+        same_time = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        await db.execute(update(models.Note).where(models.Note.id.in_(ids[1:5])).values(created_at=same_time))
+        await db.commit()
+
+    expected = await _list_all(client, limit=100)
+    assert sorted(expected) == sorted(ids)
+    for limit in (1, 2, 3, 7):
+        assert await _list_all(client, limit) == expected
+
+    assert _decode_cursor(_encode_cursor(same_time, ids[3])) == (same_time, ids[3])
+    assert (await client.get("/notes", params={"cursor": "not-a-cursor"})).status_code == 400
+
+
+async def test_note_etag_revalidates_until_a_write(client):
+    note = await _blank_note(client)
+    page_id = note["pages"][0]["id"]
+
+    async def etag_after_check(etag=None):
+        response = await client.get(f"/notes/{note['id']}", headers={"If-None-Match": etag} if etag else {})
+        assert response.headers["ETag"].startswith('W/"')
+        return response.status_code, response.headers["ETag"]
+
+    status, etag = await etag_after_check()
+    assert status == 200
+    assert await etag_after_check(etag) == (304, etag)
+    assert (await etag_after_check(etag.removeprefix("W/")))[0] == 304  # Weak comparison
+
+    response = await client.patch(f"/notes/pages/{page_id}", json={"overlay_data": {"strokes": []}})
+    assert response.status_code == 200
+    status, after_patch = await etag_after_check(etag)
+    assert status == 200 and after_patch != etag
+
+    response = await client.post(f"/notes/pages/{page_id}/ops", json={
+        "base_version": 1, "ops": [{"op": "add_element", "element": {"id": "a", "points": [[1, 2]]}}],
+    })
+    assert response.status_code == 200
+    status, after_ops = await etag_after_check(after_patch)
+    assert status == 200 and after_ops not in (etag, after_patch)
+
+    page = await client.get(f"/notes/pages/{page_id}")
+    assert (await client.get(f"/notes/pages/{page_id}", headers={"If-None-Match": page.headers["ETag"]})).status_code == 304
+
+
+class _LiveSocket:
+    """A WebSocket session on the app, driven over ASGI in the test's event loop (httpx has no WebSockets)."""
+
+    def __init__(self, client, note_id: int):
+        from main import app
+
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "path": f"/notes/{note_id}/live",
+            "raw_path": f"/notes/{note_id}/live".encode(), "root_path": "", "query_string": b"",
+            "headers": [(b"host", b"test"), (b"authorization", client.headers["Authorization"].encode())],
+            "server": ("test", 80), "client": ("127.0.0.1", 1234), "subprotocols": [], "state": {},
+        }
+        self._inbound: asyncio.Queue = asyncio.Queue()
+        self._outbound: asyncio.Queue = asyncio.Queue()
+        self._inbound.put_nowait({"type": "websocket.connect"})
+        self._task = asyncio.create_task(app(scope, self._inbound.get, self._outbound.put))
+
+    async def accepted(self):
+        assert (await self.receive_event())["type"] == "websocket.accept"
+        return self
+
+    async def receive_event(self) -> dict:
+        return await asyncio.wait_for(self._outbound.get(), timeout=5)
+
+    async def receive(self, type: str) -> dict:
+        """The next message of this type, skipping others (presence and the like)."""
+        while True:
+            event = await self.receive_event()
+            assert event["type"] == "websocket.send", event
+            message = json.loads(event["text"])
+            if message["type"] == type:
+                return message
+
+    def send(self, message: dict):
+        self._inbound.put_nowait({"type": "websocket.receive", "text": json.dumps(message)})
+
+    async def close(self):
+        self._inbound.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self._task, timeout=5)
+
+
+async def test_live_ops_reach_other_sessions_and_are_persisted(client):
+    from services import live_hub
+
+    note = await _blank_note(client)
+    page_id = note["pages"][0]["id"]
+    await live_hub.start()
+    try:
+        writer = await _LiveSocket(client, note["id"]).accepted()
+        reader = await _LiveSocket(client, note["id"]).accepted()
+        stroke = {"id": "a", "points": [[1, 2], [3, 4]]}
+        writer.send({"type": "ops", "page_id": page_id, "ops": [{"op": "add_element", "element": stroke}], "seq": 1})
+
+        assert (await writer.receive("ack"))["seq"] == 1
+        broadcast = await reader.receive("ops")
+        assert broadcast["page_id"] == page_id
+        assert [op["element"] for op in broadcast["ops"]] == [stroke]
+
+        await live_hub.flush()
+        for socket in (writer, reader):
+            assert await socket.receive("persisted") == {"type": "persisted", "page_id": page_id, "overlay_version": 1}
+        await writer.close()
+        await reader.close()
+    finally:
+        await live_hub.stop()
+
+    page = (await client.get(f"/notes/pages/{page_id}")).json()
+    assert page["overlay_version"] == 1
+    assert page["overlay_data"]["strokes"] == [stroke]
@@ -0,0 +1,99 @@
+import pytest
+
+from services import overlay, stroke_codec
+from services.overlay import OverlayConflict, OverlayOpError
+
+
+def _doc():
+    return {"strokes": [{"id": "a", "points": [[0, 0], [1, 1]]}, {"id": "b", "points": [[2, 2]]}]}
+
+
+def test_add_and_remove_elements():
+    doc = overlay.apply_ops(_doc(), [
+        {"op": "add_element", "element": {"id": "c", "points": [[3, 3]]}},
+        {"op": "remove_elements", "ids": ["a"]},
+        {"op": "add_element", "collection": "text", "element": {"id": "t", "value": "hi"}},
+    ])
+    assert [stroke["id"] for stroke in doc["strokes"]] == ["b", "c"]
+    assert doc["text"] == [{"id": "t", "value": "hi"}]
+
+
+def test_apply_ops_does_not_touch_its_input():
+    doc = _doc()
+    overlay.apply_ops(doc, [{"op": "json_patch", "patch": [{"op": "remove", "path": "/strokes/0"}]}])
+    assert doc == _doc()
+
+
+def test_json_patch_add_replace_remove():
+    doc = overlay.apply_op(_doc(), {"op": "json_patch", "patch": [
+        {"op": "replace", "path": "/strokes/0/points/1", "value": [5, 5]},
+        {"op": "add", "path": "/strokes/1/points/-", "value": [3, 3]},
+        {"op": "remove", "path": "/strokes/0/points/0"},
+        {"op": "add", "path": "/meta", "value": {"zoom": 2}},
+    ]})
+    assert doc["strokes"][0]["points"] == [[5, 5]]
+    assert doc["strokes"][1]["points"] == [[2, 2], [3, 3]]
+    assert doc["meta"] == {"zoom": 2}
+
+
+def test_json_patch_is_all_or_nothing():
+    doc = _doc()
+    with pytest.raises(OverlayOpError):
+        overlay.apply_op(doc, {"op": "json_patch", "patch": [
+            {"op": "replace", "path": "/strokes/0/id", "value": "changed"},
+            {"op": "remove", "path": "/strokes/7"},
+        ]})
+    assert doc == _doc()
+
+
+def test_failed_test_is_a_conflict():
+    with pytest.raises(OverlayConflict):
+        overlay.check_ops(_doc(), [{"op": "json_patch", "patch": [
+            {"op": "test", "path": "/strokes/0/id", "value": "b"},
+            {"op": "replace", "path": "/strokes/0/id", "value": "z"},
+        ]}])
+    doc = overlay.check_ops(_doc(), [{"op": "json_patch", "patch": [
+        {"op": "test", "path": "/strokes/0/id", "value": "a"},
+        {"op": "replace", "path": "/strokes/0/id", "value": "z"},
+    ]}])
+    assert doc["strokes"][0]["id"] == "z"
+
+
+def test_ops_that_no_longer_apply_are_skipped_or_dropped():
+    ops = [
+        {"op": "json_patch", "patch": [{"op": "remove", "path": "/strokes/0"}]},
+        {"op": "json_patch", "patch": [{"op": "replace", "path": "/strokes/1/id", "value": "gone"}]},  # Only one stroke left
+        {"op": "add_element", "element": {"id": "c"}},
+    ]
+    assert overlay.applicable_ops(_doc(), ops) == [ops[0], ops[2]]
+    assert [stroke["id"] for stroke in overlay.apply_ops(_doc(), ops)["strokes"]] == ["b", "c"]
+
+
+@pytest.mark.parametrize("op", [
+    {"op": "add_element"},
+    {"op": "remove_elements", "ids": "a"},
+    {"op": "json_patch", "patch": [{"op": "move", "path": "/a", "from": "/b"}]},
+    {"op": "json_patch", "patch": [{"op": "replace", "path": "/a"}]},
+    {"op": "json_patch", "patch": [{"op": "remove", "path": "no-slash"}]},
+    {"op": "rotate"},
+])
+def test_malformed_ops_are_rejected_before_they_are_stored(op):
+    with pytest.raises(OverlayOpError):
+        overlay.validate_op(op)
+
+
+def test_needs_document_only_for_json_patch():
+    assert not overlay.needs_document([{"op": "add_element", "element": {}}, {"op": "remove_elements", "ids": []}])
+    assert overlay.needs_document([{"op": "json_patch", "patch": []}])
+
+
+def test_ops_address_packed_strokes_in_their_plain_form():
+    stored = stroke_codec.pack_overlay(_doc())
+    assert stroke_codec.format_of(stored) == stroke_codec.FORMAT_PACKED
+    ops = [{"op": "json_patch", "patch": [
+        {"op": "test", "path": "/strokes/0/points/1", "value": [1, 1]},
+        {"op": "replace", "path": "/strokes/0/points/0/0", "value": 7},
+    ]}]
+    doc = overlay.check_ops(stored, ops)
+    assert doc["strokes"][0]["points"] == [[7, 0], [1, 1]]
+    assert overlay.apply_ops(stored, ops) == doc
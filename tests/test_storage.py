@@ -0,0 +1,94 @@
+import pytest
+
+import security
+from services.storage import LOCAL_UPLOAD_URL_PREFIX, LocalStorage, StorageError
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(root=str(tmp_path))
+
+
+def _token(upload) -> str:
+    assert upload.url.startswith(LOCAL_UPLOAD_URL_PREFIX)
+    return upload.url[len(LOCAL_UPLOAD_URL_PREFIX):]
+
+
+def test_upload_token_round_trips(storage):
+    upload = storage.presign_upload("incoming/1/a.pdf", "application/pdf")
+    assert storage.verify_upload(_token(upload)) == ("incoming/1/a.pdf", "application/pdf")
+
+
+def test_tampered_token_is_rejected(storage):
+    token = _token(storage.presign_upload("incoming/1/a.pdf", "application/pdf"))
+    forged = token[:-2] + ("AA" if not token.endswith("AA") else "BB")
+    with pytest.raises(StorageError, match="Invalid"):
+        storage.verify_upload(forged)
+
+
+def test_token_signed_with_another_secret_is_rejected(storage, monkeypatch):
+    token = _token(storage.presign_upload("incoming/1/a.pdf", "application/pdf"))
+    monkeypatch.setattr(security, "SECRET_KEY", "another-secret")
+    with pytest.raises(StorageError, match="Invalid"):
+        storage.verify_upload(token)
+
+
+def test_tokens_need_a_secret(storage, monkeypatch):
+    monkeypatch.setattr(security, "SECRET_KEY", None)
+    with pytest.raises(RuntimeError, match="SECRET_KEY"):
+        storage.presign_upload("incoming/1/a.pdf", "application/pdf")
+
+
+def test_expired_token_is_rejected(storage):
+    token = _token(storage.presign_upload("incoming/1/a.pdf", "application/pdf", expires=-1))
+    with pytest.raises(StorageError, match="expired"):
+        storage.verify_upload(token)
+
+
+@pytest.mark.parametrize("key", ["../outside.pdf", "/etc/passwd", "a/../../b", "."])
+def test_keys_stay_inside_the_root(storage, key):
+    with pytest.raises(StorageError):
+        storage.path(key)
+
+
+# --- S3 (against moto's in-process S3, the same API MinIO speaks) ---
+@pytest.fixture
+def s3(monkeypatch):
+    moto = pytest.importorskip("moto")
+    import boto3
+    from services.storage import S3Storage
+
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="notes")
+        yield S3Storage(bucket="notes", region="us-east-1", public_url="https://cdn.test")
+
+
+def test_s3_put_get_and_delete(s3):
+    s3.put_bytes("cas/ab/x/page_0001.png", b"png")
+    s3.put_bytes("cas/ab/x/page_0002.png", b"png2")
+    s3.put_bytes("note_1_1.png", b"own")
+    assert s3.get_bytes("cas/ab/x/page_0001.png") == b"png"
+    assert s3.size("cas/ab/x/page_0002.png") == 4
+    assert s3.url("note_1_1.png") == "https://cdn.test/note_1_1.png"
+    assert s3.key_for_url("https://cdn.test/note_1_1.png") == "note_1_1.png"
+
+    s3.delete_prefix("cas/ab/x")
+    assert not s3.exists("cas/ab/x/page_0001.png")
+    s3.delete(["note_1_1.png", "never-existed.png"])
+    assert not s3.exists("note_1_1.png")
+    with pytest.raises(StorageError):
+        s3.get_bytes("note_1_1.png")
+
+
+def test_s3_presigned_upload(s3):
+    import requests  # Installed with moto; botocore's mocked transport only sees requests it sends
+
+    upload = s3.presign_upload("incoming/1/a.pdf", "application/pdf", expires=60)
+    assert (upload.method, upload.headers) == ("PUT", {"Content-Type": "application/pdf"})
+    assert "X-Amz-Signature=" in upload.url
+
+    response = requests.put(upload.url, data=b"%PDF-1.4", headers=upload.headers)
+    assert response.status_code == 200
+    assert s3.get_bytes("incoming/1/a.pdf") == b"%PDF-1.4"
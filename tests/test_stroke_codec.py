@@ -0,0 +1,141 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from services import overlay, stroke_codec
+
+
+@pytest.fixture(params=["numpy", "array"])
+def codec(request, monkeypatch):
+    if request.param == "array":
+        monkeypatch.setattr(stroke_codec, "_np", None)
+    return stroke_codec
+
+
+def _round_trip(codec, points):
+    packed = codec.pack_points(points)
+    assert packed is not None
+    return packed, codec.unpack_points(packed)
+
+
+def test_int_coordinates_come_back_as_ints(codec):
+    points = [[10, 20], [11, 25], [-3, 40000]]
+    packed, unpacked = _round_trip(codec, points)
+    assert packed["ints"] is True
+    assert json.dumps(unpacked) == json.dumps(points)
+
+
+def test_float_coordinates_keep_their_type(codec):
+    points = [[1.5, 2.0], [1.25, -0.001]]
+    packed, unpacked = _round_trip(codec, points)
+    assert "ints" not in packed
+    assert json.dumps(unpacked) == json.dumps(points)
+
+
+def test_mixed_ints_and_fractions(codec):
+    points = [[100, 200.5], [101, 199.25]]
+    _, unpacked = _round_trip(codec, points)
+    assert json.dumps(unpacked) == json.dumps(points)
+
+
+@pytest.mark.parametrize("points", [
+    [[0.0001, 1.0]],        # Finer than 1/scale
+    [[2.0, 3], [4, 5]],     # A whole float next to ints would come back as an int
+    [[0, 0], [1e6, 1e6]],   # A jump that does not fit int32
+])
+def test_strokes_that_would_change_stay_plain(codec, points):
+    assert codec.pack_points(points) is None
+    overlay_data = {"strokes": [{"id": "a", "points": points}]}
+    assert codec.pack_overlay(overlay_data) == overlay_data
+
+
+def test_numpy_and_array_write_the_same_bytes(monkeypatch):
+    points = [[412.345, 80.21, 0.5], [413.0, 81.5, 0.55], [400.125, 79.0, 0.6]]
+    with_numpy = stroke_codec.pack_points(points)
+    monkeypatch.setattr(stroke_codec, "_np", None)
+    assert stroke_codec.pack_points(points) == with_numpy
+
+
+def test_numpy_is_imported_on_first_use():
+    script = (
+        "import sys; from services import stroke_codec; "
+        "assert 'numpy' not in sys.modules and stroke_codec._np is False; "
+        "stroke_codec.pack_points([[1, 2]]); "
+        "assert stroke_codec._np is sys.modules['numpy']"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+
+
+def test_falls_back_to_array_without_numpy(monkeypatch):
+    points = [[412.345, 80.21, 0.5], [413.0, 81.5, 0.55]]
+    with_numpy = stroke_codec.pack_points(points)
+    monkeypatch.setattr(stroke_codec, "_np", False)
+    monkeypatch.setitem(sys.modules, "numpy", None)  # Makes `import numpy` raise ImportError
+    assert stroke_codec.pack_points(points) == with_numpy
+    assert stroke_codec._np is None
+    assert json.dumps(stroke_codec.unpack_points(with_numpy)) == json.dumps(points)
+
+
+def test_packs_written_before_the_ints_flag_decode_as_floats(codec):
+    packed = codec.pack_points([[1, 2], [3, 4]])
+    del packed["ints"]
+    assert json.dumps(codec.unpack_points(packed)) == "[[1.0, 2.0], [3.0, 4.0]]"
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), -float("inf"), 1e13, -(2 ** 60)])
+def test_bad_coordinates_are_rejected(codec, value):
+    overlay_data = {"strokes": [{"id": "a", "points": [[1, 2], [value, 3]]}]}
+    with pytest.raises(stroke_codec.StrokeCodecError):
+        codec.for_storage(overlay_data)
+    with pytest.raises(overlay.OverlayOpError):
+        overlay.validate_op({"op": "add_element", "element": overlay_data["strokes"][0]})
+    with pytest.raises(overlay.OverlayOpError):
+        overlay.validate_op({"op": "json_patch", "patch": [{"op": "replace", "path": "/strokes/0/points/0/0", "value": value}]})
+
+
+def test_only_coordinates_are_range_checked():
+    big = 1.7e16
+    element = {"id": "a", "ts": big, "points": [[1, 2]]}
+    stroke_codec.for_storage({"strokes": [element], "meta": {"ts": big}})
+    overlay.validate_op({"op": "add_element", "element": element})
+    overlay.validate_op({"op": "add_element", "collection": "shapes", "element": {"points": [[big, 0]]}})
+    overlay.validate_op({"op": "json_patch", "patch": [
+        {"op": "add", "path": "/meta", "value": {"ts": big}},
+        {"op": "replace", "path": "/strokes/0/ts", "value": big},
+        {"op": "test", "path": "/strokes/0/points/0/0", "value": big},
+    ]})
+
+
+@pytest.mark.parametrize("path, value", [
+    ("", {"strokes": [{"points": [[1e17, 0]]}]}),
+    ("/strokes", [{"points": [[1e17, 0]]}]),
+    ("/strokes/0", {"points": [[1e17, 0]]}),
+    ("/strokes/0/points", [[1e17, 0]]),
+    ("/strokes/0/points/-", [1e17, 0]),
+])
+def test_patch_values_are_checked_wherever_they_land(path, value):
+    with pytest.raises(overlay.OverlayOpError):
+        overlay.validate_op({"op": "json_patch", "patch": [{"op": "add", "path": path, "value": value}]})
+
+
+def test_malformed_packed_points_are_rejected(codec):
+    packed = codec.pack_points([[1, 2], [3, 4]])
+    with pytest.raises(stroke_codec.StrokeCodecError):
+        codec.check_points({**packed, "count": 3})
+    with pytest.raises(stroke_codec.StrokeCodecError):
+        codec.check_points({**packed, "ints": "yes"})
+
+
+def test_overlay_round_trip_leaves_other_content_alone(codec, monkeypatch):
+    monkeypatch.setattr(stroke_codec, "STROKE_STORAGE_FORMAT", stroke_codec.FORMAT_PACKED)
+    overlay_data = {
+        "strokes": [{"id": "a", "points": [[1, 2], [3.5, 4]]}, {"id": "b", "points": [{"x": 1}]}],
+        "text": [{"id": "t", "value": "hi"}],
+    }
+    stored = codec.for_storage(overlay_data)
+    assert codec.format_of(stored) == stroke_codec.FORMAT_PACKED
+    assert stored["strokes"][1] is overlay_data["strokes"][1]
+    assert json.dumps(codec.for_client(stored, stroke_codec.FORMAT_JSON)) == json.dumps(overlay_data)
@@ -0,0 +1,48 @@
+import time
+
+import pytest
+
+from services.user_cache import UserCache, UserSnapshot
+
+ALICE = UserSnapshot(id=1, email="alice@test.local")
+BOB = UserSnapshot(id=2, email="bob@test.local")
+
+
+def test_hit_miss_and_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = UserCache(maxsize=10, ttl=5)
+    assert cache.get("1") is None
+    cache.set("1", ALICE)
+    assert cache.get("1") is ALICE
+    now[0] += 6
+    assert cache.get("1") is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 2}
+
+
+def test_invalidate_user_drops_every_subject():
+    cache = UserCache(maxsize=10, ttl=60)
+    cache.set("1", ALICE)
+    cache.set("alice@test.local", ALICE)  # Legacy email-subject token
+    cache.set("2", BOB)
+
+    cache.invalidate_user(1)
+    assert cache.get("1") is None
+    assert cache.get("alice@test.local") is None
+    assert cache.get("2") is BOB
+    assert cache._keys_by_user == {2: {"2"}}
+
+
+@pytest.mark.parametrize("maxsize", [1, 2])
+def test_eviction_keeps_index_in_step(maxsize):
+    cache = UserCache(maxsize=maxsize, ttl=60)
+    cache.set("1", ALICE)
+    cache.set("2", BOB)
+    cache.set("x", BOB)
+    assert len(cache._entries) == maxsize
+    assert sum(len(keys) for keys in cache._keys_by_user.values()) == maxsize
+
+    cache.set("x", ALICE)  # Re-pointed key leaves its old user's index
+    assert "x" not in cache._keys_by_user.get(2, set())
+    cache.invalidate_user(2)
+    assert cache.get("x") is ALICE
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+import models
+from database import AsyncSessionLocal
+from services.write_buffer import BufferedOverlay, OverlayWriteBuffer
+
+pytestmark = pytest.mark.anyio
+
+
+async def _page() -> int:
+    async with AsyncSessionLocal() as db:
+        user = models.User(email="buffer@test.local", hashed_password="x")
+        db.add(user)
+        await db.flush()
+        note = models.Note(title="Buffered", owner_id=user.id)
+        db.add(note)
+        await db.flush()
+        page = models.Page(note_id=note.id, page_number=1, overlay_data={}, overlay_version=3, overlay_base_version=3)
+        db.add(page)
+        await db.commit()
+        return page.id
+
+
+async def _stored(page_id: int):
+    async with AsyncSessionLocal() as db:
+        page = await db.get(models.Page, page_id)
+        await db.refresh(page, ["overlay_data"])
+        return page.overlay_version, page.overlay_data
+
+
+def _entry(page_id: int, data: dict, version: int) -> BufferedOverlay:
+    return BufferedOverlay(
+        page_id=page_id, owner_id=1, note_id=1, page_number=1, background_type="plain",
+        background_url=None, renditions=None, overlay_data=data, overlay_version=version,
+    )
+
+
+async def test_merged_saves_share_a_version(database):
+    page_id = await _page()
+    buffer = OverlayWriteBuffer()
+    first = await buffer.put(_entry(page_id, {"n": 1}, 4))
+    second = await buffer.put(_entry(page_id, {"n": 2}, 4))
+    assert first.overlay_version == second.overlay_version == 4
+    assert second.revision > first.revision
+
+    await buffer.flush()
+    assert await _stored(page_id) == (4, {"n": 2})
+    assert buffer.get(page_id) is None
+
+
+async def test_failed_flush_keeps_promised_version(database):
+    page_id = await _page()
+    buffer = OverlayWriteBuffer()
+    await buffer.put(_entry(page_id, {"n": 1}, 4))
+
+    writing, fail = asyncio.Event(), asyncio.Event()
+    real_write = buffer._write
+
+    async def broken_write(entries):
+        writing.set()
+        await fail.wait()
+        raise ConnectionError("database went away")
+
+    buffer._write = broken_write
+    flush = asyncio.create_task(buffer.flush())
+    await writing.wait()
+    # Saved while the first entry is being written: promised the version after it
+    newer = await buffer.put(_entry(page_id, {"n": 2}, 4))
+    assert newer.overlay_version == 5
+    fail.set()
+    with pytest.raises(ConnectionError):
+        await flush
+
+    buffer._write = real_write
+    assert buffer.get(page_id).overlay_version == 5
+    await buffer.flush()
+    assert await _stored(page_id) == (5, {"n": 2})  # What the client was told, not 4
+
+
+async def test_flush_stays_ahead_of_other_writers(database):
+    page_id = await _page()
+    buffer = OverlayWriteBuffer()
+    await buffer.put(_entry(page_id, {"n": 1}, 4))
+    async with AsyncSessionLocal() as db:
+        page = await db.get(models.Page, page_id)
+        page.overlay_version = 6
+        await db.commit()
+
+    await buffer.flush()
+    assert (await _stored(page_id))[0] == 7